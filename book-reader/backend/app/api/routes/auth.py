@@ -1,9 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from app.core.database import get_db
-from app.core.auth import get_current_user
+from app.core.database import DbSession, get_db
+from app.core.auth import auth_cache, get_current_user
 from app.models.user import User
+from app.repositories.user_repository import AsyncUserRepository
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
@@ -19,12 +19,27 @@ class UserResponse(BaseModel):
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
+async def get_me(
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    # Из кеша авторизации приходит только id, остальные поля читаем явно
+    return await AsyncUserRepository(db).get(current_user.id)
 
 
 @router.post("/telegram", response_model=UserResponse)
 async def telegram_auth(
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    return await AsyncUserRepository(db).get(current_user.id)
+
+
+@router.get("/cache-stats")
+async def auth_cache_stats(
     current_user: User = Depends(get_current_user)
 ):
-    return current_user
+    """
+    Статистика кеша проверенных initData: попадания, промахи, записи
+    """
+    return auth_cache.stats()
@@ -1,13 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from datetime import datetime
 from typing import List, Optional
 
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import DbSession, get_db
+from app.core.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, page_limit, parse_fields, project, split_page
 from app.core.auth import get_current_user
 from app.models.user import User
-from app.repositories.bookmark_repository import BookmarkRepository
-from app.repositories.user_book_repository import UserBookRepository
+from app.repositories.bookmark_repository import AsyncBookmarkRepository
+from app.repositories.user_book_repository import AsyncUserBookRepository
 
 router = APIRouter(prefix="/api/bookmarks", tags=["bookmarks"])
 
@@ -32,23 +35,50 @@ class BookmarkResponse(BaseModel):
         from_attributes = True
 
 
+class BookmarkBatchResult(BaseModel):
+    index: int
+    status: int
+    bookmark: Optional[BookmarkResponse] = None
+    detail: Optional[str] = None
+
+
 @router.get("/", response_model=List[BookmarkResponse])
 async def get_bookmarks(
+    response: Response,
     user_book_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=settings.page_max_limit),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    bookmark_repo = BookmarkRepository(db)
+    """
+    Закладки книги по позиции или все закладки пользователя, новые первыми.
+    Курсор следующей страницы - в заголовке X-Next-Cursor.
+    """
+    names = parse_fields(fields, BookmarkResponse)
+    limit = page_limit(limit, cursor)
+    fetch = limit + 1 if limit is not None else None
+    bookmark_repo = AsyncBookmarkRepository(db)
     
     if user_book_id:
-        user_book_repo = UserBookRepository(db)
-        user_book = user_book_repo.get(user_book_id)
+        user_book_repo = AsyncUserBookRepository(db)
+        user_book = await user_book_repo.get(user_book_id)
         if not user_book or user_book.user_id != current_user.id:
             raise HTTPException(status_code=404, detail="User book not found")
-        bookmarks = bookmark_repo.get_by_user_book(user_book_id)
+        after = decode_cursor(cursor, int, int)
+        bookmarks = await bookmark_repo.get_by_user_book(user_book_id, fetch, after, names)
+        key = lambda bookmark: (bookmark.position, bookmark.id)
     else:
-        bookmarks = bookmark_repo.get_all_user_bookmarks(current_user.id)
+        after = decode_cursor(cursor, datetime, int)
+        bookmarks = await bookmark_repo.get_all_user_bookmarks(current_user.id, fetch, after, names)
+        key = lambda bookmark: (bookmark.created_at, bookmark.id)
     
+    bookmarks, has_more = split_page(bookmarks, limit)
+    headers = {NEXT_CURSOR_HEADER: encode_cursor(*key(bookmarks[-1]))} if has_more else {}
+    if names:
+        return ORJSONResponse([project(bookmark, names, BookmarkResponse) for bookmark in bookmarks], headers=headers)
+    response.headers.update(headers)
     return bookmarks
 
 
@@ -56,17 +86,18 @@ async def get_bookmarks(
 async def create_bookmark(
     data: BookmarkCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    user_book_repo = UserBookRepository(db)
-    user_book = user_book_repo.get(data.user_book_id)
+    user_book_repo = AsyncUserBookRepository(db)
+    user_book = await user_book_repo.get(data.user_book_id)
     
     if not user_book or user_book.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="User book not found")
     
-    bookmark_repo = BookmarkRepository(db)
-    bookmark = bookmark_repo.create({
+    bookmark_repo = AsyncBookmarkRepository(db)
+    bookmark = await bookmark_repo.create({
         "user_book_id": data.user_book_id,
+        "user_id": current_user.id,
         "position": data.position,
         "comment": data.comment
     })
@@ -74,26 +105,57 @@ async def create_bookmark(
     return bookmark
 
 
+@router.post("/batch", response_model=List[BookmarkBatchResult])
+async def create_bookmarks_batch(
+    items: List[BookmarkCreate],
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    """
+    Пакетное создание закладок, например при синхронизации офлайн-клиента.
+    Результат возвращается по каждой записи в порядке запроса.
+    """
+    if len(items) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"Too many items, max {settings.batch_max_items}")
+
+    user_book_repo = AsyncUserBookRepository(db)
+    owned = await user_book_repo.get_owned_ids(current_user.id, (item.user_book_id for item in items))
+
+    accepted = [index for index, item in enumerate(items) if item.user_book_id in owned]
+    bookmark_repo = AsyncBookmarkRepository(db)
+    bookmarks = await bookmark_repo.create_many(
+        [{**items[index].model_dump(), "user_id": current_user.id} for index in accepted]
+    ) if accepted else []
+    created = dict(zip(accepted, bookmarks))
+
+    return [
+        BookmarkBatchResult(index=index, status=201, bookmark=BookmarkResponse.model_validate(created[index]))
+        if index in created
+        else BookmarkBatchResult(index=index, status=404, detail="User book not found")
+        for index in range(len(items))
+    ]
+
+
 @router.put("/{bookmark_id}", response_model=BookmarkResponse)
 async def update_bookmark(
     bookmark_id: int,
     data: BookmarkUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    bookmark_repo = BookmarkRepository(db)
-    bookmark = bookmark_repo.get(bookmark_id)
+    bookmark_repo = AsyncBookmarkRepository(db)
+    bookmark = await bookmark_repo.get(bookmark_id)
     
     if not bookmark:
         raise HTTPException(status_code=404, detail="Bookmark not found")
     
-    user_book_repo = UserBookRepository(db)
-    user_book = user_book_repo.get(bookmark.user_book_id)
+    user_book_repo = AsyncUserBookRepository(db)
+    user_book = await user_book_repo.get(bookmark.user_book_id)
     
     if not user_book or user_book.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    updated = bookmark_repo.update(bookmark_id, {"comment": data.comment})
+    updated = await bookmark_repo.update(bookmark_id, {"comment": data.comment})
     return updated
 
 
@@ -101,19 +163,19 @@ async def update_bookmark(
 async def delete_bookmark(
     bookmark_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    bookmark_repo = BookmarkRepository(db)
-    bookmark = bookmark_repo.get(bookmark_id)
+    bookmark_repo = AsyncBookmarkRepository(db)
+    bookmark = await bookmark_repo.get(bookmark_id)
     
     if not bookmark:
         raise HTTPException(status_code=404, detail="Bookmark not found")
     
-    user_book_repo = UserBookRepository(db)
-    user_book = user_book_repo.get(bookmark.user_book_id)
+    user_book_repo = AsyncUserBookRepository(db)
+    user_book = await user_book_repo.get(bookmark.user_book_id)
     
     if not user_book or user_book.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    bookmark_repo.delete(bookmark_id)
+    await bookmark_repo.delete(bookmark_id)
     return {"message": "Bookmark deleted"}
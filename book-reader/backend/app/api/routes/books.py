@@ -1,26 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Header, Response
+from fastapi.responses import FileResponse, ORJSONResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
+import hashlib
 import os
-import shutil
-from pathlib import Path
 from datetime import datetime
 
-from app.core.database import get_db
-from app.core.auth import get_current_user
+from app.core.config import settings
+from app.core.database import DbSession, get_db, run_in_session
+from app.core.auth import get_current_user, issue_media_token, verify_media_token
+from app.core.conditional import conditional_headers, etag_matches, make_etag
+from app.core.executors import cpu_executor, io_executor
+from app.core.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, page_limit, parse_fields, project, split_fields, split_page
 from app.models.user import User
 from app.models.book import Book
 from app.models.user_book import UserBook
-from app.repositories.book_repository import BookRepository
-from app.repositories.user_book_repository import UserBookRepository
-from app.services.fb2_parser import FB2Parser
+from app.repositories.book_repository import AsyncBookRepository, BookRepository
+from app.repositories.user_book_repository import AsyncUserBookRepository, UserBookRepository
+from app.repositories.user_repository import AsyncUserRepository
+from app.services.book_ingest import (
+    BookFormatError, BookTooLargeError, BookWriter, merge_duplicate_book, parse_book_file, release_book, store_parsed_book,
+)
+from app.services.chapter_store import ChapterStore, chapter_store, compute_file_hash
+from app.services.cover_store import cover_store
+from app.services.image_store import ImageStore, image_store
+from app.services.position_buffer import position_buffer
+from app.services.position_index import position_index
+from app.services.spritz_store import SPRITZ_MEDIA_TYPE, SpritzStore, spritz_store
+from app.services.text_index import text_index
 
 router = APIRouter(prefix="/api/books", tags=["books"])
 
-# Папка для хранения книг
-BOOKS_DIR = Path("data/books")
-BOOKS_DIR.mkdir(parents=True, exist_ok=True)
+BOOK_EXTENSIONS = ('.fb2', '.fb2.zip', '.fb2.gz')
 
 
 class BookResponse(BaseModel):
@@ -54,99 +67,254 @@ class BookContentResponse(BaseModel):
     total_chapters: int
 
 
+class ChapterInfo(BaseModel):
+    index: int
+    title: str
+    words: int
+    size: int
+
+
+class BookTocResponse(BaseModel):
+    book_id: int
+    total_chapters: int
+    total_words: int
+    chapters: List[ChapterInfo]
+
+
+class BookSearchHit(BaseModel):
+    chapter_index: int
+    paragraph_index: int
+    word_offset: int
+    snippet: str
+
+
+class BookPosition(BaseModel):
+    position: int
+    chapter: int
+    paragraph: int
+    word: int
+    total_words: int
+    progress_percent: float
+
+
+class ChapterContent(BaseModel):
+    index: int
+    title: str
+    # Блоки главы: [тип, текст] или [тип, текст, разметка], формат - в chapter_blocks
+    blocks: List[list]
+
+
+class ChapterWindowResponse(BaseModel):
+    chapters: List[ChapterContent]
+    current_chapter: int
+    total_chapters: int
+
+
+class MediaTokenResponse(BaseModel):
+    # Параметр token для ссылок на обложки и иллюстрации
+    token: str
+    expires: int
+
+
+async def _library_headers(db: DbSession, user_id: int, if_none_match: Optional[str]) -> Dict[str, str]:
+    """
+    ETag по версии библиотеки и номеру последней несохраненной позиции
+    (ответы подставляют их из буфера); 304, если ничего не менялось
+    """
+    buffer_version = position_buffer.version(user_id)
+    library_version, _ = await AsyncUserRepository(db).get_versions(user_id)
+    return conditional_headers(make_etag("library", user_id, library_version, buffer_version), if_none_match)
+
+
+def _content_etag(file_hash: str) -> str:
+    return make_etag(file_hash, ChapterStore.VERSION)
+
+
+def _spritz_etag(file_hash: str) -> str:
+    return make_etag(file_hash, "spritz", SpritzStore.VERSION)
+
+
+async def _check_content_etag(
+    db: DbSession,
+    user_id: int,
+    book_id: int,
+    if_none_match: Optional[str],
+    etag: Callable[[str], str] = _content_etag
+) -> None:
+    """304 до чтения оглавления и глав, если у клиента тот же текст книги"""
+    if not if_none_match:
+        return
+    file_hash = await AsyncUserBookRepository(db).get_book_hash(user_id, book_id)
+    if file_hash:
+        conditional_headers(etag(file_hash), if_none_match)
+
+
+async def _list_user_books(
+    db: DbSession,
+    user_id: int,
+    status: Optional[str],
+    limit: Optional[int],
+    cursor: Optional[str],
+    fields: Optional[str],
+    if_none_match: Optional[str],
+    response: Response
+):
+    """
+    Страница книг пользователя: курсор следующей страницы в заголовке X-Next-Cursor,
+    с fields= в ответе и в запросе к БД только выбранные поля
+    """
+    headers = await _library_headers(db, user_id, if_none_match)
+    names = parse_fields(fields, UserBookResponse)
+    columns, book_columns = split_fields(names, "book") if names else (None, None)
+    after = decode_cursor(cursor, int)
+    limit = page_limit(limit, cursor)
+
+    user_book_repo = AsyncUserBookRepository(db)
+    user_books = await user_book_repo.get_user_books(
+        user_id,
+        status,
+        limit=limit + 1 if limit is not None else None,
+        after_id=after[0] if after else None,
+        columns=columns,
+        book_columns=book_columns
+    )
+    user_books, has_more = split_page(user_books, limit)
+    user_books = [position_buffer.overlay(user_book) for user_book in user_books]
+
+    if has_more:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(user_books[-1].id)
+    if names:
+        return ORJSONResponse([project(user_book, names, UserBookResponse) for user_book in user_books], headers=headers)
+    response.headers.update(headers)
+    return user_books
+
+
 @router.get("/", response_model=List[UserBookResponse])
 async def get_user_books(
+    response: Response,
     status: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=settings.page_max_limit),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    user_book_repo = UserBookRepository(db)
-    user_books = user_book_repo.get_user_books(current_user.id, status)
-    return user_books
+    return await _list_user_books(db, current_user.id, status, limit, cursor, fields, if_none_match, response)
 
 
 @router.get("/reading", response_model=List[UserBookResponse])
 async def get_reading_books(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=settings.page_max_limit),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    user_book_repo = UserBookRepository(db)
-    user_books = user_book_repo.get_user_books(current_user.id, status="reading")
-    return user_books
+    return await _list_user_books(db, current_user.id, "reading", limit, cursor, fields, if_none_match, response)
+
+
+@router.get("/search", response_model=List[UserBookResponse])
+async def search_user_books(
+    q: str = Query(..., min_length=1, description="Поисковый запрос"),
+    limit: int = Query(20, ge=1, le=settings.page_max_limit),
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    """
+    Поиск по своей библиотеке: название, автор и аннотация,
+    по убыванию релевантности
+    """
+    user_book_repo = AsyncUserBookRepository(db)
+    user_books = await user_book_repo.search(current_user.id, q, limit)
+    return [position_buffer.overlay(user_book) for user_book in user_books]
+
+
+@router.get("/media-token", response_model=MediaTokenResponse)
+async def get_media_token(current_user: User = Depends(get_current_user)):
+    """
+    Подпись для ссылок на обложки и иллюстрации: <img> не передает
+    заголовок Authorization, поэтому пользователь передается в параметре token
+    """
+    return issue_media_token(current_user.id)
+
+
+async def _media_book(db: DbSession, book_id: int, token: str) -> Optional[Book]:
+    """Книга из библиотеки владельца токена, None - если ее там нет"""
+    user_id = verify_media_token(token)
+    user_book = await AsyncUserBookRepository(db).get_by_user_and_book(user_id, book_id)
+    return user_book.book if user_book else None
 
 
 @router.post("/", response_model=UserBookResponse)
 async def add_book(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    if not file.filename.endswith('.fb2'):
+    if not file.filename.endswith(BOOK_EXTENSIONS):
         raise HTTPException(status_code=400, detail="Only FB2 files are supported")
     
+    if file.size is not None and file.size > settings.max_book_size:
+        raise HTTPException(status_code=413, detail="Файл слишком большой")
+    
+    writer = BookWriter()
+    
     try:
-        # Генерируем уникальное имя файла
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        safe_filename = f"{timestamp}_{file.filename}"
-        file_path = BOOKS_DIR / safe_filename
-        
-        # Сохраняем файл на диск
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Парсим книгу
-        parser = FB2Parser(str(file_path))
-        parsed_data = parser.parse()
-        
-        # Сохраняем информацию в БД (без содержимого файла)
-        book_repo = BookRepository(db)
-        book = book_repo.create({
-            "title": parsed_data["title"],
-            "author": parsed_data["author"],
-            "file_path": str(file_path),
-            "file_name": file.filename,
-            "total_pages": parsed_data["total_pages"]
-        })
+        # Пишем файл потоком: распаковка, проверка формата и хеш по ходу записи
+        await io_executor.run(writer.consume, file.file)
+        file_hash = await io_executor.run(writer.finish)
         
-        user_book_repo = UserBookRepository(db)
-        user_book = user_book_repo.create({
-            "user_id": current_user.id,
-            "book_id": book.id,
-            "status": "planned"
-        })
+        # Такой файл уже загружали: парсить заново не нужно
+        book = await AsyncBookRepository(db).get_by_hash(file_hash)
+        if book is None:
+            parsed_data = await cpu_executor.run(parse_book_file, str(writer.path))
+            book = await io_executor.run(
+                run_in_session, store_parsed_book, parsed_data, str(writer.path), file_hash, file.filename
+            )
         
-        return user_book
+        user_book_repo = AsyncUserBookRepository(db)
+        user_book, created = await user_book_repo.get_or_create(current_user.id, book.id)
+        if created:
+            # В ответе нужна книга, а ленивая загрузка связи в async режиме недоступна
+            user_book = await user_book_repo.get_by_user_and_book(current_user.id, book.id)
+        return position_buffer.overlay(user_book)
+    except BookTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except BookFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
-        # Если что-то пошло не так, удаляем файл
-        if file_path.exists():
-            os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"Error processing book: {str(e)}")
+    finally:
+        # Если файл не перенесен в хранилище, удаляем его
+        await io_executor.run(writer.discard)
 
 
 @router.get("/{book_id}", response_model=UserBookResponse)
 async def get_book(
     book_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    user_book_repo = UserBookRepository(db)
-    user_book = user_book_repo.get_by_user_and_book(current_user.id, book_id)
+    response.headers.update(await _library_headers(db, current_user.id, if_none_match))
+    user_book_repo = AsyncUserBookRepository(db)
+    user_book = await user_book_repo.get_by_user_and_book(current_user.id, book_id)
     
     if not user_book:
         raise HTTPException(status_code=404, detail="Book not found")
     
-    return user_book
+    return position_buffer.overlay(user_book)
 
 
-@router.get("/{book_id}/content", response_model=BookContentResponse)
-async def get_book_content(
-    book_id: int,
-    chapter: int = 0,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
+def _load_book_index(db: Session, book_id: int, user_id: int):
     user_book_repo = UserBookRepository(db)
-    user_book = user_book_repo.get_by_user_and_book(current_user.id, book_id)
+    user_book = user_book_repo.get_by_user_and_book(user_id, book_id)
     
     if not user_book:
         raise HTTPException(status_code=404, detail="Book not found")
@@ -155,10 +323,71 @@ async def get_book_content(
         raise HTTPException(status_code=404, detail="Book file not found")
     
     try:
-        # Читаем напрямую из файла
-        parser = FB2Parser(user_book.book.file_path)
-        parsed_data = parser.parse()
-        chapters = parsed_data["chapters"]
+        book = user_book.book
+        index = chapter_store.load_index(book.id, book.file_hash) if book.file_hash else None
+        return book, index
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading book: {str(e)}")
+
+
+def _store_book_index(db: Session, book_id: int, file_hash: str, parsed_data: Dict):
+    book_repo = BookRepository(db)
+    book = book_repo.get(book_id)
+    keeper = book_repo.get_by_hash(file_hash)
+    if keeper is None or keeper.id == book.id:
+        try:
+            return book, chapter_store.save_parsed(book, book_repo, file_hash, parsed_data)
+        except IntegrityError:
+            # Хеш параллельно получила другая запись с тем же файлом
+            db.rollback()
+            keeper = book_repo.get_by_hash(file_hash)
+            if keeper is None:
+                raise
+
+    # Старая запись без хеша оказалась копией уже известной книги: сводим их в одну
+    for user_book_id in merge_duplicate_book(db, book, keeper):
+        position_buffer.discard(user_book_id)
+    index = chapter_store.load_index(keeper.id, file_hash)
+    if index is None:
+        index = chapter_store.save_parsed(keeper, book_repo, file_hash, parsed_data)
+    return keeper, index
+
+
+async def _open_book(book_id: int, user_id: int):
+    """
+    Книга пользователя и оглавление из хранилища глав.
+    Книги, загруженные до появления хранилища, разбираются при первом обращении:
+    хеш и парсинг - в пуле процессов, запись хранилища и БД - в пуле ввода-вывода.
+    """
+    book, index = await io_executor.run(run_in_session, _load_book_index, book_id, user_id)
+    if index is not None:
+        return book, index
+
+    try:
+        file_hash = book.file_hash or await cpu_executor.run(compute_file_hash, book.file_path)
+        parsed_data = await cpu_executor.run(parse_book_file, book.file_path)
+        return await io_executor.run(run_in_session, _store_book_index, book.id, file_hash, parsed_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading book: {str(e)}")
+
+
+@router.get("/{book_id}/content", response_model=BookContentResponse)
+async def get_book_content(
+    book_id: int,
+    response: Response,
+    chapter: int = 0,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    await _check_content_etag(db, current_user.id, book_id, if_none_match)
+    book, _ = await _open_book(book_id, current_user.id)
+    response.headers.update(conditional_headers(_content_etag(book.file_hash), None))
+    
+    try:
+        chapters = await io_executor.run(chapter_store.read_chapters, book.id, book.file_hash)
         
         return {
             "chapters": chapters,
@@ -169,25 +398,274 @@ async def get_book_content(
         raise HTTPException(status_code=500, detail=f"Error reading book: {str(e)}")
 
 
+@router.get("/{book_id}/toc", response_model=BookTocResponse)
+async def get_book_toc(
+    book_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    await _check_content_etag(db, current_user.id, book_id, if_none_match)
+    book, index = await _open_book(book_id, current_user.id)
+    response.headers.update(conditional_headers(_content_etag(book.file_hash), None))
+    
+    chapters = [
+        {
+            "index": i,
+            "title": entry["title"],
+            "words": entry["words"],
+            "size": entry["size"]
+        }
+        for i, entry in enumerate(index["chapters"])
+    ]
+    
+    # Старая копия могла быть сведена к другой записи при открытии
+    return {
+        "book_id": book.id,
+        "total_chapters": len(chapters),
+        "total_words": sum(entry["words"] for entry in chapters),
+        "chapters": chapters
+    }
+
+
+@router.get("/{book_id}/chapters/{chapter_index}", response_model=ChapterWindowResponse)
+async def get_book_chapters(
+    book_id: int,
+    chapter_index: int,
+    response: Response,
+    window: int = Query(0, ge=0, le=5, description="Сколько соседних глав вернуть с каждой стороны"),
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    await _check_content_etag(db, current_user.id, book_id, if_none_match)
+    book, index = await _open_book(book_id, current_user.id)
+    response.headers.update(conditional_headers(_content_etag(book.file_hash), None))
+    total_chapters = len(index["chapters"])
+    
+    if chapter_index < 0 or chapter_index >= total_chapters:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    
+    start = max(0, chapter_index - window)
+    end = min(total_chapters, chapter_index + window + 1)
+    
+    try:
+        chapters = await io_executor.run(chapter_store.read_chapters, book.id, book.file_hash, start, end)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading book: {str(e)}")
+    
+    return {
+        "chapters": [
+            {"index": start + i, **chapter}
+            for i, chapter in enumerate(chapters)
+        ],
+        "current_chapter": chapter_index,
+        "total_chapters": total_chapters
+    }
+
+
+@router.get("/{book_id}/notes", response_model=Dict[str, List[list]])
+async def get_book_notes(
+    book_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    """Примечания книги по id в виде блоков, как главы. Ссылки на них в тексте - разметка "a" с href вида #id"""
+    await _check_content_etag(db, current_user.id, book_id, if_none_match)
+    book, _ = await _open_book(book_id, current_user.id)
+    response.headers.update(conditional_headers(_content_etag(book.file_hash), None))
+    
+    try:
+        return await io_executor.run(chapter_store.read_notes, book.id, book.file_hash)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading book: {str(e)}")
+
+
+@router.get("/{book_id}/spritz/{chapter_index}", response_class=Response)
+async def get_chapter_spritz(
+    book_id: int,
+    chapter_index: int,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    """
+    Слова главы для Spritz в упакованном двоичном виде (формат - в SpritzStore):
+    ORP и паузы посчитаны при загрузке книги, клиенту не нужно разбирать текст
+    """
+    await _check_content_etag(db, current_user.id, book_id, if_none_match, _spritz_etag)
+    book, _ = await _open_book(book_id, current_user.id)
+    
+    try:
+        packed = await io_executor.run(spritz_store.read_chapter, book.id, book.file_hash, chapter_index)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading book: {str(e)}")
+    
+    if packed is None:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    
+    return Response(
+        packed,
+        media_type=SPRITZ_MEDIA_TYPE,
+        headers=conditional_headers(_spritz_etag(book.file_hash), None)
+    )
+
+
+@router.get("/{book_id}/position", response_model=BookPosition)
+async def resolve_position(
+    book_id: int,
+    position: Optional[int] = Query(None, ge=0, description="Номер слова от начала книги"),
+    chapter: Optional[int] = Query(None, ge=0),
+    paragraph: int = Query(0, ge=0, description="Номер абзаца в главе"),
+    word: int = Query(0, ge=0, description="Номер слова в абзаце"),
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    """
+    Позиция в книге по номеру слова (position) или по главе, абзацу и слову (chapter, paragraph, word).
+    Конец книги - position = total_words или chapter = числу глав.
+    """
+    if (position is None) == (chapter is None):
+        raise HTTPException(status_code=400, detail="Either position or chapter is required")
+    
+    book, _ = await _open_book(book_id, current_user.id)
+    try:
+        positions = await io_executor.run(position_index.load, book.id, book.file_hash)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading book: {str(e)}")
+    
+    try:
+        if position is None:
+            position = positions.position(chapter, paragraph, word)
+        chapter, paragraph, word = positions.locate(position)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "position": position,
+        "chapter": chapter,
+        "paragraph": paragraph,
+        "word": word,
+        "total_words": positions.total_words,
+        "progress_percent": positions.progress(position)
+    }
+
+
+@router.get("/{book_id}/search", response_model=List[BookSearchHit])
+async def search_in_book(
+    book_id: int,
+    response: Response,
+    q: str = Query(..., min_length=1, description="Фраза для поиска"),
+    limit: int = Query(20, ge=1, le=settings.page_max_limit),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    """
+    Поиск фразы в тексте книги по индексу абзацев, в порядке текста.
+    Курсор следующей страницы - в заголовке X-Next-Cursor.
+    """
+    book, _ = await _open_book(book_id, current_user.id)
+    after = decode_cursor(cursor, int)
+    
+    try:
+        hits = await io_executor.run(
+            text_index.search, book.id, book.file_hash, q, limit + 1, after[0] if after else None
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching book: {str(e)}")
+    
+    hits, has_more = split_page(hits, limit)
+    if has_more:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(hits[-1]["id"])
+    return hits
+
+
+@router.get("/{book_id}/cover")
+async def get_book_cover(
+    book_id: int,
+    token: str,
+    size: str = Query("medium", pattern="^(small|medium|original)$"),
+    if_none_match: Optional[str] = Header(None),
+    db: DbSession = Depends(get_db)
+):
+    book = await _media_book(db, book_id, token)
+    if not book or not book.cover_path:
+        raise HTTPException(status_code=404, detail="Cover not found")
+    
+    cover = cover_store.resolve(book.cover_path, size)
+    if not cover:
+        raise HTTPException(status_code=404, detail="Cover not found")
+    
+    # Ответ зависит от токена в ссылке, поэтому только в кеше браузера
+    headers = {
+        "ETag": cover["etag"],
+        "Cache-Control": "private, max-age=604800"
+    }
+    
+    if etag_matches(if_none_match, cover["etag"]):
+        return Response(status_code=304, headers=headers)
+    
+    return FileResponse(cover["path"], media_type=cover["media_type"], headers=headers)
+
+
+@router.get("/{book_id}/images/{image_id}")
+async def get_book_image(
+    book_id: int,
+    image_id: str,
+    token: str,
+    if_none_match: Optional[str] = Header(None),
+    db: DbSession = Depends(get_db)
+):
+    book = await _media_book(db, book_id, token)
+    if not book or not book.file_hash or not book.file_path or not os.path.exists(book.file_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    # Картинка определяется содержимым файла книги, своим id и версией хранилища.
+    # Тип проверен по содержимому, nosniff не дает браузеру угадывать другой
+    etag = make_etag(book.file_hash, "image", ImageStore.VERSION, hashlib.sha256(image_id.encode("utf-8")).hexdigest()[:16])
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=604800",
+        "X-Content-Type-Options": "nosniff",
+        "Content-Disposition": "inline"
+    }
+    
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        image = await io_executor.run(image_store.read, book.id, book.file_hash, book.file_path, image_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading book: {str(e)}")
+    
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    data, media_type = image
+    return Response(data, media_type=media_type, headers=headers)
+
+
 @router.delete("/{book_id}")
 async def delete_book(
     book_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    user_book_repo = UserBookRepository(db)
-    user_book = user_book_repo.get_by_user_and_book(current_user.id, book_id)
+    user_book_repo = AsyncUserBookRepository(db)
+    user_book = await user_book_repo.get_by_user_and_book(current_user.id, book_id)
     
     if not user_book:
         raise HTTPException(status_code=404, detail="Book not found")
     
-    # Удаляем файл с диска, если он существует
-    if user_book.book.file_path and os.path.exists(user_book.book.file_path):
-        try:
-            os.remove(user_book.book.file_path)
-        except Exception as e:
-            print(f"Warning: Could not delete file {user_book.book.file_path}: {e}")
+    book = user_book.book
+    position_buffer.discard(user_book.id)
+    await user_book_repo.delete(user_book.id)
     
-    user_book_repo.delete(user_book.id)
+    # Файл книги общий: удаляем его, только если книга больше ни у кого не осталась
+    await io_executor.run(run_in_session, release_book, book)
     
     return {"message": "Book deleted successfully"}
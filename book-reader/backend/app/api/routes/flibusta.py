@@ -1,29 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
-import tempfile
-import os
-import gzip
-import zipfile
-import io
-from pathlib import Path
-from datetime import datetime
 
-from app.core.database import get_db
+from app.core.database import DbSession, get_db, run_in_session
 from app.core.auth import get_current_user
+from app.core.executors import cpu_executor, io_executor
 from app.models.user import User
-from app.services.flibusta_service import FlibustaService
-from app.services.fb2_parser import FB2Parser
-from app.repositories.book_repository import BookRepository
-from app.repositories.user_book_repository import UserBookRepository
+from app.models.book import Book
+from app.services.flibusta_service import flibusta_service
+from app.services.book_ingest import BookFormatError, BookTooLargeError, BookWriter, parse_book_file, store_parsed_book
+from app.repositories.book_repository import AsyncBookRepository
+from app.repositories.user_book_repository import AsyncUserBookRepository
 
 router = APIRouter(prefix="/api/flibusta", tags=["flibusta"])
 
-# Папка для хранения книг
-BOOKS_DIR = Path("data/books")
-BOOKS_DIR.mkdir(parents=True, exist_ok=True)
-
 
 class FlibustaBookResponse(BaseModel):
     id: str
@@ -49,9 +39,10 @@ async def search_books(
     Поиск книг на Флибусте
     """
     try:
-        flibusta = FlibustaService()
-        books = flibusta.search_books(query, limit)
+        books = await flibusta_service.search_books(query, limit)
         return books
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, 
@@ -59,149 +50,49 @@ async def search_books(
         )
 
 
+@router.get("/search/cache-stats")
+async def search_cache_stats(
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Статистика кеша поиска: попадания, промахи, объем
+    """
+    return flibusta_service.search_cache.stats()
+
+
 @router.post("/download")
 async def download_and_add_book(
     request: DownloadBookRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
     """
     Скачивание книги с Флибусты и добавление в библиотеку пользователя
     """
     try:
-        # Скачиваем книгу
-        flibusta = FlibustaService()
-        content = flibusta.download_book(request.book_id, format="fb2")
+        # Книгу с этим ID уже скачивали: повторно не загружаем
+        book = await AsyncBookRepository(db).get_by_flibusta_id(request.book_id)
+        downloaded = False
         
-        if not content:
-            raise HTTPException(
-                status_code=404, 
-                detail="Не удалось скачать книгу с Флибусты"
-            )
+        if book is None:
+            book = await _download_book(request.book_id, db)
+            downloaded = True
         
-        # Проверяем и распаковываем если нужно
-        try:
-            # Проверяем, не ZIP ли это
-            if content[:2] == b'PK':
-                print("Detected ZIP archive, extracting...")
-                try:
-                    with zipfile.ZipFile(io.BytesIO(content)) as zf:
-                        # Ищем FB2 файл в архиве
-                        fb2_files = [f for f in zf.namelist() if f.endswith('.fb2')]
-                        if not fb2_files:
-                            raise HTTPException(
-                                status_code=500,
-                                detail="В архиве не найден FB2 файл"
-                            )
-                        # Берем первый FB2 файл
-                        print(f"Found FB2 file in archive: {fb2_files[0]}")
-                        content = zf.read(fb2_files[0])
-                except zipfile.BadZipFile:
-                    raise HTTPException(
-                        status_code=500,
-                        detail="Не удалось распаковать архив"
-                    )
-            
-            # Проверяем, не gzip ли это
-            elif content[:2] == b'\x1f\x8b':
-                print("Detected gzip, decompressing...")
-                content = gzip.decompress(content)
-            
-            # Проверяем, что это XML
-            if not content.strip().startswith(b'<?xml') and not content.strip().startswith(b'<FictionBook'):
-                # Логируем первые 200 байт для диагностики
-                preview = content[:200]
-                print(f"Invalid content (first 200 bytes): {preview}")
-                raise HTTPException(
-                    status_code=500,
-                    detail="Флибуста вернула некорректный файл. Попробуйте другую книгу или повторите позже."
-                )
-        except HTTPException:
-            raise
-        except gzip.BadGzipFile:
-            pass  # Не gzip, продолжаем
+        user_book, created = await AsyncUserBookRepository(db).get_or_create(current_user.id, book.id)
         
-        # Создаем временный файл для парсинга
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.fb2') as tmp_file:
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
+        if not created:
+            message = "Книга уже есть в вашей библиотеке"
+        elif downloaded:
+            message = "Книга успешно скачана и добавлена в библиотеку"
+        else:
+            message = "Книга добавлена в библиотеку"
         
-        try:
-            # Парсим книгу
-            parser = FB2Parser(tmp_path)
-            parsed_data = parser.parse()
-            
-            # Проверяем, нет ли уже такой книги у пользователя
-            book_repo = BookRepository(db)
-            existing_book = db.query(book_repo.model).filter(
-                book_repo.model.title == parsed_data["title"],
-                book_repo.model.author == parsed_data["author"]
-            ).first()
-            
-            if existing_book:
-                # Проверяем, есть ли у пользователя эта книга
-                user_book_repo = UserBookRepository(db)
-                existing_user_book = user_book_repo.get_by_user_and_book(
-                    current_user.id, 
-                    existing_book.id
-                )
-                
-                if existing_user_book:
-                    return {
-                        "message": "Книга уже есть в вашей библиотеке",
-                        "book_id": existing_book.id,
-                        "user_book_id": existing_user_book.id
-                    }
-                else:
-                    # Добавляем существующую книгу пользователю
-                    user_book = user_book_repo.create({
-                        "user_id": current_user.id,
-                        "book_id": existing_book.id,
-                        "status": "planned"
-                    })
-                    
-                    return {
-                        "message": "Книга добавлена в библиотеку",
-                        "book_id": existing_book.id,
-                        "user_book_id": user_book.id
-                    }
-            
-            # Сохраняем файл на диск
-            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-            safe_filename = f"{timestamp}_{current_user.id}_{request.book_id}.fb2"
-            file_path = BOOKS_DIR / safe_filename
-            
-            with open(file_path, "wb") as f:
-                f.write(content)
-            
-            # Создаем новую книгу в БД
-            book = book_repo.create({
-                "title": parsed_data["title"],
-                "author": parsed_data["author"],
-                "file_path": str(file_path),
-                "file_name": f"{request.book_id}.fb2",
-                "total_pages": parsed_data["total_pages"]
-            })
-            
-            # Добавляем книгу пользователю
-            user_book_repo = UserBookRepository(db)
-            user_book = user_book_repo.create({
-                "user_id": current_user.id,
-                "book_id": book.id,
-                "status": "planned"
-            })
-            
-            return {
-                "message": "Книга успешно скачана и добавлена в библиотеку",
-                "book_id": book.id,
-                "user_book_id": user_book.id
-            }
-            
-        finally:
-            # Удаляем временный файл
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-                
+        return {
+            "message": message,
+            "book_id": book.id,
+            "user_book_id": user_book.id
+        }
+    
     except HTTPException:
         raise
     except Exception as e:
@@ -209,3 +100,41 @@ async def download_and_add_book(
             status_code=500,
             detail=f"Ошибка обработки книги: {str(e)}"
         )
+
+
+async def _download_book(flibusta_id: str, db: DbSession) -> Book:
+    # Скачиваем книгу потоком: распаковка, хеш и запись на диск идут по мере получения
+    writer = BookWriter()
+    
+    async def sink(chunk: bytes) -> None:
+        await io_executor.run(writer.write, chunk)
+    
+    try:
+        try:
+            downloaded = await flibusta_service.download_book(flibusta_id, sink, format="fb2")
+            if not downloaded:
+                raise HTTPException(
+                    status_code=404, 
+                    detail="Не удалось скачать книгу с Флибусты"
+                )
+            file_hash = await io_executor.run(writer.finish)
+        except BookTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except BookFormatError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        
+        # Тот же файл мог попасть в библиотеку через загрузку или под другим ID
+        book_repo = AsyncBookRepository(db)
+        book = await book_repo.get_by_hash(file_hash)
+        if book is not None:
+            if not book.flibusta_id:
+                book = await book_repo.attach_flibusta_id(book.id, flibusta_id)
+            return book
+        
+        parsed_data = await cpu_executor.run(parse_book_file, str(writer.path))
+        return await io_executor.run(
+            run_in_session, store_parsed_book, parsed_data, str(writer.path), file_hash, f"{flibusta_id}.fb2", flibusta_id
+        )
+    finally:
+        # Удаляем временный файл, если он не перенесен в хранилище
+        await io_executor.run(writer.discard)
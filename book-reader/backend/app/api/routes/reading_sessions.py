@@ -1,13 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import DbSession, get_db
 from app.core.auth import get_current_user
 from app.models.user import User
-from app.repositories.reading_session_repository import ReadingSessionRepository
-from app.repositories.user_book_repository import UserBookRepository
+from app.repositories.reading_session_repository import AsyncReadingSessionRepository
+from app.repositories.user_book_repository import AsyncUserBookRepository
 
 router = APIRouter(prefix="/api/reading-sessions", tags=["reading-sessions"])
 
@@ -30,20 +30,27 @@ class ReadingSessionResponse(BaseModel):
         from_attributes = True
 
 
+class ReadingSessionBatchResult(BaseModel):
+    index: int
+    status: int
+    session: Optional[ReadingSessionResponse] = None
+    detail: Optional[str] = None
+
+
 @router.post("/", response_model=ReadingSessionResponse)
 async def create_session(
     data: ReadingSessionCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    user_book_repo = UserBookRepository(db)
-    user_book = user_book_repo.get(data.user_book_id)
+    user_book_repo = AsyncUserBookRepository(db)
+    user_book = await user_book_repo.get(data.user_book_id)
     
     if not user_book or user_book.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="User book not found")
     
-    session_repo = ReadingSessionRepository(db)
-    session = session_repo.create({
+    session_repo = AsyncReadingSessionRepository(db)
+    session = await session_repo.create({
         "user_book_id": data.user_book_id,
         "words_count": data.words_count,
         "speed_wpm": data.speed_wpm,
@@ -53,13 +60,43 @@ async def create_session(
     return session
 
 
+@router.post("/batch", response_model=List[ReadingSessionBatchResult])
+async def create_sessions_batch(
+    items: List[ReadingSessionCreate],
+    current_user: User = Depends(get_current_user),
+    db: DbSession = Depends(get_db)
+):
+    """
+    Пакетное сохранение сессий чтения (частые короткие сессии Spritz,
+    очередь офлайн-клиента). Результат возвращается по каждой записи
+    в порядке запроса: чужие книги не прерывают сохранение остальных.
+    """
+    if len(items) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"Too many items, max {settings.batch_max_items}")
+
+    user_book_repo = AsyncUserBookRepository(db)
+    owned = await user_book_repo.get_owned_ids(current_user.id, (item.user_book_id for item in items))
+
+    accepted = [index for index, item in enumerate(items) if item.user_book_id in owned]
+    session_repo = AsyncReadingSessionRepository(db)
+    sessions = await session_repo.create_many([items[index].model_dump() for index in accepted]) if accepted else []
+    created = dict(zip(accepted, sessions))
+
+    return [
+        ReadingSessionBatchResult(index=index, status=201, session=ReadingSessionResponse.model_validate(created[index]))
+        if index in created
+        else ReadingSessionBatchResult(index=index, status=404, detail="User book not found")
+        for index in range(len(items))
+    ]
+
+
 @router.get("/stats")
 async def get_stats(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    session_repo = ReadingSessionRepository(db)
-    average_speed = session_repo.get_average_speed(current_user.id)
+    session_repo = AsyncReadingSessionRepository(db)
+    average_speed = await session_repo.get_average_speed(current_user.id)
     
     return {
         "average_speed": average_speed
@@ -1,20 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
 from pydantic import BaseModel
+from typing import Optional
 from datetime import datetime
 
-from app.core.database import get_db
+from app.core.database import DbSession, get_db
 from app.core.auth import get_current_user
+from app.core.conditional import conditional_headers, make_etag
+from app.core.executors import io_executor
 from app.models.user import User
-from app.repositories.user_book_repository import UserBookRepository
-from app.repositories.user_settings_repository import UserSettingsRepository
+from app.repositories.user_book_repository import AsyncUserBookRepository
+from app.repositories.user_repository import AsyncUserRepository
+from app.repositories.user_settings_repository import AsyncUserSettingsRepository
+from app.services.position_buffer import position_buffer
+from app.services.position_index import BookPositions, position_index
 
 router = APIRouter(prefix="/api/user-books", tags=["user-books"])
 
 
 class PositionUpdate(BaseModel):
-    current_position: int
-    progress_percent: float
+    """
+    Позиция - номер слова от начала книги (current_position) или глава,
+    абзац и слово в абзаце. progress_percent считается на сервере по числу слов,
+    значение клиента используется, только если индекса позиций у книги нет.
+    """
+    current_position: Optional[int] = None
+    chapter: Optional[int] = None
+    paragraph: int = 0
+    word: int = 0
+    progress_percent: Optional[float] = None
 
 
 class SettingsUpdate(BaseModel):
@@ -24,20 +37,43 @@ class SettingsUpdate(BaseModel):
     spritz_speed: int = None
 
 
+async def _book_positions(db: DbSession, user_id: int, book_id: int) -> Optional[BookPositions]:
+    """Индекс позиций книги, None - его нельзя построить (глав книги нет в хранилище)"""
+    file_hash = await AsyncUserBookRepository(db).get_book_hash(user_id, book_id)
+    if not file_hash:
+        return None
+    positions = position_index.cached(book_id, file_hash)
+    if positions is not None:
+        return positions
+    try:
+        return await io_executor.run(position_index.load, book_id, file_hash)
+    except FileNotFoundError:
+        return None
+
+
 @router.get("/{user_book_id}")
 async def get_user_book(
     user_book_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    user_book_repo = UserBookRepository(db)
-    user_book = user_book_repo.get(user_book_id)
+    # Версии читаются до данных: при гонке с записью ETag окажется старше ответа, а не новее.
+    # Несохраненная позиция подставляется из буфера, ее учитывает номер записи в буфере
+    buffer_version = position_buffer.version(current_user.id)
+    library_version, settings_version = await AsyncUserRepository(db).get_versions(current_user.id)
+    etag = make_etag("user-book", current_user.id, library_version, settings_version, buffer_version)
+    response.headers.update(conditional_headers(etag, if_none_match))
+    
+    user_book_repo = AsyncUserBookRepository(db)
+    user_book = position_buffer.overlay(await user_book_repo.get(user_book_id))
     
     if not user_book or user_book.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="User book not found")
     
-    settings_repo = UserSettingsRepository(db)
-    settings = settings_repo.get_or_create(current_user.id)
+    settings_repo = AsyncUserSettingsRepository(db)
+    settings = await settings_repo.get_or_create(current_user.id)
     
     return {
         "user_book": user_book,
@@ -50,38 +86,62 @@ async def update_position(
     user_book_id: int,
     data: PositionUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    user_book_repo = UserBookRepository(db)
-    user_book = user_book_repo.get(user_book_id)
+    user_book_repo = AsyncUserBookRepository(db)
+    user_book = position_buffer.overlay(await user_book_repo.get(user_book_id))
     
     if not user_book or user_book.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="User book not found")
     
+    if (data.current_position is None) == (data.chapter is None):
+        raise HTTPException(status_code=400, detail="Either current_position or chapter is required")
+    
+    positions = await _book_positions(db, current_user.id, user_book.book_id)
+    if positions is not None:
+        try:
+            position = data.current_position
+            if position is None:
+                position = positions.position(data.chapter, data.paragraph, data.word)
+            elif position > positions.total_words:
+                raise ValueError(f"Position {position} is out of range")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        progress = positions.progress(position)
+    elif data.current_position is not None and data.progress_percent is not None:
+        position, progress = data.current_position, data.progress_percent
+    else:
+        raise HTTPException(status_code=409, detail="Position index is not available")
+    
     update_data = {
-        "current_position": data.current_position,
-        "progress_percent": data.progress_percent
+        "current_position": position,
+        "progress_percent": progress
     }
     
-    if user_book.status == "planned" and data.current_position > 0:
+    if user_book.status == "planned" and position > 0:
         update_data["status"] = "reading"
         update_data["started_at"] = datetime.utcnow()
-    elif data.progress_percent >= 100:
+    elif progress >= 100 and user_book.status != "finished":
         update_data["status"] = "finished"
         update_data["finished_at"] = datetime.utcnow()
     
-    updated = user_book_repo.update(user_book_id, update_data)
-    return updated
+    # Позиция копится в буфере, смена статуса записывается сразу
+    overflow = position_buffer.put(user_book_id, current_user.id, update_data)
+    position_buffer.overlay(user_book)
+    if overflow or "status" in update_data:
+        await position_buffer.flush()
+    
+    return user_book
 
 
 @router.put("/settings")
 async def update_settings(
     data: SettingsUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    settings_repo = UserSettingsRepository(db)
-    settings = settings_repo.get_or_create(current_user.id)
+    settings_repo = AsyncUserSettingsRepository(db)
+    settings = await settings_repo.get_or_create(current_user.id)
     
     update_data = {}
     if data.font_size is not None:
@@ -93,5 +153,5 @@ async def update_settings(
     if data.spritz_speed is not None:
         update_data["spritz_speed"] = data.spritz_speed
     
-    updated = settings_repo.update(settings.id, update_data)
+    updated = await settings_repo.update(settings.id, update_data)
     return updated
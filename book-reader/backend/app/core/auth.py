@@ -1,14 +1,77 @@
 from fastapi import Depends, HTTPException, Header
-from sqlalchemy.orm import Session
 from typing import Optional
 import hashlib
 import hmac
+import secrets
+import time
 from urllib.parse import parse_qs
 
+from app.core.cache import TTLCache
 from app.core.config import settings
-from app.core.database import get_db
+from app.core.database import DbSession, get_db
 from app.models.user import User
-from app.repositories.user_repository import UserRepository
+from app.repositories.user_repository import AsyncUserRepository, UserRepository
+
+
+# Проверенные initData: sha256(initData) -> (user.id, user.telegram_id).
+# Повторные запросы с той же строкой обходятся без HMAC и запроса пользователя.
+auth_cache = TTLCache(settings.auth_cache_max_entries, settings.auth_cache_ttl)
+
+_secret_key: Optional[bytes] = None
+_media_key: Optional[bytes] = None
+
+
+def _get_secret_key() -> bytes:
+    # Ключ зависит только от токена бота, считаем его один раз
+    global _secret_key
+    if _secret_key is None:
+        _secret_key = hmac.new(
+            b"WebAppData",
+            settings.tg_bot_token.encode(),
+            hashlib.sha256
+        ).digest()
+    return _secret_key
+
+
+def _get_media_key() -> bytes:
+    global _media_key
+    if _media_key is None:
+        if settings.media_url_secret:
+            _media_key = settings.media_url_secret.encode()
+        elif settings.tg_bot_token:
+            _media_key = hmac.new(b"MediaUrl", settings.tg_bot_token.encode(), hashlib.sha256).digest()
+        else:
+            _media_key = secrets.token_bytes(32)
+    return _media_key
+
+
+def _media_signature(user_id: int, expires: int) -> str:
+    return hmac.new(_get_media_key(), f"{user_id}.{expires}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def issue_media_token(user_id: int) -> dict:
+    """
+    Токен для ссылок на обложки и иллюстрации книг пользователя.
+    Срок округляется до интервала media_url_ttl: в течение интервала
+    ссылки не меняются и кеш браузера продолжает работать.
+    """
+    ttl = settings.media_url_ttl
+    expires = (int(time.time()) // ttl + 2) * ttl
+    return {"token": f"{user_id}.{expires}.{_media_signature(user_id, expires)}", "expires": expires}
+
+
+def verify_media_token(token: str) -> int:
+    """id пользователя из токена ссылки; 403, если подпись неверна или срок истек"""
+    try:
+        user_id, expires, signature = token.split(".")
+        user_id, expires = int(user_id), int(expires)
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Invalid media token")
+    if not hmac.compare_digest(_media_signature(user_id, expires), signature):
+        raise HTTPException(status_code=403, detail="Invalid media token")
+    if expires < time.time():
+        raise HTTPException(status_code=403, detail="Media token expired")
+    return user_id
 
 
 def validate_telegram_init_data(init_data: str) -> dict:
@@ -39,61 +102,78 @@ def validate_telegram_init_data(init_data: str) -> dict:
         
         data_check_string = '\n'.join(sorted(data_check_items))
         
-        secret_key = hmac.new(
-            b"WebAppData",
-            settings.tg_bot_token.encode(),
-            hashlib.sha256
-        ).digest()
-        
         calculated_hash = hmac.new(
-            secret_key,
+            _get_secret_key(),
             data_check_string.encode(),
             hashlib.sha256
         ).hexdigest()
         
-        if calculated_hash != hash_value:
+        if not hmac.compare_digest(calculated_hash, hash_value):
             raise HTTPException(status_code=401, detail="Invalid hash")
         
+        auth_date = int(parsed.get('auth_date', ['0'])[0])
+        if settings.tg_auth_max_age and time.time() - auth_date > settings.tg_auth_max_age:
+            raise HTTPException(status_code=401, detail="Init data expired")
+        
         user_data = parsed.get('user', ['{}'])[0]
         import json
-        return {"user": json.loads(user_data)}
+        return {"user": json.loads(user_data), "auth_date": auth_date}
     
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid init data: {str(e)}")
 
 
+def _cache_ttl(auth_date: Optional[int]) -> float:
+    """Запись в кеше не должна пережить срок действия initData"""
+    ttl = settings.auth_cache_ttl
+    if auth_date and settings.tg_auth_max_age:
+        ttl = min(ttl, auth_date + settings.tg_auth_max_age - time.time())
+    return ttl
+
+
 async def get_current_user(
     authorization: Optional[str] = Header(None),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ) -> User:
     if not authorization:
         if settings.skip_tg_validation:
-            user_repo = UserRepository(db)
-            user = user_repo.get_by_telegram_id(settings.test_user_id)
+            user_repo = AsyncUserRepository(db)
+            user = await user_repo.get_by_telegram_id(settings.test_user_id)
             if not user:
-                user = user_repo.create({
+                user = await user_repo.create({
                     "telegram_id": settings.test_user_id,
                     "username": settings.test_username
                 })
             return user
         raise HTTPException(status_code=401, detail="Authorization header required")
     
+    init_data = authorization.replace("Bearer ", "")
+    cache_key = hashlib.sha256(init_data.encode()).digest()
+    cached = auth_cache.get(cache_key)
+    if cached is not None:
+        user_id, telegram_id = cached[0]
+        # Привязка к сессии без запроса к БД, поэтому без run_sync
+        return UserRepository(db.sync_session).attach(user_id, telegram_id)
+    
     try:
-        init_data = authorization.replace("Bearer ", "")
         validated_data = validate_telegram_init_data(init_data)
         
         telegram_id = validated_data["user"]["id"]
         username = validated_data["user"].get("username", "")
         
-        user_repo = UserRepository(db)
-        user = user_repo.get_by_telegram_id(telegram_id)
+        user_repo = AsyncUserRepository(db)
+        user = await user_repo.get_by_telegram_id(telegram_id)
         
         if not user:
-            user = user_repo.create({
+            user = await user_repo.create({
                 "telegram_id": telegram_id,
                 "username": username
             })
         
+        ttl = _cache_ttl(validated_data.get("auth_date"))
+        if ttl > 0:
+            auth_cache.set(cache_key, (user.id, user.telegram_id), ttl=ttl)
+        
         return user
     
     except HTTPException:
@@ -0,0 +1,46 @@
+"""
+Условные GET-запросы: ETag в ответе и 304 Not Modified на If-None-Match.
+
+Неизменяемые данные книги (текст, оглавление) помечаются хешем файла,
+состояние пользователя - версиями из БД (User.library_version, UserSettings.version).
+Валидатор проверяется до чтения хранилища глав и тяжелых запросов.
+"""
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+
+
+# Ответы зависят от пользователя, а свежесть проверяется при каждом обращении
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+
+def _opaque(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Слабое сравнение, как требует If-None-Match: CompressionMiddleware
+    отдает сжатый ответ со слабым ETag, и клиент присылает его обратно с W/
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or _opaque(etag) in {_opaque(tag) for tag in tags}
+
+
+def conditional_headers(etag: str, if_none_match: Optional[str]) -> Dict[str, str]:
+    """
+    Заголовки валидатора для ответа.
+
+    Raises:
+        HTTPException: 304, если у клиента эта же версия
+    """
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        raise HTTPException(status_code=304, headers=headers)
+    return headers
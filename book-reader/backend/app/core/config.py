@@ -11,8 +11,79 @@ class Settings(BaseSettings):
     test_username: Optional[str] = "dev_user"
     
     tg_bot_token: Optional[str] = None
+    # Сколько секунд initData считается действительной после auth_date (0 - без ограничения)
+    tg_auth_max_age: int = 86400
+    # Кеш проверенных initData
+    auth_cache_ttl: float = 300.0
+    auth_cache_max_entries: int = 10000
+    # Подпись ссылок на обложки и иллюстрации (<img> не передает Authorization).
+    # По умолчанию выводится из токена бота, без него - случайный ключ процесса
+    media_url_secret: Optional[str] = None
+    media_url_ttl: int = 3600
     
     database_url: str = "sqlite:///./data/database.db"
+    # Асинхронный драйвер (aiosqlite/asyncpg) вместо синхронной сессии в пуле потоков
+    db_async: bool = False
+    # По умолчанию выводится из database_url
+    async_database_url: Optional[str] = None
+    
+    # SQLite: пул читающих соединений и одно пишущее, параметры PRAGMA
+    sqlite_read_pool_size: int = 8
+    sqlite_read_max_overflow: int = 8
+    sqlite_busy_timeout: int = 60000
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    sqlite_cache_size: int = -64000  # отрицательное значение - в КиБ
+    sqlite_wal_autocheckpoint: int = 1000
+    
+    # Пул соединений для PostgreSQL и других серверных СУБД
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    
+    # Файлы книг (по хешу содержимого) и распарсенные главы
+    books_dir: str = "data/books"
+    max_book_size: int = 100 * 1024 * 1024
+    chapters_dir: str = "data/chapters"
+    covers_dir: str = "data/covers"
+    # Иллюстрации из текста книг, извлекаются из файла при первом запросе
+    images_dir: str = "data/images"
+    
+    # Полнотекстовый индекс текста книг и длина фрагмента в результатах (слов)
+    search_index_dir: str = "data/search"
+    search_snippet_words: int = 16
+    
+    # Упакованные потоки слов глав для Spritz
+    spritz_dir: str = "data/spritz"
+    
+    # Индексы позиций (номер слова <-> глава и абзац) и сколько их держать в памяти
+    positions_dir: str = "data/positions"
+    position_index_cache_entries: int = 256
+    
+    # Пулы для блокирующей работы: процессы для парсинга, потоки для файлов и БД
+    cpu_pool_size: int = 2
+    cpu_queue_size: int = 8
+    io_pool_size: int = 8
+    io_queue_size: int = 64
+    executor_wait_timeout: float = 10.0
+    
+    # Буфер позиций чтения: как часто и при каком объеме сбрасывать в БД
+    position_flush_interval: float = 5.0
+    position_buffer_max_entries: int = 10000
+    
+    # Максимум записей в одном пакетном запросе (сессии чтения, закладки)
+    batch_max_items: int = 500
+    
+    # Постраничная выдача списков: размер страницы по умолчанию и максимальный
+    page_default_limit: int = 50
+    page_max_limit: int = 200
+    
+    # Сжатие ответов: минимальный размер, уровни, с какого размера сжимать в пуле потоков
+    compression_min_size: int = 1024
+    compression_gzip_level: int = 5
+    compression_brotli_quality: int = 4
+    compression_offload_size: int = 256 * 1024
     
     backend_host: str = "0.0.0.0"
     backend_port: int = 8000
@@ -20,6 +91,13 @@ class Settings(BaseSettings):
     tor_proxy_host: str = "localhost"
     tor_proxy_port: int = 9050
     flibusta_url: str = "https://flibusta.is"
+    flibusta_timeout: float = 30.0
+    
+    # Кеш результатов поиска на Флибусте
+    flibusta_cache_ttl: float = 600.0
+    flibusta_cache_stale_ttl: float = 3600.0
+    flibusta_cache_max_entries: int = 1000
+    flibusta_cache_max_bytes: int = 16 * 1024 * 1024
     
     # HTTP Proxy для Flibusta
     http_proxy_host: Optional[str] = None
@@ -1,62 +1,228 @@
-from sqlalchemy import create_engine, event
+from typing import Callable, Union
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from app.core.config import settings
+from app.core.executors import io_executor
+from app.core.migrations import run_migrations
 
-# Настройки для SQLite
-connect_args = {}
-engine_kwargs = {}
+is_sqlite = "sqlite" in settings.database_url
 
-if "sqlite" in settings.database_url:
+if is_sqlite:
+    # SQLite допускает только одного писателя, поэтому соединения разделены:
+    # пул читающих соединений и одно пишущее, которое сессии берут по очереди.
+    # check_same_thread=False нужен, потому что сессии работают в пуле потоков
     connect_args = {
         "check_same_thread": False,
-        "timeout": 30
-    }
-    # Используем StaticPool для SQLite чтобы переиспользовать одно соединение
-    engine_kwargs = {
-        "poolclass": StaticPool,
-        "connect_args": connect_args,
+        "timeout": settings.sqlite_busy_timeout / 1000
     }
+    engine = create_engine(
+        settings.database_url,
+        poolclass=QueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=settings.sqlite_busy_timeout / 1000,
+        connect_args=connect_args,
+    )
+    read_engine = create_engine(
+        settings.database_url,
+        poolclass=QueuePool,
+        pool_size=settings.sqlite_read_pool_size,
+        max_overflow=settings.sqlite_read_max_overflow,
+        connect_args=connect_args,
+    )
 else:
-    engine_kwargs = {
-        "pool_pre_ping": True,
-        "pool_size": 5,
-        "max_overflow": 10,
-    }
+    engine = create_engine(
+        settings.database_url,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+    )
+    read_engine = engine
+
+
+def _apply_sqlite_pragmas(dbapi_conn, read_only: bool):
+    cursor = dbapi_conn.cursor()
+    try:
+        # Пытаемся включить WAL режим, но не падаем если не получается
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    except Exception as e:
+        print(f"Warning: Could not set WAL mode: {e}")
+        # Продолжаем работу в обычном режиме
+    
+    # Этот параметр важнее - он точно должен быть установлен
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")  # Временные данные в памяти
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+    if read_only:
+        # Запись через читающее соединение - ошибка маршрутизации, пусть она будет заметна
+        cursor.execute("PRAGMA query_only=ON")
+    else:
+        cursor.execute(f"PRAGMA wal_autocheckpoint={int(settings.sqlite_wal_autocheckpoint)}")
+    cursor.close()
 
-engine = create_engine(settings.database_url, **engine_kwargs)
 
-# Включаем WAL режим для SQLite (улучшает конкурентность)
-if "sqlite" in settings.database_url:
+if is_sqlite:
     @event.listens_for(engine, "connect")
     def set_sqlite_pragma(dbapi_conn, connection_record):
-        cursor = dbapi_conn.cursor()
-        try:
-            # Пытаемся включить WAL режим, но не падаем если не получается
-            cursor.execute("PRAGMA journal_mode=WAL")
-            cursor.execute("PRAGMA synchronous=NORMAL")
-        except Exception as e:
-            print(f"Warning: Could not set WAL mode: {e}")
-            # Продолжаем работу в обычном режиме
-        
-        # Этот параметр важнее - он точно должен быть установлен
-        cursor.execute("PRAGMA busy_timeout=60000")  # 60 секунд
-        cursor.execute("PRAGMA temp_store=MEMORY")  # Временные данные в памяти
-        cursor.close()
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        _apply_sqlite_pragmas(dbapi_conn, read_only=False)
+
+    @event.listens_for(read_engine, "connect")
+    def set_sqlite_read_pragma(dbapi_conn, connection_record):
+        _apply_sqlite_pragmas(dbapi_conn, read_only=True)
+
+
+class ReadWriteSession(Session):
+    """
+    Сессия, которая отправляет SELECT в читающий пул, а все остальное - в пишущее соединение.
+    После первой записи транзакция целиком остается на пишущем соединении,
+    чтобы чтения видели еще не закоммиченные изменения.
+    """
+
+    write_bind = engine
+    read_bind = read_engine
+    _writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.read_bind is self.write_bind:
+            return self.write_bind
+        if not self._writing and not self._flushing and getattr(clause, "is_select", False):
+            return self.read_bind
+        self._writing = True
+        return self.write_bind
+
+
+@event.listens_for(ReadWriteSession, "after_transaction_end")
+def _release_writer(session, transaction):
+    if transaction.parent is None:
+        session._writing = False
+
+
+# Без expire_on_commit: объекты, возвращенные репозиторием, остаются загруженными после коммита
+SessionLocal = sessionmaker(class_=ReadWriteSession, autocommit=False, autoflush=False, expire_on_commit=False)
+
+
+def _async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith(("postgresql:", "postgres:")):
+        return "postgresql+asyncpg:" + url.split(":", 1)[1]
+    return url
+
+
+# Асинхронный путь: те же пулы и маршрутизация, но запросы не занимают потоки
+AsyncSessionLocal = None
+
+if settings.db_async:
+    async_url = settings.async_database_url or _async_url(settings.database_url)
+    if is_sqlite:
+        async_connect_args = {"timeout": settings.sqlite_busy_timeout / 1000}
+        async_engine = create_async_engine(
+            async_url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=settings.sqlite_busy_timeout / 1000,
+            connect_args=async_connect_args,
+        )
+        async_read_engine = create_async_engine(
+            async_url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.sqlite_read_pool_size,
+            max_overflow=settings.sqlite_read_max_overflow,
+            connect_args=async_connect_args,
+        )
+
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def set_async_sqlite_pragma(dbapi_conn, connection_record):
+            _apply_sqlite_pragmas(dbapi_conn, read_only=False)
+
+        @event.listens_for(async_read_engine.sync_engine, "connect")
+        def set_async_sqlite_read_pragma(dbapi_conn, connection_record):
+            _apply_sqlite_pragmas(dbapi_conn, read_only=True)
+    else:
+        async_engine = create_async_engine(
+            async_url,
+            pool_pre_ping=settings.db_pool_pre_ping,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+        )
+        async_read_engine = async_engine
+
+    class AsyncReadWriteSession(ReadWriteSession):
+        write_bind = async_engine.sync_engine
+        read_bind = async_read_engine.sync_engine
+
+    # expire_on_commit выключен и здесь: ленивая загрузка атрибутов вне run_sync невозможна
+    AsyncSessionLocal = async_sessionmaker(
+        sync_session_class=AsyncReadWriteSession,
+        autoflush=False,
+        expire_on_commit=False
+    )
+
+
+class ThreadedSession:
+    """
+    Синхронная сессия с интерфейсом AsyncSession.run_sync:
+    запросы выполняются в пуле потоков и не блокируют event loop.
+    """
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    async def run_sync(self, fn: Callable, *args, **kwargs):
+        return await io_executor.run(fn, self.sync_session, *args, **kwargs)
+
+    async def close(self) -> None:
+        self.sync_session.close()
+
+
+DbSession = Union[AsyncSession, ThreadedSession]
 
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
+async def get_db():
+    if settings.db_async:
+        db = AsyncSessionLocal()
+    else:
+        db = ThreadedSession(SessionLocal())
     try:
         yield db
+    finally:
+        await db.close()
+
+
+async def close_db():
+    if settings.db_async:
+        await async_engine.dispose()
+        if async_read_engine is not async_engine:
+            await async_read_engine.dispose()
+
+
+def run_in_session(func: Callable, *args, **kwargs):
+    """
+    Вызов func(db, ...) с отдельной синхронной сессией.
+    Для работы, где запросы к БД перемешаны с файлами и парсингом: ее выполняем в пуле потоков.
+    """
+    db = SessionLocal()
+    try:
+        return func(db, *args, **kwargs)
     finally:
         db.close()
 
 
 def init_db():
+    with engine.connect() as conn:
+        fresh = not inspect(conn).has_table("users")
     Base.metadata.create_all(bind=engine)
+    # Изменения существующих таблиц - только через версионные миграции
+    run_migrations(engine, fresh=fresh)
@@ -0,0 +1,82 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+
+class BoundedExecutor:
+    """
+    Пул с ограниченной очередью: одновременно выполняется или ждет не больше
+    max_workers + queue_size задач. Если место не освободилось за wait_timeout,
+    запрос отклоняется с 503, чтобы не копить работу на перегруженном воркере.
+    """
+
+    def __init__(self, factory: Callable[[int], Executor], max_workers: int, queue_size: int, wait_timeout: float):
+        self.factory = factory
+        self.max_workers = max_workers
+        self.wait_timeout = wait_timeout
+        self._slots = asyncio.Semaphore(max_workers + queue_size)
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self.factory(self.max_workers)
+        return self._executor
+
+    async def run(self, func: Callable, *args, **kwargs):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.wait_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail="Сервер перегружен, повторите запрос позже",
+                headers={"Retry-After": str(int(self.wait_timeout))}
+            )
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+def _process_pool(max_workers: int) -> Executor:
+    # spawn: fork из многопоточного процесса uvicorn может зависнуть на блокировках
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _thread_pool(max_workers: int) -> Executor:
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="io")
+
+
+# CPU-bound: парсинг FB2, распаковка архивов
+cpu_executor = BoundedExecutor(
+    _process_pool,
+    settings.cpu_pool_size,
+    settings.cpu_queue_size,
+    settings.executor_wait_timeout
+)
+
+# Блокирующий ввод-вывод: файлы, синхронный SQLAlchemy, HTTP
+io_executor = BoundedExecutor(
+    _thread_pool,
+    settings.io_pool_size,
+    settings.io_queue_size,
+    settings.executor_wait_timeout
+)
+
+
+def shutdown_executors() -> None:
+    cpu_executor.shutdown()
+    io_executor.shutdown()
@@ -0,0 +1,61 @@
+"""
+Подготовка поисковых запросов для SQLite FTS5.
+
+FTS5 не умеет русскую морфологию, поэтому от слов отсекаются типичные
+окончания, и основа ищется как префикс: "толстого" -> "толст*" находит "Толстой".
+Короткие слова ищутся целиком: префикс "и*" нашел бы "из" и "изобиловал".
+Токенизатор unicode61 не сводит ё к е, поэтому это делается и в запросе,
+и в индексируемом тексте.
+"""
+import re
+from typing import List, Optional
+
+
+RUSSIAN_ENDINGS = sorted((
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией", "ах", "ях",
+    "ов", "ев", "ом", "ем", "ам", "ям", "ий", "ый", "ой", "ей", "ая", "яя", "ое", "ее",
+    "ые", "ие", "ую", "юю", "ия", "ья", "ию", "ью", "а", "я", "ы", "и", "у", "ю", "е", "о", "ь", "й",
+), key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+# Слова не длиннее этого (союзы, предлоги, частицы) ищутся точно, без префикса
+EXACT_WORD_LENGTH = 3
+
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+
+WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Текст для индекса: длина и позиции слов не меняются"""
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def stem(word: str) -> str:
+    if re.search("[а-яё]", word):
+        for ending in RUSSIAN_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+                return word[:-len(ending)]
+    return word
+
+
+def query_terms(search: str) -> List[str]:
+    """Основы слов запроса в нижнем регистре"""
+    return [stem(word) for word in WORD_RE.findall(normalize(search.lower()))]
+
+
+def match_terms(search: str) -> List[str]:
+    """Термы FTS5 для слов запроса: короткие слова точно, остальные - префиксом основы"""
+    return [
+        f'"{word}"' if len(word) <= EXACT_WORD_LENGTH else f'"{stem(word)}"*'
+        for word in WORD_RE.findall(normalize(search.lower()))
+    ]
+
+
+def match_all(search: str) -> Optional[str]:
+    """Запрос MATCH: все слова обязательны, в любом порядке. None - в строке нет слов"""
+    return " ".join(match_terms(search)) or None
+
+
+def match_phrase(search: str) -> Optional[str]:
+    """Запрос MATCH: слова подряд в указанном порядке. None - в строке нет слов"""
+    return " + ".join(match_terms(search)) or None
@@ -0,0 +1,254 @@
+"""
+Версионные миграции схемы БД.
+
+create_all создает только недостающие таблицы, поэтому изменения уже
+существующих таблиц описываются здесь. Номер последней примененной миграции
+хранится в таблице schema_version. Новая база создается по моделям целиком
+и сразу помечается последней версией.
+
+Миграции должны быть идемпотентными: таблица, созданная create_all
+до запуска миграций, уже содержит индексы из моделей.
+"""
+import os
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from app.core.config import settings
+
+
+# Миграция может вернуть файлы, которые стали не нужны: они удаляются после коммита
+Migration = Tuple[int, str, Callable[[Connection], Optional[List[str]]]]
+
+# Файлы хранилищ книги по id (см. delete в хранилищах app/services).
+# Миграции не импортируют сервисы: схема не должна зависеть от их кода
+BOOK_STORE_PATTERNS = (
+    (settings.chapters_dir, "{}_*.chapters"),
+    (settings.search_index_dir, "{}_*.fts"),
+    (settings.spritz_dir, "{}_*.spritz"),
+    (settings.positions_dir, "{}_*.pos"),
+    (settings.images_dir, "{}_*.images"),
+    (settings.covers_dir, "{}_*"),
+)
+
+
+def _add_column(conn: Connection, table: str, column: str, column_type: str) -> None:
+    existing = {info["name"] for info in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+def _create_index(
+    conn: Connection, name: str, table: str, columns: Sequence[str], unique: bool = False, where: Optional[str] = None
+) -> None:
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    condition = f" WHERE {where}" if where else ""
+    conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({', '.join(columns)}){condition}"))
+
+
+def _drop_index(conn: Connection, name: str) -> None:
+    conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def _book_storage_columns(conn: Connection) -> None:
+    _add_column(conn, "books", "file_hash", "VARCHAR")
+    _add_column(conn, "books", "flibusta_id", "VARCHAR")
+    _create_index(conn, "ix_books_file_hash", "books", ["file_hash"])
+    _create_index(conn, "ix_books_flibusta_id", "books", ["flibusta_id"])
+
+
+def _merge_duplicate_user_books(conn: Connection) -> None:
+    # Перед уникальным индексом сводим повторы книги в библиотеке к одной записи,
+    # закладки и сессии чтения переносим на нее
+    duplicates = conn.execute(text(
+        "SELECT user_id, book_id, MIN(id) FROM user_books "
+        "GROUP BY user_id, book_id HAVING COUNT(*) > 1"
+    )).fetchall()
+
+    for user_id, book_id, keep_id in duplicates:
+        params = {"user_id": user_id, "book_id": book_id, "keep_id": keep_id}
+        for table in ("bookmarks", "reading_sessions"):
+            conn.execute(text(
+                f"UPDATE {table} SET user_book_id = :keep_id WHERE user_book_id IN ("
+                "SELECT id FROM user_books WHERE user_id = :user_id AND book_id = :book_id AND id != :keep_id)"
+            ), params)
+        conn.execute(text(
+            "DELETE FROM user_books WHERE user_id = :user_id AND book_id = :book_id AND id != :keep_id"
+        ), params)
+        print(f"Merged duplicate user_books for user {user_id}, book {book_id}")
+
+
+def _hot_path_indexes(conn: Connection) -> None:
+    _merge_duplicate_user_books(conn)
+    _create_index(conn, "uq_user_books_user_book", "user_books", ["user_id", "book_id"], unique=True)
+    _create_index(conn, "ix_user_books_user_status", "user_books", ["user_id", "status"])
+    _create_index(conn, "ix_user_books_book_id", "user_books", ["book_id"])
+    _create_index(conn, "ix_bookmarks_user_book_position", "bookmarks", ["user_book_id", "position"])
+    _create_index(conn, "ix_reading_sessions_user_book_created", "reading_sessions", ["user_book_id", "created_at"])
+    _create_index(conn, "ix_books_file_path", "books", ["file_path"])
+
+
+def _keyset_indexes(conn: Connection) -> None:
+    # Ключ постраничной выдачи (id) добавлен в конец индексов списков:
+    # страница после курсора читается диапазоном индекса без сортировки
+    for name, table, columns in (
+        ("ix_user_books_user_status", "user_books", ["user_id", "status", "id"]),
+        ("ix_bookmarks_user_book_position", "bookmarks", ["user_book_id", "position", "id"]),
+    ):
+        _drop_index(conn, name)
+        _create_index(conn, name, table, columns)
+    _create_index(conn, "ix_user_books_user_id", "user_books", ["user_id", "id"])
+    _create_index(conn, "ix_bookmarks_user_book_created", "bookmarks", ["user_book_id", "created_at", "id"])
+
+
+def _books_fulltext(conn: Connection) -> None:
+    # Модели импортируют database, которая импортирует этот модуль
+    from app.models.book import create_books_fts
+
+    _add_column(conn, "books", "annotation", "TEXT")
+    create_books_fts(conn)
+
+
+def _state_versions(conn: Connection) -> None:
+    _add_column(conn, "users", "library_version", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "user_settings", "version", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _book_store_files(book_id: int) -> List[str]:
+    return [str(path) for base_dir, pattern in BOOK_STORE_PATTERNS for path in Path(base_dir).glob(pattern.format(book_id))]
+
+
+def _merge_duplicate_books(conn: Connection, column: str) -> List[str]:
+    # Книги с одинаковым значением column сводим к самой ранней записи. Записи библиотеки
+    # переносим на нее; если у пользователя были обе книги, закладки и сессии чтения
+    # переходят на его запись с оставшейся книгой
+    groups = conn.execute(text(
+        f"SELECT {column}, MIN(id) FROM books WHERE {column} IS NOT NULL "
+        f"GROUP BY {column} HAVING COUNT(*) > 1"
+    )).fetchall()
+
+    removed = []
+    for value, keep_id in groups:
+        duplicates = conn.execute(text(
+            f"SELECT id, file_path FROM books WHERE {column} = :value AND id != :keep_id"
+        ), {"value": value, "keep_id": keep_id}).fetchall()
+
+        for book_id, file_path in duplicates:
+            params = {"book_id": book_id, "keep_id": keep_id}
+            for table in ("bookmarks", "reading_sessions"):
+                conn.execute(text(
+                    f"UPDATE {table} SET user_book_id = ("
+                    "SELECT kept.id FROM user_books kept JOIN user_books dup ON dup.user_id = kept.user_id "
+                    f"WHERE dup.id = {table}.user_book_id AND kept.book_id = :keep_id"
+                    ") WHERE user_book_id IN ("
+                    "SELECT dup.id FROM user_books dup JOIN user_books kept ON kept.user_id = dup.user_id "
+                    "WHERE dup.book_id = :book_id AND kept.book_id = :keep_id)"
+                ), params)
+            conn.execute(text(
+                "DELETE FROM user_books WHERE book_id = :book_id "
+                "AND user_id IN (SELECT user_id FROM user_books WHERE book_id = :keep_id)"
+            ), params)
+            conn.execute(text("UPDATE user_books SET book_id = :keep_id WHERE book_id = :book_id"), params)
+            conn.execute(text(
+                "UPDATE books SET flibusta_id = (SELECT flibusta_id FROM books WHERE id = :book_id) "
+                "WHERE id = :keep_id AND flibusta_id IS NULL"
+            ), params)
+            conn.execute(text("DELETE FROM books WHERE id = :book_id"), params)
+            removed.append((book_id, file_path))
+            print(f"Merged duplicate book {book_id} into {keep_id} by {column}")
+
+    # Хранилища удаленных книг и файлы, на которые больше никто не ссылается
+    obsolete = []
+    for book_id, file_path in removed:
+        obsolete.extend(_book_store_files(book_id))
+        in_use = conn.execute(
+            text("SELECT COUNT(*) FROM books WHERE file_path = :file_path"), {"file_path": file_path}
+        ).scalar()
+        if file_path and not in_use:
+            obsolete.append(file_path)
+    return obsolete
+
+
+def _unique_books(conn: Connection) -> List[str]:
+    obsolete = _merge_duplicate_books(conn, "file_hash") + _merge_duplicate_books(conn, "flibusta_id")
+    _drop_index(conn, "ix_books_file_hash")
+    _create_index(conn, "ix_books_file_hash", "books", ["file_hash"], unique=True)
+    _drop_index(conn, "ix_books_flibusta_id")
+    _create_index(conn, "ix_books_flibusta_id", "books", ["flibusta_id"], unique=True, where="flibusta_id IS NOT NULL")
+    return obsolete
+
+
+def _bookmark_owner(conn: Connection) -> None:
+    # Колонка без NOT NULL: SQLite не добавляет ее к существующим строкам без значения по умолчанию
+    _add_column(conn, "bookmarks", "user_id", "INTEGER REFERENCES users(id) ON DELETE CASCADE")
+    conn.execute(text(
+        "UPDATE bookmarks SET user_id = (SELECT user_id FROM user_books WHERE user_books.id = bookmarks.user_book_id) "
+        "WHERE user_id IS NULL"
+    ))
+    _create_index(conn, "ix_bookmarks_user_created", "bookmarks", ["user_id", "created_at", "id"])
+
+
+MIGRATIONS: List[Migration] = [
+    (1, "Хеш файла и ID Флибусты у книг", _book_storage_columns),
+    (2, "Составные индексы для библиотеки, закладок и сессий чтения", _hot_path_indexes),
+    (3, "Индексы для постраничной выдачи библиотеки и закладок", _keyset_indexes),
+    (4, "Аннотация книги и полнотекстовый индекс FTS5", _books_fulltext),
+    (5, "Версии библиотеки и настроек пользователя для ETag", _state_versions),
+    (6, "Уникальные хеш файла и ID Флибусты у книг", _unique_books),
+    (7, "Владелец закладки и индекс для всех закладок пользователя", _bookmark_owner),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(conn: Connection) -> int:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+
+def _set_version(conn: Connection, version: int) -> None:
+    conn.execute(text("DELETE FROM schema_version"))
+    conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": version})
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: Could not delete {path}: {e}")
+
+
+def run_migrations(engine: Engine, fresh: bool = False) -> int:
+    """
+    Применение недостающих миграций, каждая в своей транзакции.
+
+    Args:
+        fresh: База только что создана по моделям, миграции не нужны
+
+    Returns:
+        int: Версия схемы после применения
+    """
+    with engine.begin() as conn:
+        version = _current_version(conn)
+        if fresh and version == 0:
+            _set_version(conn, LATEST_VERSION)
+            return LATEST_VERSION
+
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        print(f"Applying migration {number}: {description}")
+        with engine.begin() as conn:
+            obsolete = migrate(conn) or []
+            _set_version(conn, number)
+        # Только после коммита: при откате миграции файлы еще нужны
+        _remove_files(obsolete)
+        version = number
+
+    return version
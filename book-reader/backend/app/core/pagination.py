@@ -0,0 +1,124 @@
+"""
+Постраничная выдача списков по ключу (keyset) и выбор полей ответа.
+
+Курсор - непрозрачная строка со значениями ключа сортировки последней
+отданной записи. Следующая страница начинается строго после него,
+поэтому добавление и удаление записей не сдвигает страницы, а запрос
+идет по индексу без OFFSET.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from app.core.config import settings
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values: Any) -> str:
+    data = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: Optional[str], *types: type) -> Optional[Tuple]:
+    """Значения ключа из курсора, приведенные к типам types"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if not isinstance(data, list) or len(data) != len(types):
+            raise ValueError(cursor)
+        return tuple(
+            datetime.fromisoformat(value) if kind is datetime else kind(value)
+            for kind, value in zip(types, data)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_limit(limit: Optional[int], cursor: Optional[str]) -> Optional[int]:
+    """Размер страницы. Без limit и курсора список отдается целиком, как раньше"""
+    if limit is None and cursor:
+        return settings.page_default_limit
+    return limit
+
+
+def split_page(rows: List, limit: Optional[int]) -> Tuple[List, bool]:
+    """Репозиторий выбирает limit + 1 записей: лишняя означает, что есть следующая страница"""
+    if limit is None or len(rows) <= limit:
+        return rows, False
+    return rows[:limit], True
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[List[str]]:
+    """
+    Список полей из параметра fields=id,status,book.title.
+    Вложенные поля указываются через точку, имя вложенной модели целиком
+    означает все ее поля.
+    """
+    if not fields:
+        return None
+
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    for name in names:
+        current = model
+        for part in name.split("."):
+            field = current.model_fields.get(part) if current else None
+            if field is None:
+                raise HTTPException(status_code=400, detail=f"Unknown field: {name}")
+            current = _nested_model(field.annotation)
+    return names
+
+
+def split_fields(names: Sequence[str], relation: str) -> Tuple[List[str], Optional[List[str]]]:
+    """
+    Колонки самой записи и связанной записи relation для load_only.
+
+    Returns:
+        (колонки записи, колонки связи): None - связь нужна целиком,
+        пустой список - связь не нужна
+    """
+    own = [name for name in names if name.partition(".")[0] != relation]
+    if relation in names:
+        return own, None
+    prefix = relation + "."
+    return own, [name[len(prefix):] for name in names if name.startswith(prefix)]
+
+
+def project(obj: Any, names: Sequence[str], model: Type[BaseModel]) -> Dict:
+    """Словарь только с выбранными полями объекта"""
+    result: Dict = {}
+    for name in names:
+        target, current, value = result, model, obj
+        parts = name.split(".")
+        for part in parts[:-1]:
+            current = _nested_model(current.model_fields[part].annotation)
+            value = getattr(value, part)
+            if value is None:
+                target[part] = None
+                break
+            target = target.setdefault(part, {})
+        else:
+            last = parts[-1]
+            value = getattr(value, last)
+            nested = _nested_model(current.model_fields[last].annotation)
+            if nested is not None and value is not None:
+                value = nested.model_validate(value).model_dump()
+            target[last] = value
+    return jsonable_encoder(result)
+
+
+def _nested_model(annotation: Any) -> Optional[Type[BaseModel]]:
+    candidates = getattr(annotation, "__args__", None) or (annotation,)
+    for candidate in candidates:
+        if isinstance(candidate, type) and issubclass(candidate, BaseModel):
+            return candidate
+    return None
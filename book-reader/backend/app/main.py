@@ -1,14 +1,21 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from app.core.compression import CompressionMiddleware
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import close_db, init_db
+from app.core.executors import shutdown_executors
+from app.services.flibusta_service import flibusta_service
+from app.services.position_buffer import position_buffer
 from app.api.routes import auth, users, books, user_books, bookmarks, reading_sessions, flibusta
 
 app = FastAPI(
     title="Book Reader API",
     description="API для Telegram WebApp читалки книг",
     version="1.0.0",
-    debug=settings.debug
+    debug=settings.debug,
+    # orjson сериализует большие ответы (главы книг) в разы быстрее стандартного json
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -19,6 +26,7 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
 
 app.include_router(auth.router)
 app.include_router(users.router)
@@ -32,6 +40,16 @@ app.include_router(flibusta.router)
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    position_buffer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await flibusta_service.close()
+    # Несохраненные позиции пишем до закрытия БД
+    await position_buffer.close()
+    await close_db()
+    shutdown_executors()
 
 
 @app.get("/")
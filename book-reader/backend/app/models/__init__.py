@@ -4,5 +4,6 @@ from app.models.user_book import UserBook
 from app.models.bookmark import Bookmark
 from app.models.reading_session import ReadingSession
 from app.models.user_settings import UserSettings
+from app.models.user_stats import UserStats
 
-__all__ = ["User", "Book", "UserBook", "Bookmark", "ReadingSession", "UserSettings"]
+__all__ = ["User", "Book", "UserBook", "Bookmark", "ReadingSession", "UserSettings", "UserStats"]
@@ -1,19 +1,75 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index, event, text
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
+from app.core.fulltext import FTS_TOKENIZER
 
 
 class Book(Base):
     __tablename__ = "books"
+    __table_args__ = (
+        # Одна книга на файл и на ID Флибусты: повторная загрузка находит существующую запись
+        Index(
+            "ix_books_flibusta_id", "flibusta_id", unique=True,
+            sqlite_where=text("flibusta_id IS NOT NULL"), postgresql_where=text("flibusta_id IS NOT NULL"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False, index=True)
     author = Column(String, nullable=False, index=True)
-    file_path = Column(String, nullable=False)  # Путь к файлу в файловой системе
+    annotation = Column(Text, nullable=True)  # Аннотация из FB2, участвует в полнотекстовом поиске
+    file_path = Column(String, nullable=False, index=True)  # Путь к файлу в файловой системе
     file_name = Column(String, nullable=True)  # Оригинальное имя файла
+    file_hash = Column(String, nullable=True, unique=True, index=True)  # SHA-256 файла, по нему же путь в хранилище
+    flibusta_id = Column(String, nullable=True)
     cover_path = Column(String, nullable=True)
     total_pages = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user_books = relationship("UserBook", back_populates="book", cascade="all, delete-orphan")
+
+
+# Полнотекстовый индекс SQLite FTS5 по названию, автору и аннотации.
+# Таблица хранит только индекс (content='books'), синхронизируется триггерами.
+# ё сводится к е при индексации, как и в запросе (см. app.core.fulltext).
+FTS_COLUMNS = ("title", "author", "annotation")
+
+
+def _fts_values(row: str) -> str:
+    return ", ".join(f"replace(replace({row}.{name}, 'ё', 'е'), 'Ё', 'Е')" for name in FTS_COLUMNS)
+
+
+BOOKS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "title, author, annotation, content='books', content_rowid='id', "
+    f"tokenize='{FTS_TOKENIZER}')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN "
+    f"INSERT INTO books_fts(rowid, title, author, annotation) VALUES (new.id, {_fts_values('new')}); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, annotation) "
+    f"VALUES ('delete', old.id, {_fts_values('old')}); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, annotation ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, annotation) "
+    f"VALUES ('delete', old.id, {_fts_values('old')}); "
+    f"INSERT INTO books_fts(rowid, title, author, annotation) VALUES (new.id, {_fts_values('new')}); END",
+]
+
+
+def create_books_fts(conn: Connection) -> None:
+    """Создание индекса и триггеров (идемпотентно) и заполнение по существующим книгам"""
+    if conn.dialect.name != "sqlite":
+        return
+    for statement in BOOKS_FTS_DDL:
+        conn.execute(text(statement))
+    # rebuild взял бы значения из books как есть, без замены ё
+    conn.execute(text("INSERT INTO books_fts(books_fts) VALUES ('delete-all')"))
+    conn.execute(text(
+        f"INSERT INTO books_fts(rowid, title, author, annotation) SELECT books.id, {_fts_values('books')} FROM books"
+    ))
+
+
+@event.listens_for(Book.__table__, "after_create")
+def _create_books_fts(target, connection, **kw):
+    create_books_fts(connection)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
@@ -6,9 +6,16 @@ from app.core.database import Base
 
 class Bookmark(Base):
     __tablename__ = "bookmarks"
+    __table_args__ = (
+        Index("ix_bookmarks_user_book_position", "user_book_id", "position", "id"),
+        Index("ix_bookmarks_user_book_created", "user_book_id", "created_at", "id"),
+        Index("ix_bookmarks_user_created", "user_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_book_id = Column(Integer, ForeignKey("user_books.id", ondelete="CASCADE"), nullable=False)
+    # Владелец записи библиотеки: все закладки пользователя читаются одним диапазоном индекса
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     position = Column(Integer, nullable=False)
     comment = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
@@ -6,6 +6,9 @@ from app.core.database import Base
 
 class ReadingSession(Base):
     __tablename__ = "reading_sessions"
+    __table_args__ = (
+        Index("ix_reading_sessions_user_book_created", "user_book_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_book_id = Column(Integer, ForeignKey("user_books.id", ondelete="CASCADE"), nullable=False)
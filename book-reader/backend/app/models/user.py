@@ -1,17 +1,67 @@
-from sqlalchemy import Column, Integer, String, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, event, select, update
+from sqlalchemy.orm import Session, relationship
 from datetime import datetime
 from app.core.database import Base
+from app.models.book import Book
+from app.models.user_book import UserBook
+from app.models.user_settings import UserSettings
 
 
 class User(Base):
+    """
+    library_version растет при любом изменении книг в библиотеке пользователя,
+    UserSettings.version - при изменении настроек (см. _bump_versions).
+    Из них строятся ETag списков библиотеки и настроек.
+    """
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(Integer, unique=True, index=True, nullable=False)
     username = Column(String, nullable=True)
     reading_goal = Column(Integer, default=0)
+    library_version = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user_books = relationship("UserBook", back_populates="user", cascade="all, delete-orphan")
     settings = relationship("UserSettings", back_populates="user", uselist=False, cascade="all, delete-orphan")
+
+
+@event.listens_for(Session, "before_flush")
+def _bump_versions(session: Session, flush_context, instances):
+    user_ids = set()
+    book_ids = set()
+
+    for obj in session.new:
+        if isinstance(obj, UserBook):
+            user_ids.add(obj.user_id)
+
+    for obj in session.deleted:
+        if isinstance(obj, UserBook):
+            user_ids.add(obj.user_id)
+
+    for obj in session.dirty:
+        if not session.is_modified(obj):
+            continue
+        if isinstance(obj, UserBook):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, Book):
+            # Книга входит в ответы библиотеки всех, у кого она есть
+            book_ids.add(obj.id)
+        elif isinstance(obj, UserSettings):
+            # Выражением, а не значением: параллельные изменения не получат одну версию
+            obj.version = UserSettings.version + 1
+
+    condition = None
+    if user_ids:
+        condition = User.id.in_(user_ids)
+    if book_ids:
+        owners = User.id.in_(select(UserBook.user_id).where(UserBook.book_id.in_(book_ids)))
+        condition = owners if condition is None else condition | owners
+    if condition is not None:
+        # Версию читают отдельным запросом, объекты User в сессии обновлять не нужно
+        session.execute(
+            update(User)
+            .where(condition)
+            .values(library_version=User.library_version + 1)
+            .execution_options(synchronize_session=False)
+        )
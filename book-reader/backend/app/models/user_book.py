@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
@@ -6,6 +6,12 @@ from app.core.database import Base
 
 class UserBook(Base):
     __tablename__ = "user_books"
+    __table_args__ = (
+        Index("uq_user_books_user_book", "user_id", "book_id", unique=True),
+        Index("ix_user_books_user_id", "user_id", "id"),
+        Index("ix_user_books_user_status", "user_id", "status", "id"),
+        Index("ix_user_books_book_id", "book_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -13,5 +13,6 @@ class UserSettings(Base):
     line_height = Column(Float, default=1.8)
     paragraph_spacing = Column(Integer, default=16)
     spritz_speed = Column(Integer, default=250)
+    version = Column(Integer, nullable=False, default=0)
 
     user = relationship("User", back_populates="settings")
@@ -0,0 +1,110 @@
+from collections import defaultdict
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, event, inspect, update, delete
+from sqlalchemy.orm import Session
+from datetime import datetime
+from app.core.database import Base
+from app.models.book import Book
+from app.models.user_book import UserBook
+from app.models.reading_session import ReadingSession
+
+
+class UserStats(Base):
+    """
+    Статистика пользователя для профиля. Поддерживается инкрементально
+    при изменении книг в библиотеке и сессий чтения (см. _track_user_stats).
+    Отсутствующая строка считается заново одним агрегатным запросом.
+    """
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    books_read = Column(Integer, nullable=False, default=0)
+    books_in_progress = Column(Integer, nullable=False, default=0)
+    total_pages = Column(Integer, nullable=False, default=0)
+    sessions_count = Column(Integer, nullable=False, default=0)
+    speed_sum = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def average_speed(self) -> float:
+        return self.speed_sum / self.sessions_count if self.sessions_count else 0.0
+
+
+_MISSING = object()
+
+
+def _old_value(obj, attr: str):
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    if not history.added:
+        return getattr(obj, attr)
+    # Атрибут изменили, не загрузив прежнее значение
+    return _MISSING
+
+
+def contribution(session: Session, status, progress, book_id) -> dict:
+    book = session.get(Book, book_id) if progress else None
+    pages = int(book.total_pages * (progress / 100)) if book and book.total_pages else 0
+    return {
+        "books_read": int(status == "finished"),
+        "books_in_progress": int(status == "reading"),
+        "total_pages": pages,
+    }
+
+
+@event.listens_for(Session, "before_flush")
+def _track_user_stats(session: Session, flush_context, instances):
+    deltas = defaultdict(lambda: defaultdict(int))
+    stale = set()
+    user_books = {obj.id: obj for obj in session.deleted if isinstance(obj, UserBook)}
+
+    def add(user_id, values, sign):
+        for field, value in values.items():
+            deltas[user_id][field] += sign * value
+
+    def owner(user_book_id):
+        user_book = user_books.get(user_book_id) or session.get(UserBook, user_book_id)
+        return user_book.user_id if user_book else None
+
+    for obj in session.new:
+        if isinstance(obj, UserBook):
+            add(obj.user_id, contribution(session, obj.status, obj.progress_percent, obj.book_id), 1)
+        elif isinstance(obj, ReadingSession):
+            add(owner(obj.user_book_id), {"sessions_count": 1, "speed_sum": obj.speed_wpm or 0}, 1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, UserBook):
+            continue
+        state = inspect(obj)
+        # Смена позиции без смены прогресса и статуса статистику не меняет
+        if not (state.attrs.status.history.has_changes() or state.attrs.progress_percent.history.has_changes()):
+            continue
+        old_status = _old_value(obj, "status")
+        old_progress = _old_value(obj, "progress_percent")
+        if old_status is _MISSING or old_progress is _MISSING:
+            stale.add(obj.user_id)
+            continue
+        add(obj.user_id, contribution(session, old_status, old_progress, obj.book_id), -1)
+        add(obj.user_id, contribution(session, obj.status, obj.progress_percent, obj.book_id), 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, UserBook):
+            add(obj.user_id, contribution(session, obj.status, obj.progress_percent, obj.book_id), -1)
+        elif isinstance(obj, ReadingSession):
+            add(owner(obj.user_book_id), {"sessions_count": 1, "speed_sum": obj.speed_wpm or 0}, -1)
+
+    for user_id, values in deltas.items():
+        values = {field: value for field, value in values.items() if value}
+        if user_id is None or user_id in stale or not values:
+            continue
+        # Строки может не быть: тогда она посчитается целиком при первом чтении
+        session.execute(
+            update(UserStats)
+            .where(UserStats.user_id == user_id)
+            .values({field: getattr(UserStats, field) + value for field, value in values.items()})
+        )
+
+    for user_id in stale:
+        session.execute(delete(UserStats).where(UserStats.user_id == user_id))
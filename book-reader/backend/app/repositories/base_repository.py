@@ -1,6 +1,6 @@
 from typing import Generic, TypeVar, Type, Optional, List
 from sqlalchemy.orm import Session
-from app.core.database import Base
+from app.core.database import Base, DbSession
 
 ModelType = TypeVar("ModelType", bound=Base)
 
@@ -23,6 +23,13 @@ class BaseRepository(Generic[ModelType]):
         self.db.refresh(obj)
         return obj
 
+    def create_many(self, items: List[dict]) -> List[ModelType]:
+        """Создание многих записей одним пакетным INSERT и одним коммитом"""
+        objs = [self.model(**data) for data in items]
+        self.db.add_all(objs)
+        self.db.commit()
+        return objs
+
     def update(self, id: int, data: dict) -> Optional[ModelType]:
         obj = self.get(id)
         if obj:
@@ -39,3 +46,42 @@ class BaseRepository(Generic[ModelType]):
             self.db.commit()
             return True
         return False
+
+
+class AsyncBaseRepository(Generic[ModelType]):
+    """
+    Асинхронная версия репозитория. Запросы описаны один раз в синхронном
+    репозитории и выполняются через run_sync сессии: в greenlet поверх
+    асинхронного драйвера или в пуле потоков, в зависимости от settings.db_async.
+    """
+
+    repository_class: Type[BaseRepository] = BaseRepository
+
+    def __init__(self, db: DbSession):
+        self.db = db
+
+    async def _run(self, method: str, *args, **kwargs):
+        def call(session: Session):
+            result = getattr(self.repository_class(session), method)(*args, **kwargs)
+            # Завершаем транзакцию, чтобы соединение вернулось в пул до следующего await
+            session.commit()
+            return result
+        return await self.db.run_sync(call)
+
+    async def get(self, id: int) -> Optional[ModelType]:
+        return await self._run("get", id)
+
+    async def get_all(self, skip: int = 0, limit: int = 100) -> List[ModelType]:
+        return await self._run("get_all", skip, limit)
+
+    async def create(self, data: dict) -> ModelType:
+        return await self._run("create", data)
+
+    async def create_many(self, items: List[dict]) -> List[ModelType]:
+        return await self._run("create_many", items)
+
+    async def update(self, id: int, data: dict) -> Optional[ModelType]:
+        return await self._run("update", id, data)
+
+    async def delete(self, id: int) -> bool:
+        return await self._run("delete", id)
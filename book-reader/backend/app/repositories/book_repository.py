@@ -1,7 +1,46 @@
-from typing import List
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from sqlalchemy import column, func, literal_column, or_, table
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query, Session
+from app.core.database import is_sqlite
+from app.core.fulltext import match_all, query_terms
 from app.models.book import Book
-from app.repositories.base_repository import BaseRepository
+from app.models.bookmark import Bookmark
+from app.models.reading_session import ReadingSession
+from app.models.user_book import UserBook
+from app.repositories.base_repository import AsyncBaseRepository, BaseRepository
+
+
+books_fts = table("books_fts", column("rowid"))
+# Чем меньше bm25, тем выше релевантность. Веса колонок: название, автор, аннотация
+BOOKS_FTS_RANK = func.bm25(literal_column("books_fts"), 10.0, 5.0, 1.0)
+
+def apply_search(query: Query, search: str) -> Optional[Query]:
+    """
+    Условие поиска и сортировка по релевантности для запроса, в котором есть книги.
+    Все слова обязательны. На SQLite - полнотекстовый индекс books_fts,
+    на других базах - ILIKE по основам тех же слов.
+
+    Returns:
+        Query или None, если в строке нет ни одного слова
+    """
+    if is_sqlite:
+        match = match_all(search)
+        if match is None:
+            return None
+        return (
+            query.join(books_fts, books_fts.c.rowid == Book.id)
+            .filter(literal_column("books_fts").op("MATCH")(match))
+            .order_by(BOOKS_FTS_RANK)
+        )
+
+    terms = query_terms(search)
+    if not terms:
+        return None
+    for term in terms:
+        pattern = f"%{term}%"
+        query = query.filter(or_(Book.title.ilike(pattern), Book.author.ilike(pattern), Book.annotation.ilike(pattern)))
+    return query.order_by(Book.title)
 
 
 class BookRepository(BaseRepository[Book]):
@@ -9,12 +48,82 @@ class BookRepository(BaseRepository[Book]):
         super().__init__(Book, db)
 
     def search(self, query: str, skip: int = 0, limit: int = 20) -> List[Book]:
-        return (
-            self.db.query(Book)
-            .filter(
-                (Book.title.ilike(f"%{query}%")) | (Book.author.ilike(f"%{query}%"))
-            )
-            .offset(skip)
-            .limit(limit)
-            .all()
-        )
+        """Поиск по всем книгам, по убыванию релевантности"""
+        found = apply_search(self.db.query(Book), query)
+        if found is None:
+            return []
+        return found.offset(skip).limit(limit).all()
+
+    def get_by_hash(self, file_hash: str) -> Optional[Book]:
+        return self.db.query(Book).filter(Book.file_hash == file_hash).first()
+
+    def get_by_flibusta_id(self, flibusta_id: str) -> Optional[Book]:
+        return self.db.query(Book).filter(Book.flibusta_id == flibusta_id).first()
+
+    def count_by_file_path(self, file_path: str) -> int:
+        return self.db.query(Book).filter(Book.file_path == file_path).count()
+
+    def attach_flibusta_id(self, book_id: int, flibusta_id: str) -> Optional[Book]:
+        """
+        ID Флибусты для книги, у которой его нет. ID уникален: если его
+        параллельно получила другая книга, запись остается без изменений.
+        """
+        try:
+            self.db.query(Book).filter(Book.id == book_id, Book.flibusta_id.is_(None)).update({"flibusta_id": flibusta_id})
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+        return self.get(book_id)
+
+    def merge_into(self, book_id: int, keep_id: int) -> List[int]:
+        """
+        Перенос записей библиотеки с книги-дубликата на keep_id и удаление дубликата,
+        как в миграции 6: если у пользователя есть обе книги, закладки и сессии чтения
+        переходят на его запись с оставшейся книгой.
+
+        Returns:
+            List[int]: id удаленных записей библиотеки
+        """
+        kept = {user_id: id for id, user_id in self.db.query(UserBook.id, UserBook.user_id).filter(UserBook.book_id == keep_id)}
+        removed = []
+        for user_book in self.db.query(UserBook).filter(UserBook.book_id == book_id).all():
+            kept_id = kept.get(user_book.user_id)
+            if kept_id is None:
+                user_book.book_id = keep_id
+                continue
+            for model in (Bookmark, ReadingSession):
+                self.db.query(model).filter(model.user_book_id == user_book.id).update(
+                    {"user_book_id": kept_id}, synchronize_session=False
+                )
+            removed.append(user_book.id)
+            self.db.delete(user_book)
+        self.db.flush()
+
+        duplicate, keeper = self.get(book_id), self.get(keep_id)
+        flibusta_id = duplicate.flibusta_id
+        self.db.delete(duplicate)
+        # ID Флибусты уникален: переносим его после удаления дубликата
+        self.db.flush()
+        if flibusta_id and keeper.flibusta_id is None:
+            keeper.flibusta_id = flibusta_id
+        self.db.commit()
+        return removed
+
+
+class AsyncBookRepository(AsyncBaseRepository[Book]):
+    repository_class = BookRepository
+
+    async def search(self, query: str, skip: int = 0, limit: int = 20) -> List[Book]:
+        return await self._run("search", query, skip, limit)
+
+    async def get_by_hash(self, file_hash: str) -> Optional[Book]:
+        return await self._run("get_by_hash", file_hash)
+
+    async def get_by_flibusta_id(self, flibusta_id: str) -> Optional[Book]:
+        return await self._run("get_by_flibusta_id", flibusta_id)
+
+    async def count_by_file_path(self, file_path: str) -> int:
+        return await self._run("count_by_file_path", file_path)
+
+    async def attach_flibusta_id(self, book_id: int, flibusta_id: str) -> Optional[Book]:
+        return await self._run("attach_flibusta_id", book_id, flibusta_id)
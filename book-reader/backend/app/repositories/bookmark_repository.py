@@ -1,27 +1,83 @@
-from typing import List
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, load_only
 from app.models.bookmark import Bookmark
-from app.repositories.base_repository import BaseRepository
+from app.repositories.base_repository import AsyncBaseRepository, BaseRepository
 
 
 class BookmarkRepository(BaseRepository[Bookmark]):
     def __init__(self, db: Session):
         super().__init__(Bookmark, db)
 
-    def get_by_user_book(self, user_book_id: int) -> List[Bookmark]:
-        return (
-            self.db.query(Bookmark)
-            .filter(Bookmark.user_book_id == user_book_id)
-            .order_by(Bookmark.position)
-            .all()
-        )
-
-    def get_all_user_bookmarks(self, user_id: int) -> List[Bookmark]:
-        from app.models.user_book import UserBook
-        return (
-            self.db.query(Bookmark)
-            .join(UserBook)
-            .filter(UserBook.user_id == user_id)
-            .order_by(Bookmark.created_at.desc())
-            .all()
-        )
+    def get_by_user_book(
+        self,
+        user_book_id: int,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[int, int]] = None,
+        columns: Optional[Sequence[str]] = None
+    ) -> List[Bookmark]:
+        """Закладки книги по позиции в тексте, страница после ключа (position, id)"""
+        query = self.db.query(Bookmark).filter(Bookmark.user_book_id == user_book_id)
+        if after is not None:
+            position, bookmark_id = after
+            query = query.filter(or_(
+                Bookmark.position > position,
+                and_(Bookmark.position == position, Bookmark.id > bookmark_id)
+            ))
+        return self._page(query, limit, columns, (Bookmark.position, Bookmark.id))
+
+    def get_all_user_bookmarks(
+        self,
+        user_id: int,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        columns: Optional[Sequence[str]] = None
+    ) -> List[Bookmark]:
+        """Все закладки пользователя, новые первыми, страница после ключа (created_at, id)"""
+        query = self.db.query(Bookmark).filter(Bookmark.user_id == user_id)
+        if after is not None:
+            created_at, bookmark_id = after
+            query = query.filter(or_(
+                Bookmark.created_at < created_at,
+                and_(Bookmark.created_at == created_at, Bookmark.id < bookmark_id)
+            ))
+        return self._page(query, limit, columns, (Bookmark.created_at, Bookmark.id), descending=True)
+
+    def _page(
+        self,
+        query,
+        limit: Optional[int],
+        columns: Optional[Sequence[str]],
+        keys: Sequence,
+        descending: bool = False
+    ) -> List[Bookmark]:
+        if columns is not None:
+            # Колонки ключа сортировки нужны для курсора следующей страницы
+            query = query.options(load_only(*keys, *[getattr(Bookmark, column) for column in columns]))
+        query = query.order_by(*[key.desc() if descending else key for key in keys])
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+
+class AsyncBookmarkRepository(AsyncBaseRepository[Bookmark]):
+    repository_class = BookmarkRepository
+
+    async def get_by_user_book(
+        self,
+        user_book_id: int,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[int, int]] = None,
+        columns: Optional[Sequence[str]] = None
+    ) -> List[Bookmark]:
+        return await self._run("get_by_user_book", user_book_id, limit, after, columns)
+
+    async def get_all_user_bookmarks(
+        self,
+        user_id: int,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        columns: Optional[Sequence[str]] = None
+    ) -> List[Bookmark]:
+        return await self._run("get_all_user_bookmarks", user_id, limit, after, columns)
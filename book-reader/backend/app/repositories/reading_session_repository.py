@@ -2,7 +2,7 @@ from typing import List
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from app.models.reading_session import ReadingSession
-from app.repositories.base_repository import BaseRepository
+from app.repositories.base_repository import AsyncBaseRepository, BaseRepository
 
 
 class ReadingSessionRepository(BaseRepository[ReadingSession]):
@@ -26,3 +26,13 @@ class ReadingSessionRepository(BaseRepository[ReadingSession]):
             .scalar()
         )
         return result if result else 0.0
+
+
+class AsyncReadingSessionRepository(AsyncBaseRepository[ReadingSession]):
+    repository_class = ReadingSessionRepository
+
+    async def get_by_user_book(self, user_book_id: int) -> List[ReadingSession]:
+        return await self._run("get_by_user_book", user_book_id)
+
+    async def get_average_speed(self, user_id: int) -> float:
+        return await self._run("get_average_speed", user_id)
@@ -1,25 +1,64 @@
-from typing import List, Optional
-from sqlalchemy.orm import Session, joinedload
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from sqlalchemy.orm import Session, contains_eager, joinedload, load_only
 from sqlalchemy import and_
 from app.models.user_book import UserBook
 from app.models.book import Book
-from app.repositories.base_repository import BaseRepository
+from app.repositories.base_repository import AsyncBaseRepository, BaseRepository
+from app.repositories.book_repository import apply_search
 
 
 class UserBookRepository(BaseRepository[UserBook]):
     def __init__(self, db: Session):
         super().__init__(UserBook, db)
 
-    def get_user_books(self, user_id: int, status: Optional[str] = None) -> List[UserBook]:
-        query = (
-            self.db.query(UserBook)
-            .filter(UserBook.user_id == user_id)
-            .options(joinedload(UserBook.book))
-        )
+    def get_user_books(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None,
+        columns: Optional[Sequence[str]] = None,
+        book_columns: Optional[Sequence[str]] = None
+    ) -> List[UserBook]:
+        """
+        Книги пользователя по порядку добавления, страница после after_id.
+
+        Args:
+            limit: Сколько записей вернуть, None - все
+            columns: Загружаемые колонки записи, None - все
+            book_columns: Загружаемые колонки книги, None - все, пустой список - книга не нужна
+        """
+        query = self.db.query(UserBook).filter(UserBook.user_id == user_id)
+        if columns is not None:
+            query = query.options(load_only(UserBook.id, *[getattr(UserBook, column) for column in columns]))
+        if book_columns is None:
+            query = query.options(joinedload(UserBook.book))
+        elif book_columns:
+            query = query.options(
+                joinedload(UserBook.book).load_only(*[getattr(Book, column) for column in book_columns])
+            )
         if status:
             query = query.filter(UserBook.status == status)
+        if after_id is not None:
+            query = query.filter(UserBook.id > after_id)
+        query = query.order_by(UserBook.id)
+        if limit is not None:
+            query = query.limit(limit)
         return query.all()
 
+    def search(self, user_id: int, query: str, limit: int = 20) -> List[UserBook]:
+        """Поиск по библиотеке пользователя: название, автор и аннотация, по убыванию релевантности"""
+        found = apply_search(
+            self.db.query(UserBook)
+            .join(UserBook.book)
+            .filter(UserBook.user_id == user_id)
+            .options(contains_eager(UserBook.book)),
+            query
+        )
+        if found is None:
+            return []
+        return found.limit(limit).all()
+
     def get_by_user_and_book(self, user_id: int, book_id: int) -> Optional[UserBook]:
         return (
             self.db.query(UserBook)
@@ -27,3 +66,84 @@ class UserBookRepository(BaseRepository[UserBook]):
             .options(joinedload(UserBook.book))
             .first()
         )
+
+    def get_book_hash(self, user_id: int, book_id: int) -> Optional[str]:
+        """Хеш файла книги из библиотеки пользователя, без загрузки записей"""
+        return (
+            self.db.query(Book.file_hash)
+            .join(UserBook, UserBook.book_id == Book.id)
+            .filter(and_(UserBook.user_id == user_id, UserBook.book_id == book_id))
+            .scalar()
+        )
+
+    def get_or_create(self, user_id: int, book_id: int) -> Tuple[UserBook, bool]:
+        user_book = self.get_by_user_and_book(user_id, book_id)
+        if user_book:
+            return user_book, False
+        user_book = self.create({
+            "user_id": user_id,
+            "book_id": book_id,
+            "status": "planned"
+        })
+        return user_book, True
+
+    def count_by_book(self, book_id: int) -> int:
+        return self.db.query(UserBook).filter(UserBook.book_id == book_id).count()
+
+    def get_owned_ids(self, user_id: int, ids: Iterable[int]) -> Set[int]:
+        """Какие из переданных записей библиотеки принадлежат пользователю"""
+        ids = set(ids)
+        if not ids:
+            return set()
+        rows = (
+            self.db.query(UserBook.id)
+            .filter(UserBook.user_id == user_id, UserBook.id.in_(ids))
+            .all()
+        )
+        return {row.id for row in rows}
+
+    def apply_updates(self, updates: Dict[int, Dict], chunk_size: int = 500) -> None:
+        """
+        Обновление многих записей одной транзакцией.
+        Записи загружаются, а не обновляются UPDATE напрямую, чтобы сработал учет статистики.
+        """
+        ids = list(updates)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            for user_book in self.db.query(UserBook).filter(UserBook.id.in_(chunk)):
+                for key, value in updates[user_book.id].items():
+                    setattr(user_book, key, value)
+        self.db.commit()
+
+
+class AsyncUserBookRepository(AsyncBaseRepository[UserBook]):
+    repository_class = UserBookRepository
+
+    async def get_user_books(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None,
+        columns: Optional[Sequence[str]] = None,
+        book_columns: Optional[Sequence[str]] = None
+    ) -> List[UserBook]:
+        return await self._run("get_user_books", user_id, status, limit, after_id, columns, book_columns)
+
+    async def search(self, user_id: int, query: str, limit: int = 20) -> List[UserBook]:
+        return await self._run("search", user_id, query, limit)
+
+    async def get_by_user_and_book(self, user_id: int, book_id: int) -> Optional[UserBook]:
+        return await self._run("get_by_user_and_book", user_id, book_id)
+
+    async def get_book_hash(self, user_id: int, book_id: int) -> Optional[str]:
+        return await self._run("get_book_hash", user_id, book_id)
+
+    async def get_or_create(self, user_id: int, book_id: int) -> Tuple[UserBook, bool]:
+        return await self._run("get_or_create", user_id, book_id)
+
+    async def count_by_book(self, book_id: int) -> int:
+        return await self._run("count_by_book", book_id)
+
+    async def get_owned_ids(self, user_id: int, ids: Iterable[int]) -> Set[int]:
+        return await self._run("get_owned_ids", user_id, ids)
@@ -1,7 +1,9 @@
-from typing import Optional
-from sqlalchemy.orm import Session
+from typing import Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session, make_transient_to_detached
 from app.models.user import User
-from app.repositories.base_repository import BaseRepository
+from app.models.user_settings import UserSettings
+from app.repositories.base_repository import AsyncBaseRepository, BaseRepository
 
 
 class UserRepository(BaseRepository[User]):
@@ -10,3 +12,38 @@ class UserRepository(BaseRepository[User]):
 
     def get_by_telegram_id(self, telegram_id: int) -> Optional[User]:
         return self.db.query(User).filter(User.telegram_id == telegram_id).first()
+
+    def attach(self, user_id: int, telegram_id: int) -> User:
+        """
+        Пользователь с известным id без запроса к БД.
+        Остальные поля загрузятся при первом обращении к ним.
+        """
+        user = User(id=user_id, telegram_id=telegram_id)
+        make_transient_to_detached(user)
+        return self.db.merge(user, load=False)
+
+    def get_versions(self, user_id: int) -> Tuple[int, int]:
+        """
+        Версии библиотеки и настроек пользователя одним запросом, без загрузки объектов.
+
+        Returns:
+            Tuple[int, int]: library_version и версия настроек (0, если их еще нет)
+        """
+        row = self.db.execute(
+            select(User.library_version, UserSettings.version)
+            .outerjoin(UserSettings, UserSettings.user_id == User.id)
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return 0, 0
+        return row[0] or 0, row[1] or 0
+
+
+class AsyncUserRepository(AsyncBaseRepository[User]):
+    repository_class = UserRepository
+
+    async def get_by_telegram_id(self, telegram_id: int) -> Optional[User]:
+        return await self._run("get_by_telegram_id", telegram_id)
+
+    async def get_versions(self, user_id: int) -> Tuple[int, int]:
+        return await self._run("get_versions", user_id)
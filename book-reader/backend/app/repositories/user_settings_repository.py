@@ -1,7 +1,7 @@
 from typing import Optional
 from sqlalchemy.orm import Session
 from app.models.user_settings import UserSettings
-from app.repositories.base_repository import BaseRepository
+from app.repositories.base_repository import AsyncBaseRepository, BaseRepository
 
 
 class UserSettingsRepository(BaseRepository[UserSettings]):
@@ -16,3 +16,13 @@ class UserSettingsRepository(BaseRepository[UserSettings]):
         if not settings:
             settings = self.create({"user_id": user_id})
         return settings
+
+
+class AsyncUserSettingsRepository(AsyncBaseRepository[UserSettings]):
+    repository_class = UserSettingsRepository
+
+    async def get_by_user(self, user_id: int) -> Optional[UserSettings]:
+        return await self._run("get_by_user", user_id)
+
+    async def get_or_create(self, user_id: int) -> UserSettings:
+        return await self._run("get_or_create", user_id)
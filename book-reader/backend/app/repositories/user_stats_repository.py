@@ -0,0 +1,82 @@
+from collections import defaultdict
+from typing import Dict
+
+from sqlalchemy import Integer, case, cast, func, insert, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models.book import Book
+from app.models.reading_session import ReadingSession
+from app.models.user_book import UserBook
+from app.models.user_stats import UserStats, contribution
+from app.repositories.base_repository import AsyncBaseRepository, BaseRepository
+
+
+class UserStatsRepository(BaseRepository[UserStats]):
+    def __init__(self, db: Session):
+        super().__init__(UserStats, db)
+
+    def aggregate(self, user_id: int):
+        """Вся статистика пользователя одним запросом"""
+        sessions = (
+            select(ReadingSession.speed_wpm)
+            .join(UserBook, UserBook.id == ReadingSession.user_book_id)
+            .where(UserBook.user_id == user_id)
+            .subquery()
+        )
+        return (
+            select(
+                literal(user_id),
+                func.coalesce(func.sum(case((UserBook.status == "finished", 1), else_=0)), 0),
+                func.coalesce(func.sum(case((UserBook.status == "reading", 1), else_=0)), 0),
+                func.coalesce(func.sum(cast(Book.total_pages * (UserBook.progress_percent / 100), Integer)), 0),
+                select(func.count()).select_from(sessions).scalar_subquery(),
+                select(func.coalesce(func.sum(sessions.c.speed_wpm), 0)).scalar_subquery(),
+            )
+            .select_from(UserBook)
+            .outerjoin(Book, Book.id == UserBook.book_id)
+            .where(UserBook.user_id == user_id)
+        )
+
+    def get_or_create(self, user_id: int) -> UserStats:
+        """Чтение по первичному ключу; при первом обращении строка считается агрегатом"""
+        stats = self.db.get(UserStats, user_id, populate_existing=True)
+        if stats:
+            return stats
+
+        columns = ["user_id", "books_read", "books_in_progress", "total_pages", "sessions_count", "speed_sum"]
+        try:
+            # INSERT ... SELECT одной командой, чтобы параллельная запись не проскочила между ними
+            self.db.execute(insert(UserStats).from_select(columns, self.aggregate(user_id)))
+            self.db.commit()
+        except IntegrityError:
+            # Строку уже создал параллельный запрос
+            self.db.rollback()
+        return self.db.get(UserStats, user_id, populate_existing=True)
+
+    def pending_delta(self, user_id: int, pending: Dict[int, Dict]) -> Dict[str, int]:
+        """
+        Поправка статистики на значения из буфера позиций, еще не записанные в БД.
+        Если буфер успели сбросить, значения в БД совпадут с ними и поправка будет нулевой.
+        """
+        delta = defaultdict(int)
+        if not pending:
+            return delta
+        user_books = self.db.query(UserBook).filter(UserBook.id.in_(list(pending)), UserBook.user_id == user_id)
+        for user_book in user_books:
+            values = pending[user_book.id]
+            new_status = values.get("status", user_book.status)
+            new_progress = values.get("progress_percent", user_book.progress_percent)
+            for sign, status, progress in ((-1, user_book.status, user_book.progress_percent), (1, new_status, new_progress)):
+                for field, value in contribution(self.db, status, progress, user_book.book_id).items():
+                    delta[field] += sign * value
+        return delta
+
+
+class AsyncUserStatsRepository(AsyncBaseRepository[UserStats]):
+    repository_class = UserStatsRepository
+
+    async def get_or_create(self, user_id: int) -> UserStats:
+        return await self._run("get_or_create", user_id)
+
+    async def pending_delta(self, user_id: int, pending: Dict[int, Dict]) -> Dict[str, int]:
+        return await self._run("pending_delta", user_id, pending)
@@ -0,0 +1,402 @@
+"""
+Добавление книг в библиотеку: прием файла, парсинг и сохранение результатов.
+
+parse_book_file выполняется в пуле процессов,
+поэтому должна оставаться функцией верхнего уровня.
+"""
+import hashlib
+import os
+import struct
+import uuid
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.book import Book
+from app.repositories.book_repository import BookRepository
+from app.repositories.user_book_repository import UserBookRepository
+from app.services.chapter_store import chapter_store
+from app.services.cover_store import cover_store
+from app.services.fb2_parser import FB2Parser
+from app.services.image_store import image_store
+from app.services.position_index import position_index
+from app.services.spritz_store import spritz_store
+from app.services.text_index import text_index
+
+
+BOOKS_DIR = Path(settings.books_dir)
+BOOKS_DIR.mkdir(parents=True, exist_ok=True)
+
+CHUNK_SIZE = 256 * 1024
+
+
+class BookFormatError(ValueError):
+    """Файл не является FB2 или поврежден"""
+
+
+class BookTooLargeError(BookFormatError):
+    """Файл больше допустимого размера"""
+
+
+TRUNCATED_ARCHIVE = "Архив поврежден или загружен не полностью"
+
+
+def _inflate(decompressor, data: bytes, output: Callable[[bytes], None]) -> None:
+    """
+    Распаковка кусками не больше CHUNK_SIZE. Часть вывода может остаться
+    в декомпрессоре и после того, как весь вход принят, поэтому цикл идет,
+    пока есть вход или вывод.
+    """
+    try:
+        while not decompressor.eof:
+            chunk = decompressor.decompress(data, CHUNK_SIZE)
+            data = decompressor.unconsumed_tail
+            if not chunk and not data:
+                return
+            output(chunk)
+    except zlib.error:
+        raise BookFormatError("Не удалось распаковать архив")
+
+
+class _ZipStream:
+    """
+    Потоковая распаковка ZIP по локальным заголовкам без центрального каталога:
+    наружу отдается содержимое первого .fb2, остальные записи пропускаются.
+    """
+
+    LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+    LOCAL_SIGNATURE = b"PK\x03\x04"
+    DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+    HAS_DESCRIPTOR = 0x08
+
+    def __init__(self, emit: Callable[[bytes], None]):
+        self.emit = emit
+        self.buffer = b""
+        self.entry = None
+        self.found = False
+        self.finished = False
+
+    def feed(self, data: bytes) -> None:
+        self.buffer += data
+        while self.buffer and not self.finished:
+            if self.entry is None:
+                progressed = self._read_header()
+            elif self.entry["phase"] == "data":
+                progressed = self._read_data()
+            else:
+                progressed = self._read_descriptor()
+            if not progressed:
+                return
+
+    def _read_header(self) -> bool:
+        size = self.LOCAL_HEADER.size
+        if len(self.buffer) < 4:
+            return False
+        if not self.buffer.startswith(self.LOCAL_SIGNATURE):
+            # Дошли до центрального каталога: записей больше нет
+            self.finished = True
+            return False
+        if len(self.buffer) < size:
+            return False
+
+        _, _, flags, method, _, _, _, compressed_size, _, name_len, extra_len = self.LOCAL_HEADER.unpack(self.buffer[:size])
+        if len(self.buffer) < size + name_len + extra_len:
+            return False
+
+        name = self.buffer[size:size + name_len].decode("utf-8", errors="replace")
+        self.buffer = self.buffer[size + name_len + extra_len:]
+
+        # Без дескриптора длина несжатой записи неизвестна заранее, такие архивы не поддерживаем
+        if method not in (0, 8) or (method == 0 and flags & self.HAS_DESCRIPTOR):
+            raise BookFormatError("Не удалось распаковать архив")
+
+        is_target = name.lower().endswith(".fb2")
+        if is_target:
+            print(f"Found FB2 file in archive: {name}")
+        self.entry = {
+            "phase": "data",
+            "target": is_target,
+            "descriptor": bool(flags & self.HAS_DESCRIPTOR),
+            "remaining": compressed_size,
+            "decompressor": zlib.decompressobj(-zlib.MAX_WBITS) if method == 8 else None,
+        }
+        return True
+
+    def _read_data(self) -> bool:
+        entry = self.entry
+        output = self.emit if entry["target"] else (lambda _: None)
+
+        if entry["decompressor"] is not None:
+            decompressor = entry["decompressor"]
+            data, self.buffer = self.buffer, b""
+            _inflate(decompressor, data, output)
+            if not decompressor.eof:
+                return False
+            self.buffer = decompressor.unused_data
+        else:
+            take = min(entry["remaining"], len(self.buffer))
+            output(self.buffer[:take])
+            self.buffer = self.buffer[take:]
+            entry["remaining"] -= take
+            if entry["remaining"]:
+                return False
+
+        if entry["target"]:
+            # Берем первый FB2 файл, остаток архива не нужен
+            self.found = True
+            self.finished = True
+        elif entry["descriptor"]:
+            entry["phase"] = "descriptor"
+        else:
+            self.entry = None
+        return True
+
+    def _read_descriptor(self) -> bool:
+        if len(self.buffer) < 4:
+            return False
+        size = 16 if self.buffer.startswith(self.DESCRIPTOR_SIGNATURE) else 12
+        if len(self.buffer) < size:
+            return False
+        self.buffer = self.buffer[size:]
+        self.entry = None
+        return True
+
+    def finish(self) -> None:
+        """Проверка после последнего куска: FB2 файл найден и прочитан до конца"""
+        if self.found:
+            return
+        if self.entry is not None and self.entry["target"]:
+            raise BookFormatError(TRUNCATED_ARCHIVE)
+        raise BookFormatError("В архиве не найден FB2 файл")
+
+
+class _GzipStream:
+    """Потоковая распаковка gzip"""
+
+    def __init__(self, emit: Callable[[bytes], None]):
+        self.emit = emit
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes) -> None:
+        _inflate(self.decompressor, data, self.emit)
+
+    def finish(self) -> None:
+        """Остаток вывода после последнего куска; поток gzip должен быть дочитан до конца"""
+        _inflate(self.decompressor, b"", self.emit)
+        if not self.decompressor.eof:
+            raise BookFormatError(TRUNCATED_ARCHIVE)
+
+
+class BookWriter:
+    """
+    Прием книги потоком: формат (ZIP, gzip или XML) определяется по первым байтам,
+    архивы распаковываются на лету, хеш считается по мере записи.
+    Файл пишется один раз - во временное имя в папке хранилища, откуда
+    store_parsed_book переносит его переименованием.
+    """
+
+    XML_PREFIXES = (b"<?xml", b"<FictionBook")
+    SNIFF_SIZE = 64
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or settings.max_book_size
+        self.path = BOOKS_DIR / f".incoming_{uuid.uuid4().hex}.fb2"
+        self.file = open(self.path, "wb")
+        self.digest = hashlib.sha256()
+        self.received = 0
+        self.size = 0
+        self.prefix = b""
+        self.archive = None
+        self._feed = None
+
+    def write(self, chunk: bytes) -> None:
+        self.received += len(chunk)
+        if self.received > self.max_size:
+            raise BookTooLargeError("Файл слишком большой")
+
+        if self._feed is None:
+            self.prefix += chunk
+            if len(self.prefix) < 4:
+                return
+            chunk, self.prefix = self.prefix, b""
+            self._feed = self._detect(chunk)
+        self._feed(chunk)
+
+    def consume(self, source: BinaryIO) -> None:
+        """Запись из файлового объекта кусками"""
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            self.write(chunk)
+
+    def _detect(self, head: bytes) -> Callable[[bytes], None]:
+        if head.startswith(b"PK\x03\x04"):
+            print("Detected ZIP archive, extracting...")
+            self.archive = _ZipStream(self._emit)
+            return self.archive.feed
+        if head.startswith(b"\x1f\x8b"):
+            print("Detected gzip, decompressing...")
+            self.archive = _GzipStream(self._emit)
+            return self.archive.feed
+        return self._emit
+
+    def _emit(self, data: bytes) -> None:
+        if not data:
+            return
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise BookTooLargeError("Файл слишком большой")
+
+        if len(self.prefix) < self.SNIFF_SIZE:
+            self.prefix += data[:self.SNIFF_SIZE]
+        self.digest.update(data)
+        self.file.write(data)
+
+    def finish(self) -> str:
+        """Завершение записи, возвращает SHA-256 содержимого"""
+        if self._feed is None and self.prefix:
+            # Файл короче 4 байт
+            data, self.prefix = self.prefix, b""
+            self._emit(data)
+        if self.archive is not None:
+            # Остаток распакованных данных; обрезанный архив - ошибка, а не неполная книга
+            self.archive.finish()
+        self.file.close()
+
+        # Проверяем, что это XML
+        head = self.prefix.lstrip(b"\xef\xbb\xbf").lstrip()
+        if not head.startswith(self.XML_PREFIXES):
+            # Логируем начало файла для диагностики
+            print(f"Invalid content (first {self.SNIFF_SIZE} bytes): {self.prefix}")
+            raise BookFormatError(
+                "Файл не похож на FB2. Попробуйте другую книгу или повторите позже."
+            )
+
+        return self.digest.hexdigest()
+
+    def discard(self) -> None:
+        """Удаление временного файла, если он не перенесен в хранилище"""
+        if not self.file.closed:
+            self.file.close()
+        if self.path.exists():
+            os.remove(self.path)
+
+
+def content_path(file_hash: str) -> Path:
+    """Путь к файлу книги в хранилище, адресуемом по содержимому"""
+    return BOOKS_DIR / file_hash[:2] / f"{file_hash}.fb2"
+
+
+def parse_book_file(file_path: str) -> Dict:
+    """Потоковый парсинг книги"""
+    return FB2Parser(file_path).parse_streaming()
+
+
+def store_parsed_book(
+    db: Session,
+    parsed_data: Dict,
+    tmp_path: str,
+    file_hash: str,
+    file_name: str,
+    flibusta_id: Optional[str] = None
+) -> Book:
+    """
+    Перенос файла в хранилище, запись книги в БД, глав в хранилище и обложки на диск.
+    Одинаковые файлы хранятся один раз и общие для всех пользователей.
+    """
+    file_path = content_path(file_hash)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, file_path)
+
+    book_repo = BookRepository(db)
+    try:
+        book = book_repo.create({
+            "title": parsed_data["title"],
+            "author": parsed_data["author"],
+            "annotation": parsed_data["annotation"],
+            "file_path": str(file_path),
+            "file_name": file_name,
+            "file_hash": file_hash,
+            "flibusta_id": flibusta_id,
+            "total_pages": parsed_data["total_pages"]
+        })
+    except IntegrityError:
+        # Ту же книгу параллельно добавил другой запрос: берем его запись,
+        # хранилища этого запроса еще не созданы
+        db.rollback()
+        book = book_repo.get_by_hash(file_hash)
+        if book is None and flibusta_id:
+            book = book_repo.get_by_flibusta_id(flibusta_id)
+        if book is None:
+            raise
+        # Другой файл с тем же ID Флибусты: перенесенный файл больше не нужен
+        if book_repo.count_by_file_path(str(file_path)) == 0:
+            remove_book_file(str(file_path))
+        return book
+
+    # Главы сохраняем сразу, чтобы читалка не парсила файл повторно
+    chapter_store.save(book.id, file_hash, parsed_data["chapters"], parsed_data["notes"])
+    text_index.build(book.id, file_hash, parsed_data["chapters"])
+    spritz_store.save(book.id, file_hash, parsed_data["chapters"])
+    position_index.build(book.id, file_hash, parsed_data["chapters"])
+    if parsed_data["cover"]:
+        cover_path = cover_store.save(book.id, parsed_data["cover"])
+        if cover_path:
+            book = book_repo.update(book.id, {"cover_path": cover_path})
+
+    return book
+
+
+def release_book(db: Session, book: Book) -> None:
+    """Удаление книги и ее файлов, когда она не осталась ни у одного пользователя"""
+    if UserBookRepository(db).count_by_book(book.id) > 0:
+        return
+
+    book_id, file_path = book.id, book.file_path
+    book_repo = BookRepository(db)
+    book_repo.delete(book_id)
+
+    delete_book_files(book_id)
+    # Старые книги и дубликаты могут ссылаться на один файл
+    if file_path and book_repo.count_by_file_path(file_path) == 0:
+        remove_book_file(file_path)
+
+
+def merge_duplicate_book(db: Session, book: Book, keeper: Book) -> List[int]:
+    """
+    Сведение книги к другой записи с тем же файлом: библиотеки переходят на keeper,
+    хранилища и файл дубликата удаляются после коммита.
+
+    Returns:
+        List[int]: id удаленных записей библиотеки (у пользователя были обе книги)
+    """
+    book_id, file_path = book.id, book.file_path
+    book_repo = BookRepository(db)
+    removed = book_repo.merge_into(book_id, keeper.id)
+    print(f"Merged duplicate book {book_id} into {keeper.id}")
+
+    delete_book_files(book_id)
+    if file_path and book_repo.count_by_file_path(file_path) == 0:
+        remove_book_file(file_path)
+    return removed
+
+
+def delete_book_files(book_id: int) -> None:
+    """Удаление распарсенных данных книги из всех хранилищ"""
+    chapter_store.delete(book_id)
+    text_index.delete(book_id)
+    spritz_store.delete(book_id)
+    position_index.delete(book_id)
+    image_store.delete(book_id)
+    cover_store.delete(book_id)
+
+
+def remove_book_file(file_path: str) -> None:
+    """Удаление файла книги, на который больше не ссылается ни одна запись"""
+    if os.path.exists(file_path):
+        try:
+            os.remove(file_path)
+        except Exception as e:
+            print(f"Warning: Could not delete file {file_path}: {e}")
@@ -0,0 +1,123 @@
+"""
+Структурное представление главы: плоский список блоков с разметкой внутри текста
+"""
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+# Блок - список [тип, текст] или [тип, текст, spans], spans только если есть разметка.
+# Номер блока в главе - номер абзаца (id абзаца в читалке, позиции, поиск, Spritz).
+PARAGRAPH = "p"
+SUBTITLE = "subtitle"
+EPIGRAPH = "epigraph"
+CITE = "cite"
+VERSE = "verse"
+AUTHOR = "author"
+# Подзаголовки вложенных секций: h1 - секция внутри главы, глубже - h2..h4
+HEADINGS = ("h1", "h2", "h3", "h4")
+# Пустая строка и иллюстрация слов не содержат, у иллюстрации вместо текста - id картинки
+EMPTY = "empty"
+IMAGE = "image"
+TEXTLESS = frozenset((EMPTY, IMAGE))
+
+# Разметка: [начало, конец, метка] или [начало, конец, "a", ссылка].
+# Смещения - в единицах UTF-16 (индексы строк JavaScript), отрезки могут вкладываться
+INLINE_MARKS = {
+    "strong": "strong",
+    "emphasis": "em",
+    "strikethrough": "s",
+    "sub": "sub",
+    "sup": "sup",
+    "code": "code",
+    "a": "a",
+}
+
+
+def heading(level: int) -> str:
+    """Тип подзаголовка секции на глубине level (1 - секция внутри главы)"""
+    return HEADINGS[min(level, len(HEADINGS)) - 1]
+
+
+def utf16_len(text: str) -> int:
+    """Длина в единицах UTF-16, как length строки в JavaScript"""
+    return len(text.encode("utf-16-le")) >> 1
+
+
+def block_text(block: List) -> str:
+    """Текст блока; у пустой строки и иллюстрации текста нет"""
+    return "" if block[0] in TEXTLESS else block[1]
+
+
+def split_paragraphs(blocks: Iterable[List]) -> List[List[str]]:
+    """
+    Слова каждого блока главы, включая блоки без слов: номер элемента - номер абзаца.
+    Слова - как str.split(), одна нумерация для позиций, поиска и Spritz.
+    """
+    return [block_text(block).split() for block in blocks]
+
+
+def count_words(blocks: Iterable[List]) -> int:
+    return sum(len(block_text(block).split()) for block in blocks)
+
+
+def iter_text_blocks(blocks: Iterable[List]) -> Iterator[Tuple[int, str]]:
+    """(номер абзаца, текст) блоков, в которых есть текст"""
+    for index, block in enumerate(blocks):
+        text = block_text(block)
+        if text:
+            yield index, text
+
+
+class InlineText:
+    """
+    Текст блока с разметкой, собирается за один проход по элементу:
+    куски текста копятся в списке и склеиваются один раз в build.
+    Смещения считаются в символах и переводятся в UTF-16 только для текста
+    с символами вне BMP.
+    """
+
+    __slots__ = ("parts", "spans", "length")
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.spans: List[List] = []
+        self.length = 0
+
+    def append(self, text: Optional[str]) -> None:
+        if text:
+            self.parts.append(text)
+            self.length += len(text)
+
+    def open(self, mark: str, href: Optional[str] = None) -> List:
+        # Отрезок добавляется до содержимого: внешние отрезки идут раньше вложенных
+        span = [self.length, self.length, mark]
+        if href is not None:
+            span.append(href)
+        self.spans.append(span)
+        return span
+
+    def close(self, span: List) -> None:
+        span[1] = self.length
+
+    def build(self, kind: str) -> Optional[List]:
+        """Блок с текстом без пробелов по краям; None - текста нет"""
+        text = "".join(self.parts)
+        stripped = text.strip()
+        if not stripped:
+            return None
+
+        block = [kind, stripped]
+        if self.spans:
+            lead = len(text) - len(text.lstrip())
+            size = len(stripped)
+            # Символы вне BMP занимают в UTF-16 две единицы
+            astral = utf16_len(stripped) != size
+            spans = []
+            for start, end, *rest in self.spans:
+                start, end = max(start - lead, 0), min(end - lead, size)
+                if start < end:
+                    if astral:
+                        start, end = utf16_len(stripped[:start]), utf16_len(stripped[:end])
+                    spans.append([start, end, *rest])
+            if spans:
+                block.append(spans)
+        return block
@@ -0,0 +1,174 @@
+"""
+Хранилище предварительно распарсенных глав книг
+"""
+import contextlib
+import hashlib
+import json
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from app.core.config import settings
+from app.models.book import Book
+from app.repositories.book_repository import BookRepository
+from app.services.chapter_blocks import count_words
+from app.services.cover_store import cover_store
+
+
+def compute_file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 содержимого файла, читаем кусками чтобы не держать файл в памяти"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ChapterStore:
+    """
+    Файловое хранилище глав: один файл на книгу.
+
+    Формат файла:
+        4 байта   - длина заголовка (big-endian)
+        заголовок - JSON с метаданными и оглавлением (смещения глав и примечаний)
+        данные    - главы (JSON список блоков, см. chapter_blocks), каждая сжата zlib
+                    отдельно, за ними примечания одним куском
+
+    Отдельное сжатие глав позволяет читать любую главу без распаковки всей книги.
+    """
+
+    VERSION = 2
+    HEADER_SIZE = struct.Struct(">I")
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, book_id: int, file_hash: str) -> Path:
+        return self.base_dir / f"{book_id}_{file_hash}.chapters"
+
+    @staticmethod
+    def _dump(value) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def save(self, book_id: int, file_hash: str, chapters: Iterable[Dict], notes: Optional[Dict] = None) -> Dict:
+        """
+        Сохранение глав в хранилище. Главы можно передавать генератором,
+        в памяти остаются только сжатые данные. Примечания читаются после глав,
+        поэтому можно передать словарь парсера, который заполняется при проходе.
+
+        Returns:
+            Dict: Заголовок с оглавлением
+        """
+        toc = []
+        blobs = []
+        offset = 0
+        for chapter in chapters:
+            raw = self._dump(chapter["blocks"])
+            blob = zlib.compress(raw, 6)
+            toc.append({
+                "title": chapter["title"],
+                "offset": offset,
+                "length": len(blob),
+                "size": len(raw),
+                "words": chapter.get("words", count_words(chapter["blocks"])),
+            })
+            blobs.append(blob)
+            offset += len(blob)
+
+        notes_entry = None
+        if notes:
+            blob = zlib.compress(self._dump(notes), 6)
+            notes_entry = {"offset": offset, "length": len(blob), "count": len(notes)}
+            blobs.append(blob)
+
+        header = {
+            "version": self.VERSION,
+            "book_id": book_id,
+            "file_hash": file_hash,
+            "chapters": toc,
+            "notes": notes_entry,
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+        # Пишем во временный файл и атомарно переименовываем,
+        # чтобы параллельный читатель не увидел недописанный файл
+        path = self._path(book_id, file_hash)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp_path, "wb") as f:
+            f.write(self.HEADER_SIZE.pack(len(header_bytes)))
+            f.write(header_bytes)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+
+        return header
+
+    def _read_header(self, f) -> Dict:
+        (header_len,) = self.HEADER_SIZE.unpack(f.read(self.HEADER_SIZE.size))
+        return json.loads(f.read(header_len).decode("utf-8"))
+
+    def load_index(self, book_id: int, file_hash: str) -> Optional[Dict]:
+        path = self._path(book_id, file_hash)
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            header = self._read_header(f)
+        if header.get("version") != self.VERSION:
+            return None
+        return header
+
+    def read_chapters(self, book_id: int, file_hash: str, start: int = 0, end: Optional[int] = None) -> List[Dict]:
+        """Чтение глав [start, end) без распаковки остальных"""
+        path = self._path(book_id, file_hash)
+        with open(path, "rb") as f:
+            header = self._read_header(f)
+            data_start = f.tell()
+            toc = header["chapters"][start:end]
+
+            chapters = []
+            for entry in toc:
+                f.seek(data_start + entry["offset"])
+                chapters.append({
+                    "title": entry["title"],
+                    "blocks": json.loads(zlib.decompress(f.read(entry["length"]))),
+                })
+            return chapters
+
+    def read_notes(self, book_id: int, file_hash: str) -> Dict[str, List]:
+        """Примечания книги: блоки по id, на который ссылается разметка глав"""
+        path = self._path(book_id, file_hash)
+        with open(path, "rb") as f:
+            header = self._read_header(f)
+            entry = header.get("notes")
+            if not entry:
+                return {}
+            f.seek(f.tell() + entry["offset"])
+            return json.loads(zlib.decompress(f.read(entry["length"])))
+
+    def save_parsed(self, book: Book, book_repo: BookRepository, file_hash: str, parsed_data: Dict) -> Dict:
+        """
+        Сохранение глав книги, загруженной до появления хранилища или до смены его формата.
+        Хеш и разбор файла считаются в пуле процессов (parse_book_file),
+        здесь остается только запись хранилища и БД.
+        """
+        if book.file_hash != file_hash:
+            book_repo.update(book.id, {"file_hash": file_hash})
+
+        header = self.save(book.id, file_hash, parsed_data["chapters"], parsed_data["notes"])
+
+        cover = parsed_data.get("cover")
+        if cover and not book.cover_path:
+            book_repo.update(book.id, {"cover_path": cover_store.save(book.id, cover)})
+        return header
+
+    def delete(self, book_id: int) -> None:
+        for path in self.base_dir.glob(f"{book_id}_*.chapters"):
+            # Оставшийся файл не мешает: хранилище читается только по id и хешу книги
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+
+chapter_store = ChapterStore(Path(settings.chapters_dir))
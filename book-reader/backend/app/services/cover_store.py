@@ -0,0 +1,104 @@
+"""
+Хранилище обложек книг и их уменьшенных копий
+"""
+import hashlib
+import io
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from PIL import Image
+
+from app.core.config import settings
+
+
+class CoverStore:
+    """
+    Обложка сохраняется один раз при добавлении книги:
+        {book_id}_{hash}.{ext}          - оригинал
+        {book_id}_{hash}_{size}.jpg     - уменьшенные копии
+
+    Хеш содержимого в имени файла служит ETag, поэтому отдавать обложку
+    можно без чтения файла.
+    """
+
+    THUMBNAIL_SIZES: Dict[str, int] = {
+        "small": 160,
+        "medium": 320,
+    }
+    FORMATS = {
+        "JPEG": ("jpg", "image/jpeg"),
+        "PNG": ("png", "image/png"),
+        "GIF": ("gif", "image/gif"),
+        "WEBP": ("webp", "image/webp"),
+    }
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    def save(self, book_id: int, cover: bytes) -> Optional[str]:
+        """
+        Сохранение обложки и миниатюр
+
+        Returns:
+            str: Путь к оригиналу обложки или None, если изображение не читается
+        """
+        try:
+            image = Image.open(io.BytesIO(cover))
+            image.load()
+        except Exception as e:
+            print(f"Warning: Could not read cover for book {book_id}: {e}")
+            return None
+
+        ext, _ = self.FORMATS.get(image.format, ("jpg", "image/jpeg"))
+        digest = hashlib.sha256(cover).hexdigest()[:16]
+        stem = f"{book_id}_{digest}"
+
+        original_path = self.base_dir / f"{stem}.{ext}"
+        with open(original_path, "wb") as f:
+            f.write(cover)
+
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        for size, width in self.THUMBNAIL_SIZES.items():
+            thumbnail = image.copy()
+            thumbnail.thumbnail((width, width * 2), Image.LANCZOS)
+            thumbnail.save(self.base_dir / f"{stem}_{size}.jpg", "JPEG", quality=82, optimize=True)
+
+        return str(original_path)
+
+    def resolve(self, cover_path: str, size: str) -> Optional[Dict]:
+        """Путь, тип и ETag нужного варианта обложки"""
+        original = Path(cover_path)
+        stem = original.stem
+        digest = stem.rsplit("_", 1)[-1]
+
+        if size == "original":
+            path = original
+            media_type = next(
+                (media for ext, media in self.FORMATS.values() if original.suffix == f".{ext}"),
+                "application/octet-stream"
+            )
+        else:
+            path = original.with_name(f"{stem}_{size}.jpg")
+            media_type = "image/jpeg"
+
+        if not path.exists():
+            return None
+
+        return {
+            "path": str(path),
+            "media_type": media_type,
+            "etag": f'"{digest}-{size}"',
+        }
+
+    def delete(self, book_id: int) -> None:
+        for path in self.base_dir.glob(f"{book_id}_*"):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Warning: Could not delete cover {path}: {e}")
+
+
+cover_store = CoverStore(Path(settings.covers_dir))
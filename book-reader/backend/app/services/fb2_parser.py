@@ -1,153 +1,319 @@
 import re
 from lxml import etree
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 import base64
 
+from app.services.chapter_blocks import (
+    AUTHOR, CITE, EMPTY, EPIGRAPH, IMAGE, INLINE_MARKS, PARAGRAPH, SUBTITLE, VERSE,
+    InlineText, count_words, heading,
+)
+
+FB2_NS = 'http://www.gribuser.ru/xml/fictionbook/2.0'
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+_INLINE_TAGS = {f'{{{FB2_NS}}}{tag}': mark for tag, mark in INLINE_MARKS.items()}
+
 
 class FB2Parser:
     def __init__(self, file_path: str):
         self.file_path = file_path
-        self.tree = None
-        self.root = None
-        self.ns = {'fb': 'http://www.gribuser.ru/xml/fictionbook/2.0'}
+        self.ns = {'fb': FB2_NS}
+        self.metadata: Dict = {}
+        # Примечания по id: заполняются при проходе iter_chapters, после глав
+        self.notes: Dict[str, List[List]] = {}
         
     def parse(self) -> Dict:
-        try:
-            self.tree = etree.parse(self.file_path)
-            self.root = self.tree.getroot()
+        # Метаданные, главы и обложка собираются за один проход по файлу
+        return self.parse_streaming()
+    
+    def read_title_info(self, title_info) -> Dict:
+        info = {
+            "title": "Без названия",
+            "author": "Неизвестный автор",
+            "annotation": None,
+            "cover_id": None
+        }
+        if title_info is None:
+            return info
+        
+        author_found = False
+        for elem in title_info:
+            tag = etree.QName(elem).localname if isinstance(elem.tag, str) else None
+            
+            if tag == 'book-title':
+                if elem.text and elem.text.strip():
+                    info["title"] = elem.text.strip()
+            
+            elif tag == 'author' and not author_found:
+                # Как и раньше, берем только первого автора
+                author_found = True
+                parts = []
+                for name_tag in ('first-name', 'last-name'):
+                    name_elem = elem.find(f'fb:{name_tag}', self.ns)
+                    if name_elem is not None and name_elem.text:
+                        parts.append(name_elem.text.strip())
+                if parts:
+                    info["author"] = ' '.join(parts)
+            
+            elif tag == 'annotation':
+                text_parts = []
+                for p in elem.iter(f'{{{FB2_NS}}}p'):
+                    if p.text:
+                        text_parts.append(p.text.strip())
+                info["annotation"] = '\n\n'.join(text_parts) if text_parts else None
             
+            elif tag == 'coverpage':
+                image_elem = elem.find('.//fb:image', self.ns)
+                if image_elem is not None:
+                    href = image_elem.get(XLINK_HREF)
+                    if href and href.startswith('#'):
+                        info["cover_id"] = href[1:]
+        
+        return info
+    
+    @staticmethod
+    def decode_binary(binary_elem) -> Optional[bytes]:
+        if binary_elem.text:
+            try:
+                return base64.b64decode(binary_elem.text)
+            except Exception:
+                pass
+        return None
+    
+    def build_chapter(self, section, index: int) -> Optional[Dict]:
+        # Ищем title только на первом уровне секции
+        title_elem = section.find('fb:title', self.ns)
+        title = "Глава " + str(index + 1)
+        
+        if title_elem is not None:
+            title_parts = []
+            for p in title_elem.findall('fb:p', self.ns):
+                # Используем itertext() для захвата текста внутри вложенных тегов
+                text = ''.join(p.itertext()).strip()
+                if text:
+                    title_parts.append(text)
+            if title_parts:
+                title = ' '.join(title_parts)
+        
+        # Блоки главы, подсекции превращаются в подзаголовки
+        blocks: List[List] = []
+        self.extract_blocks(section, blocks, level=1)
+        
+        if any(block[0] != EMPTY for block in blocks):
             return {
-                "title": self.get_title(),
-                "author": self.get_author(),
-                "annotation": self.get_annotation(),
-                "cover": self.get_cover(),
-                "chapters": self.get_chapters(),
-                "total_pages": self.estimate_pages()
+                "title": title,
+                "blocks": blocks,
+                "words": count_words(blocks)
             }
-        except Exception as e:
-            raise Exception(f"Error parsing FB2: {str(e)}")
+        return None
     
-    def get_title(self) -> str:
-        title_elem = self.root.find('.//fb:title-info/fb:book-title', self.ns)
-        return title_elem.text.strip() if title_elem is not None and title_elem.text else "Без названия"
+    def extract_blocks(self, container, blocks: List[List], level: int = 1, kind: str = PARAGRAPH) -> None:
+        """
+        Блоки секции за один проход: текст и разметка каждого абзаца собираются один раз,
+        вложенные секции дописываются в тот же список.
+        kind - тип абзацев контейнера (эпиграф, цитата, стихи).
+        """
+        for elem in container:
+            if not isinstance(elem.tag, str):
+                continue
+            tag = elem.tag.rpartition('}')[2]
+            
+            if tag == 'p':
+                self._append_inline(blocks, kind, elem)
+            
+            elif tag == 'section':
+                subsection_title_elem = elem.find('fb:title', self.ns)
+                if subsection_title_elem is not None:
+                    self._append_title(blocks, heading(level), subsection_title_elem)
+                self.extract_blocks(elem, blocks, level + 1)
+            
+            elif tag == 'title':
+                # Заголовок секции уже добавлен (или это название главы), у стихов - подзаголовок
+                if kind == VERSE:
+                    self._append_title(blocks, SUBTITLE, elem)
+            
+            elif tag == 'subtitle':
+                self._append_inline(blocks, SUBTITLE, elem)
+            
+            elif tag == 'empty-line':
+                blocks.append([EMPTY, ""])
+            
+            elif tag == 'image':
+                href = elem.get(XLINK_HREF)
+                if href and href.startswith('#'):
+                    blocks.append([IMAGE, href[1:]])
+            
+            elif tag == 'epigraph':
+                self.extract_blocks(elem, blocks, level, EPIGRAPH)
+            
+            elif tag in ('cite', 'annotation'):
+                self.extract_blocks(elem, blocks, level, CITE)
+            
+            elif tag == 'poem':
+                self.extract_blocks(elem, blocks, level, VERSE)
+            
+            elif tag == 'stanza':
+                # Строфы разделяются пустой строкой
+                if blocks and blocks[-1][0] == VERSE:
+                    blocks.append([EMPTY, ""])
+                self.extract_blocks(elem, blocks, level, VERSE)
+            
+            elif tag == 'v':
+                self._append_inline(blocks, VERSE, elem)
+            
+            elif tag in ('text-author', 'date'):
+                self._append_inline(blocks, AUTHOR, elem)
+            
+            elif tag == 'table':
+                for row in elem:
+                    inline = InlineText()
+                    for cell in row:
+                        if inline.parts:
+                            inline.append(" | ")
+                        self._inline(cell, inline)
+                    block = inline.build(PARAGRAPH)
+                    if block:
+                        blocks.append(block)
     
-    def get_author(self) -> str:
-        author_elem = self.root.find('.//fb:title-info/fb:author', self.ns)
-        if author_elem is not None:
-            first_name = author_elem.find('fb:first-name', self.ns)
-            last_name = author_elem.find('fb:last-name', self.ns)
-            
-            parts = []
-            if first_name is not None and first_name.text:
-                parts.append(first_name.text.strip())
-            if last_name is not None and last_name.text:
-                parts.append(last_name.text.strip())
-            
-            return ' '.join(parts) if parts else "Неизвестный автор"
-        return "Неизвестный автор"
+    def _append_inline(self, blocks: List[List], kind: str, elem) -> None:
+        if not len(elem):
+            # Абзац без вложенных тегов - большинство в обычной книге
+            text = elem.text.strip() if elem.text else ""
+            if text:
+                blocks.append([kind, text])
+            return
+        inline = InlineText()
+        self._inline(elem, inline)
+        block = inline.build(kind)
+        if block:
+            blocks.append(block)
     
-    def get_annotation(self) -> Optional[str]:
-        annotation_elem = self.root.find('.//fb:title-info/fb:annotation', self.ns)
-        if annotation_elem is not None:
-            text_parts = []
-            for p in annotation_elem.findall('.//fb:p', self.ns):
-                if p.text:
-                    text_parts.append(p.text.strip())
-            return '\n\n'.join(text_parts) if text_parts else None
-        return None
+    def _append_title(self, blocks: List[List], kind: str, title_elem) -> None:
+        # Строки заголовка - один блок через пробел
+        inline = InlineText()
+        for p in title_elem.findall('fb:p', self.ns):
+            if inline.parts:
+                inline.append(' ')
+            self._inline(p, inline)
+        block = inline.build(kind)
+        if block:
+            blocks.append(block)
     
-    def get_cover(self) -> Optional[bytes]:
-        coverpage = self.root.find('.//fb:title-info/fb:coverpage', self.ns)
-        if coverpage is not None:
-            image_elem = coverpage.find('.//fb:image', self.ns)
-            if image_elem is not None:
-                href = image_elem.get('{http://www.w3.org/1999/xlink}href')
-                if href and href.startswith('#'):
-                    binary_id = href[1:]
-                    binary_elem = self.root.find(f'.//fb:binary[@id="{binary_id}"]', self.ns)
-                    if binary_elem is not None and binary_elem.text:
-                        try:
-                            return base64.b64decode(binary_elem.text)
-                        except:
-                            pass
-        return None
+    def _inline(self, elem, inline: InlineText) -> None:
+        """Текст элемента с вложенными тегами, strong/emphasis/ссылки становятся отрезками разметки"""
+        inline.append(elem.text)
+        for child in elem:
+            if isinstance(child.tag, str):
+                mark = _INLINE_TAGS.get(child.tag)
+                span = None if mark is None else inline.open(mark, child.get(XLINK_HREF, "") if mark == "a" else None)
+                # Рекурсия только для вложенной разметки, обычно внутри тега просто текст
+                if len(child):
+                    self._inline(child, inline)
+                else:
+                    inline.append(child.text)
+                if span is not None:
+                    inline.close(span)
+            inline.append(child.tail)
     
-    def get_chapters(self) -> List[Dict]:
-        chapters = []
-        body = self.root.find('.//fb:body', self.ns)
-        
-        if body is not None:
-            # Ищем только секции ПЕРВОГО уровня (прямые дети body)
-            sections = body.findall('fb:section', self.ns)
-            
-            if not sections:
-                sections = [body]
-            
-            for i, section in enumerate(sections):
-                # Ищем title только на первом уровне секции
-                title_elem = section.find('fb:title', self.ns)
-                title = "Глава " + str(i + 1)
-                
-                if title_elem is not None:
-                    title_parts = []
-                    for p in title_elem.findall('fb:p', self.ns):
-                        # Используем itertext() для захвата текста внутри вложенных тегов
-                        text = ''.join(p.itertext()).strip()
-                        if text:
-                            title_parts.append(text)
-                    if title_parts:
-                        title = ' '.join(title_parts)
-                
-                # Извлекаем контент с учетом вложенных подсекций
-                content = self.extract_section_content(section, skip_title=True, level=1)
-                
-                if content:
-                    chapters.append({
-                        "title": title,
-                        "content": content
-                    })
-        
-        return chapters
+    def read_notes(self, body) -> None:
+        """Секции с id из дополнительного body (примечания, комментарии) - цели ссылок в тексте"""
+        for section in body.iter(f'{{{FB2_NS}}}section'):
+            note_id = section.get('id')
+            if note_id:
+                blocks: List[List] = []
+                self.extract_blocks(section, blocks)
+                if blocks:
+                    self.notes[note_id] = blocks
+    
+    def parse_streaming(self) -> Dict:
+        """
+        Разбор через iterparse: главы первого уровня обрабатываются по одной
+        и сразу удаляются из дерева, бинарные вложения кроме обложки отбрасываются.
+        Потребление памяти не зависит от количества иллюстраций в файле.
+        """
+        try:
+            chapters = list(self.iter_chapters())
+            return {
+                **self.metadata,
+                "chapters": chapters
+            }
+        except Exception as e:
+            raise Exception(f"Error parsing FB2: {str(e)}")
     
-    def extract_section_content(self, section, skip_title=False, level=1) -> str:
-        paragraphs = []
+    def iter_chapters(self) -> Iterator[Dict]:
+        """
+        Потоковая выдача глав. После полного прохода в self.metadata
+        доступны title, author, annotation, cover, notes, total_words и total_pages.
+        """
+        body_tag = f'{{{FB2_NS}}}body'
+        section_tag = f'{{{FB2_NS}}}section'
+        description_tag = f'{{{FB2_NS}}}description'
+        binary_tag = f'{{{FB2_NS}}}binary'
         
-        for elem in section:
-            # Пропускаем title на первом уровне, если указано
-            if skip_title and elem.tag.endswith('title'):
+        self.metadata = {
+            "title": "Без названия",
+            "author": "Неизвестный автор",
+            "annotation": None,
+            "cover": None,
+            "notes": self.notes,
+            "total_words": 0,
+            "total_pages": 1
+        }
+        self.notes.clear()
+        cover_id = None
+        # Корень свой у каждого прохода, между вызовами дерево не хранится
+        root = None
+        main_body = None
+        section_index = 0
+        words = 0
+        
+        context = etree.iterparse(self.file_path, events=('start', 'end'), huge_tree=True)
+        for event, elem in context:
+            if event == 'start':
+                if root is None:
+                    root = elem
+                elif elem.tag == body_tag and main_body is None:
+                    main_body = elem
                 continue
-                
-            if elem.tag.endswith('p'):
-                text = ''.join(elem.itertext()).strip()
-                if text:
-                    paragraphs.append(text)
-                    
-            elif elem.tag.endswith('section'):
-                # Обрабатываем вложенные подсекции (подглавы)
-                subsection_title_elem = elem.find('fb:title', self.ns)
-                if subsection_title_elem is not None:
-                    title_parts = []
-                    for p in subsection_title_elem.findall('fb:p', self.ns):
-                        # Используем itertext() для захвата текста внутри вложенных тегов (<strong>, <em> и т.д.)
-                        text = ''.join(p.itertext()).strip()
-                        if text:
-                            title_parts.append(text)
-                    if title_parts:
-                        # Добавляем маркеры в зависимости от уровня вложенности
-                        marker = '#' * min(level + 2, 6)  # Максимум 6 уровней
-                        paragraphs.append(marker + ' ' + ' '.join(title_parts))
-                
-                # Рекурсивно извлекаем контент подсекции с увеличенным уровнем
-                subsection_content = self.extract_section_content(elem, skip_title=True, level=level + 1)
-                if subsection_content:
-                    paragraphs.append(subsection_content)
+            
+            parent = elem.getparent()
+            
+            if elem.tag == description_tag:
+                info = self.read_title_info(elem.find('fb:title-info', self.ns))
+                cover_id = info.pop("cover_id")
+                self.metadata.update(info)
+                self._release(elem)
+            
+            elif elem.tag == binary_tag and parent is root:
+                if cover_id and elem.get('id') == cover_id:
+                    self.metadata["cover"] = self.decode_binary(elem)
+                self._release(elem)
+            
+            elif elem.tag == section_tag and parent is main_body:
+                chapter = self.build_chapter(elem, section_index)
+                section_index += 1
+                self._release(elem)
+                if chapter:
+                    words += chapter["words"]
+                    yield chapter
+            
+            elif elem is main_body:
+                if section_index == 0:
+                    chapter = self.build_chapter(elem, 0)
+                    if chapter:
+                        words += chapter["words"]
+                        yield chapter
+                self._release(elem)
+            
+            elif elem.tag == body_tag and parent is root:
+                # Дополнительные body (примечания) в главы не входят, на них ведут ссылки из текста
+                self.read_notes(elem)
+                self._release(elem)
         
-        return '\n\n'.join(paragraphs)
+        self.metadata["total_words"] = words
+        self.metadata["total_pages"] = max(1, words // 250)
     
-    def estimate_pages(self) -> int:
-        body = self.root.find('.//fb:body', self.ns)
-        if body is not None:
-            text = ''.join(body.itertext())
-            words = len(text.split())
-            return max(1, words // 250)
-        return 1
+    @staticmethod
+    def _release(elem) -> None:
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
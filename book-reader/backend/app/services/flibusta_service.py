@@ -1,12 +1,49 @@
 """
 Сервис для работы с Флибустой через веб-интерфейс
 """
-import requests
-from typing import List, Dict, Optional
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
 from lxml import html
+from app.core.cache import TTLCache
 from app.core.config import settings
 
 
+@dataclass
+class MirrorHealth:
+    """Состояние зеркала: доля успешных ответов и средняя задержка"""
+    score: float = 1.0
+    latency: Optional[float] = None
+    failures: int = 0
+    down_until: float = 0.0
+    
+    SMOOTHING = 0.3
+    FAILURES_BEFORE_DOWN = 3
+    MAX_COOLDOWN = 300.0
+    
+    def record_success(self, latency: float) -> None:
+        self.score += self.SMOOTHING * (1.0 - self.score)
+        self.latency = latency if self.latency is None else self.latency + self.SMOOTHING * (latency - self.latency)
+        self.failures = 0
+        self.down_until = 0.0
+    
+    def record_failure(self) -> None:
+        self.score -= self.SMOOTHING * self.score
+        self.failures += 1
+        if self.failures >= self.FAILURES_BEFORE_DOWN:
+            # Экспоненциально увеличиваем паузу для зеркала, которое не отвечает
+            cooldown = min(self.MAX_COOLDOWN, 30.0 * 2 ** (self.failures - self.FAILURES_BEFORE_DOWN))
+            self.down_until = time.monotonic() + cooldown
+    
+    @property
+    def is_down(self) -> bool:
+        return time.monotonic() < self.down_until
+
+
 class FlibustaService:
     """Сервис для поиска и скачивания книг с Флибусты"""
     
@@ -17,47 +54,133 @@ class FlibustaService:
         "https://flibusta.appspot.com",
     ]
     
-    def __init__(self):
+    # Через сколько секунд без ответа параллельно запрашиваем следующее зеркало
+    HEDGE_DELAY = 1.5
+    DOWNLOAD_CHUNK_SIZE = 256 * 1024
+    
+    def __init__(self, mirrors: Optional[List[str]] = None):
         # Используем настройки из конфига или дефолтное зеркало
         self.base_url = settings.flibusta_url if hasattr(settings, 'flibusta_url') and settings.flibusta_url else self.MIRRORS[0]
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        mirrors = mirrors or self.MIRRORS
+        self.mirrors = [self.base_url] + [m for m in mirrors if m != self.base_url]
+        self.health: Dict[str, MirrorHealth] = {url: MirrorHealth() for url in self.mirrors}
+        self._client: Optional[httpx.AsyncClient] = None
         
+        self.search_cache = TTLCache(
+            max_entries=settings.flibusta_cache_max_entries,
+            ttl=settings.flibusta_cache_ttl,
+            stale_ttl=settings.flibusta_cache_stale_ttl,
+            max_bytes=settings.flibusta_cache_max_bytes,
+            sizeof=lambda books: len(json.dumps(books, ensure_ascii=False).encode('utf-8'))
+        )
+        # Поиски, которые уже выполняются: одинаковые запросы ждут один и тот же ответ
+        self._searches: Dict[tuple, asyncio.Task] = {}
+    
+    def _proxy_url(self) -> Optional[str]:
         # Если настроен HTTP прокси, используем его
         if hasattr(settings, 'http_proxy_host') and settings.http_proxy_host:
-            try:
-                # Формируем URL прокси с авторизацией
-                if settings.http_proxy_user and settings.http_proxy_password:
-                    proxy_url = f"http://{settings.http_proxy_user}:{settings.http_proxy_password}@{settings.http_proxy_host}:{settings.http_proxy_port}"
-                else:
-                    proxy_url = f"http://{settings.http_proxy_host}:{settings.http_proxy_port}"
-                
-                self.session.proxies = {
-                    'http': proxy_url,
-                    'https': proxy_url
-                }
-                print(f"Using HTTP proxy: {settings.http_proxy_host}:{settings.http_proxy_port}")
-            except Exception as e:
-                print(f"Error setting up HTTP proxy: {e}")
-                self.session.proxies = {}
+            # Формируем URL прокси с авторизацией
+            if settings.http_proxy_user and settings.http_proxy_password:
+                proxy_url = f"http://{settings.http_proxy_user}:{settings.http_proxy_password}@{settings.http_proxy_host}:{settings.http_proxy_port}"
+            else:
+                proxy_url = f"http://{settings.http_proxy_host}:{settings.http_proxy_port}"
+            print(f"Using HTTP proxy: {settings.http_proxy_host}:{settings.http_proxy_port}")
+            return proxy_url
         # Если используется .onion адрес, настраиваем Tor прокси
-        elif '.onion' in self.base_url:
-            try:
-                tor_proxy = f"socks5h://{settings.tor_proxy_host}:{settings.tor_proxy_port}"
-                self.session.proxies = {
-                    'http': tor_proxy,
-                    'https': tor_proxy
-                }
-                print(f"Using Tor proxy: {tor_proxy}")
-            except Exception as e:
-                print(f"Error setting up Tor proxy: {e}")
-                print("Falling back to clearnet mirror")
-                self.base_url = self.MIRRORS[0]
-                self.session.proxies = {}
-    
-    def search_books(self, query: str, limit: int = 20) -> List[Dict]:
+        if '.onion' in self.base_url:
+            tor_proxy = f"socks5://{settings.tor_proxy_host}:{settings.tor_proxy_port}"
+            print(f"Using Tor proxy: {tor_proxy}")
+            return tor_proxy
+        return None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Общий клиент с пулом keep-alive соединений, создается при первом запросе"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                proxies=self._proxy_url(),
+                timeout=httpx.Timeout(settings.flibusta_timeout, connect=10.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                follow_redirects=True
+            )
+        return self._client
+    
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def _ranked_mirrors(self) -> List[str]:
+        """Зеркала по убыванию надежности; недоступные пропускаем, пока не истечет пауза"""
+        alive = [url for url in self.mirrors if not self.health[url].is_down]
+        candidates = alive or self.mirrors
+        return sorted(
+            candidates,
+            key=lambda url: (-self.health[url].score, self.health[url].latency or float('inf'))
+        )
+    
+    async def _fetch(self, url: str, path: str, params: Optional[Dict], extract: Callable, stream: bool = False):
+        health = self.health[url]
+        started = time.monotonic()
+        response = None
+        try:
+            print(f"Trying {url}{path}")
+            request = self.client.build_request("GET", f"{url}{path}", params=params)
+            response = await self.client.send(request, stream=stream)
+            response.raise_for_status()
+            result = extract(response, url)
+        except Exception as e:
+            print(f"Error requesting {url}: {e}")
+            health.record_failure()
+            if stream and response is not None:
+                await response.aclose()
+            return None
+        
+        health.record_success(time.monotonic() - started)
+        return result
+    
+    async def _race(self, path: str, extract: Callable, params: Optional[Dict] = None, stream: bool = False):
+        """
+        Хеджированный запрос: начинаем с лучшего зеркала, и если оно не ответило
+        за HEDGE_DELAY (или ответило ошибкой), параллельно подключаем следующее.
+        Возвращаем первый непустой результат, остальные запросы отменяем.
+        При stream=True результатом является открытый ответ, который закрывает вызывающий.
+        """
+        queue = self._ranked_mirrors()
+        pending = set()
+        winner = None
+        
+        try:
+            while (queue or pending) and winner is None:
+                if queue:
+                    pending.add(asyncio.create_task(self._fetch(queue.pop(0), path, params, extract, stream)))
+                
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.HEDGE_DELAY if queue else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    result = task.result()
+                    if not result:
+                        continue
+                    if winner is None:
+                        winner = result
+                    elif stream:
+                        await result.aclose()
+        finally:
+            for task in pending:
+                task.cancel()
+            if stream and pending:
+                # Запрос мог успеть завершиться до отмены: закрываем лишние соединения
+                for result in await asyncio.gather(*pending, return_exceptions=True):
+                    if isinstance(result, httpx.Response):
+                        await result.aclose()
+        
+        return winner
+    
+    async def search_books(self, query: str, limit: int = 20) -> List[Dict]:
         """
         Поиск книг по названию или автору
         
@@ -71,82 +194,78 @@ class FlibustaService:
         if not query or not query.strip():
             return []
         
-        # Список URL для попытки (текущий + зеркала)
-        urls_to_try = [self.base_url] + [m for m in self.MIRRORS if m != self.base_url]
+        # Нормализуем запрос, чтобы "Толстой" и " толстой " попадали в одну запись кеша
+        normalized = ' '.join(query.lower().split())
+        key = (normalized, limit)
         
-        for url in urls_to_try:
-            try:
-                # Используем настроенную сессию с прокси
-                session = self.session
-                
-                # Используем веб-поиск вместо OPDS
-                search_url = f"{url}/booksearch"
-                params = {'ask': query.strip()}
-                
-                print(f"Trying to search on: {url}")
-                
-                response = session.get(search_url, params=params, timeout=60)
-                response.raise_for_status()
-                
-                # Парсим HTML
-                books = self._parse_html_results(response.content, limit, url)
-                if books:
-                    print(f"Successfully found {len(books)} books on {url}")
-                    self.base_url = url  # Запоминаем рабочее зеркало
-                    return books
-                    
-            except Exception as e:
-                print(f"Error searching on {url}: {e}")
-                continue
+        cached = self.search_cache.get(key)
+        if cached is not None:
+            books, fresh = cached
+            if not fresh:
+                # Отдаем устаревший результат сразу, а обновляем его в фоне
+                self._start_search(key)
+            return books
+        
+        return await asyncio.shield(self._start_search(key))
+    
+    def _start_search(self, key: tuple) -> asyncio.Task:
+        task = self._searches.get(key)
+        if task is None:
+            task = asyncio.create_task(self._search_and_cache(*key))
+            self._searches[key] = task
+            task.add_done_callback(lambda _: self._searches.pop(key, None))
+        return task
+    
+    async def _search_and_cache(self, query: str, limit: int) -> List[Dict]:
+        # Используем веб-поиск вместо OPDS
+        books = await self._race(
+            "/booksearch",
+            lambda response, url: self._parse_html_results(response.content, limit, url),
+            params={'ask': query}
+        )
+        if books:
+            print(f"Successfully found {len(books)} books")
+            # Пустой ответ не кешируем: это может быть сбой всех зеркал
+            self.search_cache.set((query, limit), books)
+            return books
         
         print("All mirrors failed")
         return []
     
-    def download_book(self, book_id: str, format: str = "fb2") -> Optional[bytes]:
+    async def download_book(self, book_id: str, sink: Callable[[bytes], Awaitable[None]], format: str = "fb2") -> bool:
         """
-        Скачивание книги по ID
+        Потоковое скачивание книги по ID
         
         Args:
             book_id: ID книги на Флибусте
+            sink: Корутина, получающая файл по кускам
             format: Формат файла (fb2, epub, mobi)
             
         Returns:
-            bytes: Содержимое файла книги
+            bool: Удалось ли скачать книгу
         """
-        # Список URL для попытки (текущий + зеркала)
-        urls_to_try = [self.base_url] + [m for m in self.MIRRORS if m != self.base_url]
+        def extract(response: httpx.Response, url: str) -> httpx.Response:
+            print(f"Downloading from {url}, Content-Type: {response.headers.get('Content-Type')}")
+            return response
         
-        for url in urls_to_try:
-            try:
-                # Используем настроенную сессию с прокси
-                session = self.session
-                
-                download_url = f"{url}/b/{book_id}/{format}"
-                print(f"Trying to download from: {download_url}")
-                
-                response = session.get(download_url, timeout=60)
-                response.raise_for_status()
-                
-                # Проверяем что получили
-                content = response.content
-                print(f"Downloaded {len(content)} bytes from {url}")
-                print(f"Content-Type: {response.headers.get('Content-Type')}")
-                print(f"First 100 bytes: {content[:100]}")
-                
-                if not content:
-                    print("Empty content received")
-                    continue
-                
-                print(f"Successfully downloaded book from {url}")
-                self.base_url = url  # Запоминаем рабочее зеркало
-                return content
-                
-            except Exception as e:
-                print(f"Error downloading from {url}: {e}")
-                continue
+        response = await self._race(f"/b/{book_id}/{format}", extract, stream=True)
+        if response is None:
+            print("All mirrors failed for download")
+            return False
         
-        print("All mirrors failed for download")
-        return None
+        received = 0
+        try:
+            async for chunk in response.aiter_bytes(self.DOWNLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                await sink(chunk)
+        finally:
+            await response.aclose()
+        
+        print(f"Downloaded {received} bytes")
+        if not received:
+            print("Empty content received")
+            return False
+        return True
     
     def _parse_html_results(self, html_content: bytes, limit: int, base_url: str) -> List[Dict]:
         """Парсинг HTML результатов поиска"""
@@ -205,3 +324,6 @@ class FlibustaService:
             print(f"Error parsing HTML: {e}")
             
         return results
+
+
+flibusta_service = FlibustaService()
@@ -0,0 +1,127 @@
+"""
+Иллюстрации из текста книг
+"""
+import io
+import json
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from lxml import etree
+from PIL import Image
+
+from app.core.config import settings
+from app.services.cover_store import CoverStore
+from app.services.fb2_parser import FB2_NS, FB2Parser
+
+
+def detect_media_type(image: bytes) -> Optional[str]:
+    """
+    Тип картинки по ее содержимому. content-type из FB2 не используется:
+    под видом картинки в файле может оказаться HTML или SVG со скриптом.
+    None - не JPEG, PNG, GIF или WebP.
+    """
+    try:
+        with Image.open(io.BytesIO(image)) as opened:
+            image_format = opened.format
+    except Exception:
+        return None
+    entry = CoverStore.FORMATS.get(image_format)
+    return entry[1] if entry else None
+
+
+class ImageStore:
+    """
+    Иллюстрации книги (binary из FB2, на которые ссылаются блоки image): один файл на книгу,
+    устроенный как ChapterStore - 4 байта длины заголовка, JSON заголовок
+    {id: [смещение, длина, тип]}, затем картинки подряд без сжатия.
+
+    При загрузке книги картинки не сохраняются, чтобы парсинг не держал их в памяти:
+    файл строится одним проходом по FB2 при первом запросе картинки.
+    Сохраняются только JPEG, PNG, GIF и WebP, тип определяется по содержимому.
+    """
+
+    VERSION = 2
+    HEADER_SIZE = struct.Struct(">I")
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self._build_lock = threading.Lock()
+
+    def _path(self, book_id: int, file_hash: str) -> Path:
+        return self.base_dir / f"{book_id}_{file_hash}.images"
+
+    def build(self, book_id: int, file_hash: str, file_path: str) -> Path:
+        """Извлечение всех binary из файла книги, остальное дерево освобождается по ходу разбора"""
+        binary_tag = f'{{{FB2_NS}}}binary'
+        entries: Dict[str, list] = {}
+        path = self._path(book_id, file_hash)
+        data_path = path.with_suffix(f".data{os.getpid()}_{threading.get_ident()}")
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}_{threading.get_ident()}")
+
+        offset = 0
+        try:
+            with open(data_path, "wb") as data:
+                for _, elem in etree.iterparse(file_path, events=("end",), huge_tree=True):
+                    if elem.tag == binary_tag and elem.get("id"):
+                        image = FB2Parser.decode_binary(elem)
+                        media_type = detect_media_type(image) if image else None
+                        if media_type:
+                            entries[elem.get("id")] = [offset, len(image), media_type]
+                            data.write(image)
+                            offset += len(image)
+                    FB2Parser._release(elem)
+
+            header = json.dumps({"version": self.VERSION, "images": entries}).encode("utf-8")
+            with open(tmp_path, "wb") as f, open(data_path, "rb") as data:
+                f.write(self.HEADER_SIZE.pack(len(header)))
+                f.write(header)
+                for chunk in iter(lambda: data.read(1024 * 1024), b""):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            for leftover in (data_path, tmp_path):
+                if leftover.exists():
+                    os.remove(leftover)
+        return path
+
+    def _read_header(self, f) -> Dict:
+        (header_len,) = self.HEADER_SIZE.unpack(f.read(self.HEADER_SIZE.size))
+        return json.loads(f.read(header_len).decode("utf-8"))
+
+    def _is_current(self, path: Path) -> bool:
+        if not path.exists():
+            return False
+        with open(path, "rb") as f:
+            return self._read_header(f).get("version") == self.VERSION
+
+    def read(self, book_id: int, file_hash: str, file_path: str, image_id: str) -> Optional[Tuple[bytes, str]]:
+        """Картинка и ее тип; None - в книге такой нет или это не картинка"""
+        path = self._path(book_id, file_hash)
+        # Файл прежней версии мог сохранить тип из FB2 без проверки: строим заново
+        if not self._is_current(path):
+            with self._build_lock:
+                if not self._is_current(path):
+                    self.build(book_id, file_hash, file_path)
+
+        with open(path, "rb") as f:
+            header = self._read_header(f)
+            entry = header["images"].get(image_id)
+            if entry is None:
+                return None
+            offset, length, media_type = entry
+            f.seek(f.tell() + offset)
+            return f.read(length), media_type
+
+    def delete(self, book_id: int) -> None:
+        for path in self.base_dir.glob(f"{book_id}_*.images"):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Warning: Could not delete image store {path}: {e}")
+
+
+image_store = ImageStore(Path(settings.images_dir))
@@ -0,0 +1,156 @@
+"""
+Буфер позиций чтения: запись позиции при каждом перелистывании копится в памяти
+и сбрасывается в БД пачкой, одной транзакцией.
+
+Буфер живет в процессе, поэтому рассчитан на один воркер uvicorn.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.core.config import settings
+from app.core.database import run_in_session
+from app.core.executors import io_executor
+from app.models.user_book import UserBook
+from app.repositories.user_book_repository import UserBookRepository
+
+
+class PositionBuffer:
+    """
+    Последняя запись побеждает: для каждой книги в библиотеке хранится только
+    последнее значение полей. Сброс - по таймеру, при смене статуса книги,
+    при переполнении и при остановке приложения.
+    """
+
+    def __init__(self, interval: float, max_entries: int):
+        self.interval = interval
+        self.max_entries = max_entries
+        # user_book_id -> {"user_id": ..., "values": {поле: значение}}
+        self._pending: Dict[int, Dict] = {}
+        # Пачка, которая сейчас пишется в БД: чтения должны видеть и ее
+        self._flushing: Dict[int, Dict] = {}
+        # user_id -> номер последней записи пользователя, входит в ETag его библиотеки.
+        # Счетчик начинается со времени запуска, чтобы номера не повторялись после перезапуска
+        self._versions: Dict[int, int] = {}
+        self._sequence = itertools.count(time.time_ns() // 1000)
+        self._lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def put(self, user_book_id: int, user_id: int, values: Dict) -> bool:
+        """
+        Returns:
+            bool: Буфер переполнен и его пора сбросить
+        """
+        with self._lock:
+            entry = self._pending.setdefault(user_book_id, {"user_id": user_id, "values": {}})
+            entry["values"].update(values)
+            self._versions[user_id] = next(self._sequence)
+            return len(self._pending) >= self.max_entries
+
+    def get(self, user_book_id: int) -> Optional[Dict]:
+        """Еще не записанные значения полей книги"""
+        with self._lock:
+            values = {}
+            for source in (self._flushing, self._pending):
+                entry = source.get(user_book_id)
+                if entry:
+                    values.update(entry["values"])
+            return values or None
+
+    def overlay(self, user_book: Optional[UserBook]) -> Optional[UserBook]:
+        """Подстановка несохраненных значений в объект без пометки его измененным"""
+        if user_book is not None:
+            values = self.get(user_book.id)
+            if values:
+                for field, value in values.items():
+                    set_committed_value(user_book, field, value)
+        return user_book
+
+    def pending_for(self, user_id: int) -> Dict[int, Dict]:
+        """Несохраненные значения всех книг пользователя: user_book_id -> {поле: значение}"""
+        with self._lock:
+            pending: Dict[int, Dict] = {}
+            for source in (self._flushing, self._pending):
+                for user_book_id, entry in source.items():
+                    if entry["user_id"] == user_id:
+                        pending.setdefault(user_book_id, {}).update(entry["values"])
+            return pending
+
+    def version(self, user_id: int) -> int:
+        """
+        Номер последней записи пользователя в буфер (0 - записей не было).
+        Вместе с версией библиотеки в БД определяет, что видит клиент,
+        поэтому для ETag сбрасывать буфер не нужно.
+        """
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def discard(self, user_book_id: int) -> None:
+        with self._lock:
+            self._pending.pop(user_book_id, None)
+
+    async def flush(self) -> int:
+        """Запись накопленных позиций одной транзакцией"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                batch = {user_book_id: entry["values"] for user_book_id, entry in self._flushing.items()}
+
+            try:
+                await io_executor.run(run_in_session, _write_positions, batch)
+            except Exception as e:
+                print(f"Error flushing reading positions: {e}")
+                # Возвращаем пачку в буфер, более новые значения не затираем
+                with self._lock:
+                    for user_book_id, entry in self._flushing.items():
+                        newer = self._pending.get(user_book_id)
+                        if newer:
+                            entry["values"].update(newer["values"])
+                        self._pending[user_book_id] = entry
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+            return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Ошибка уже залогирована, пачка вернулась в буфер до следующего раза
+                pass
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+def _write_positions(db: Session, batch: Dict[int, Dict]) -> None:
+    UserBookRepository(db).apply_updates(batch)
+
+
+position_buffer = PositionBuffer(settings.position_flush_interval, settings.position_buffer_max_entries)
@@ -0,0 +1,198 @@
+"""
+Индекс позиций книги: сквозной номер слова <-> (глава, абзац, слово в абзаце)
+"""
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.services.chapter_blocks import split_paragraphs
+from app.services.chapter_store import chapter_store
+
+
+class BookPositions:
+    """
+    Позиция - сквозной номер слова от начала книги, total_words - конец книги.
+    Номер абзаца - номер блока внутри главы, у пустых строк и иллюстраций слов нет.
+    """
+
+    def __init__(self, chapter_starts: array, chapter_paragraphs: array, paragraph_starts: array):
+        # Первое слово и первый абзац каждой главы, последний элемент - конец книги
+        self.chapter_starts = chapter_starts
+        self.chapter_paragraphs = chapter_paragraphs
+        # Первое слово каждого абзаца книги
+        self.paragraph_starts = paragraph_starts
+
+    @property
+    def total_chapters(self) -> int:
+        return len(self.chapter_starts) - 1
+
+    @property
+    def total_words(self) -> int:
+        return self.chapter_starts[-1]
+
+    def locate(self, position: int) -> Tuple[int, int, int]:
+        """
+        (глава, абзац, слово в абзаце) по позиции.
+        Конец книги - (total_chapters, 0, 0).
+
+        Raises:
+            ValueError: Позиция вне книги
+        """
+        if not 0 <= position <= self.total_words:
+            raise ValueError(f"Position {position} is out of range")
+        if position == self.total_words:
+            return self.total_chapters, 0, 0
+
+        # Пустые главы начинаются там же, где следующая, bisect_right их пропускает
+        chapter = bisect_right(self.chapter_starts, position) - 1
+        first = self.chapter_paragraphs[chapter]
+        paragraph = bisect_right(self.paragraph_starts, position, first, self.chapter_paragraphs[chapter + 1]) - 1
+        return chapter, paragraph - first, position - self.paragraph_starts[paragraph]
+
+    def position(self, chapter: int, paragraph: int = 0, word: int = 0) -> int:
+        """
+        Позиция слова. Абзац за последним в главе - конец главы,
+        глава за последней - конец книги.
+
+        Raises:
+            ValueError: Такого слова нет
+        """
+        if chapter == self.total_chapters and paragraph == 0 and word == 0:
+            return self.total_words
+        if not 0 <= chapter < self.total_chapters:
+            raise ValueError(f"Chapter {chapter} is out of range")
+
+        first, end = self.chapter_paragraphs[chapter], self.chapter_paragraphs[chapter + 1]
+        if paragraph == end - first and word == 0:
+            return self.chapter_starts[chapter + 1]
+        if not 0 <= paragraph < end - first:
+            raise ValueError(f"Paragraph {paragraph} is out of range")
+
+        index = first + paragraph
+        start = self.paragraph_starts[index]
+        next_start = self.paragraph_starts[index + 1] if index + 1 < end else self.chapter_starts[chapter + 1]
+        # Слово 0 есть и у абзаца без слов: это позиция следующего слова
+        if word and not 0 < word < next_start - start:
+            raise ValueError(f"Word {word} is out of range")
+        return start + word
+
+    def progress(self, position: int) -> float:
+        """Процент прочитанного: доля слов до позиции"""
+        if not self.total_words:
+            return 0.0
+        return min(position, self.total_words) / self.total_words * 100
+
+
+class PositionIndex:
+    """
+    Индексы позиций книг: один файл на книгу, строится при загрузке книги,
+    для старых книг - из хранилища глав при первом обращении.
+
+    Формат файла (uint32 в порядке байт машины, файл не покидает сервер):
+        magic, число глав, число абзацев, число слов
+        chapter_starts[глав + 1]     - первое слово главы
+        chapter_paragraphs[глав + 1] - первый абзац главы
+        paragraph_starts[абзацев]    - первое слово абзаца
+
+    Загруженные индексы кешируются в памяти: позиция пересчитывается
+    при каждом сохранении позиции чтения.
+    """
+
+    HEADER = struct.Struct("<4sIII")
+    MAGIC = b"POS2"
+
+    def __init__(self, base_dir: Path, cache_entries: int):
+        self.base_dir = base_dir
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self._build_lock = threading.Lock()
+        # Индекс не меняется, время жизни ограничивает только память под редкие книги
+        self._cache = TTLCache(cache_entries, ttl=3600)
+
+    def _path(self, book_id: int, file_hash: str) -> Path:
+        return self.base_dir / f"{book_id}_{file_hash}.pos"
+
+    def build(self, book_id: int, file_hash: str, chapters: Iterable[Dict]) -> BookPositions:
+        """Построение индекса. Главы можно передавать генератором"""
+        chapter_starts = array("I", [0])
+        chapter_paragraphs = array("I", [0])
+        paragraph_starts = array("I")
+        words = 0
+        for chapter in chapters:
+            for paragraph in split_paragraphs(chapter["blocks"]):
+                paragraph_starts.append(words)
+                words += len(paragraph)
+            chapter_starts.append(words)
+            chapter_paragraphs.append(len(paragraph_starts))
+
+        path = self._path(book_id, file_hash)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}_{threading.get_ident()}")
+        with open(tmp_path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, len(chapter_starts) - 1, len(paragraph_starts), words))
+            for values in (chapter_starts, chapter_paragraphs, paragraph_starts):
+                f.write(values.tobytes())
+        os.replace(tmp_path, path)
+
+        positions = BookPositions(chapter_starts, chapter_paragraphs, paragraph_starts)
+        self._cache.set((book_id, file_hash), positions)
+        return positions
+
+    def _read(self, path: Path) -> Optional[BookPositions]:
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            magic, chapters, paragraphs, _ = self.HEADER.unpack(f.read(self.HEADER.size))
+            if magic != self.MAGIC:
+                return None
+            arrays = []
+            for count in (chapters + 1, chapters + 1, paragraphs):
+                values = array("I")
+                values.fromfile(f, count)
+                arrays.append(values)
+        return BookPositions(*arrays)
+
+    def cached(self, book_id: int, file_hash: str) -> Optional[BookPositions]:
+        """Индекс из памяти без обращения к диску; None - его там нет"""
+        entry = self._cache.get((book_id, file_hash))
+        return entry[0] if entry else None
+
+    def load(self, book_id: int, file_hash: str) -> BookPositions:
+        """Индекс книги, при необходимости строится из хранилища глав по одной главе"""
+        positions = self.cached(book_id, file_hash)
+        if positions is not None:
+            return positions
+
+        path = self._path(book_id, file_hash)
+        positions = self._read(path)
+        if positions is None:
+            with self._build_lock:
+                positions = self._read(path)
+                if positions is None:
+                    header = chapter_store.load_index(book_id, file_hash)
+                    if header is None:
+                        raise FileNotFoundError(f"Chapters of book {book_id} are not stored")
+                    chapters = (
+                        chapter
+                        for index in range(len(header["chapters"]))
+                        for chapter in chapter_store.read_chapters(book_id, file_hash, index, index + 1)
+                    )
+                    return self.build(book_id, file_hash, chapters)
+
+        self._cache.set((book_id, file_hash), positions)
+        return positions
+
+    def delete(self, book_id: int) -> None:
+        for path in self.base_dir.glob(f"{book_id}_*.pos"):
+            self._cache.pop((book_id, path.stem.split("_", 1)[1]))
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Warning: Could not delete position index {path}: {e}")
+
+
+position_index = PositionIndex(Path(settings.positions_dir), settings.position_index_cache_entries)
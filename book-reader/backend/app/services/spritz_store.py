@@ -0,0 +1,206 @@
+"""
+Поток слов глав для Spritz: разбивка на слова, точка фиксации взгляда (ORP)
+и паузы считаются один раз при загрузке книги и отдаются клиенту упакованными
+"""
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from app.core.config import settings
+from app.services.chapter_blocks import split_paragraphs, utf16_len
+from app.services.chapter_store import chapter_store
+
+
+SPRITZ_MEDIA_TYPE = "application/vnd.abooks.spritz"
+
+# Множитель паузы после слова в десятых долях: задержка = 60000 / wpm * weight / 10
+WEIGHT_SKIP = 0
+WEIGHT_NORMAL = 10
+WEIGHT_CLAUSE = 15
+WEIGHT_SENTENCE = 25
+WEIGHT_PARAGRAPH = 30
+# Старший бит веса: в слове есть цифры, клиент может задержаться на нем дольше
+NUMBER_FLAG = 0x80
+
+SENTENCE_END_RE = re.compile(r"[.!?…]+[\"»”)]*$")
+CLAUSE_END_RE = re.compile(r"[,:;]+[\"»”)]*$")
+DIGIT_RE = re.compile(r"\d")
+LEADING_RE = re.compile(r"^\W*")
+TRAILING_RE = re.compile(r"\W*$")
+
+
+def orp_index(word: str) -> int:
+    """
+    Индекс буквы, на которой фиксируется взгляд (в единицах UTF-16).
+    Формула клиента round((length + 1) * 0.4) - 1, но по самому слову,
+    без кавычек и знаков препинания вокруг него.
+    """
+    lead = LEADING_RE.match(word).end()
+    core_len = len(word) - lead - len(TRAILING_RE.search(word[lead:]).group())
+    if core_len <= 0:
+        return 0
+    # int(x + 0.5) - округление половины вверх, как Math.round
+    index = lead + max(0, int((core_len + 1) * 0.4 + 0.5) - 1)
+    # Хранится в одном байте
+    return min(utf16_len(word[:index]), 255)
+
+
+def pause_weight(word: str, paragraph_end: bool) -> int:
+    if SENTENCE_END_RE.search(word):
+        weight = WEIGHT_SENTENCE
+    elif CLAUSE_END_RE.search(word):
+        weight = WEIGHT_CLAUSE
+    else:
+        weight = WEIGHT_NORMAL
+    if paragraph_end:
+        weight = max(weight, WEIGHT_PARAGRAPH)
+    if DIGIT_RE.search(word):
+        weight |= NUMBER_FLAG
+    return weight
+
+
+class SpritzStore:
+    """
+    Упакованные потоки слов глав: один файл на книгу, устроенный как ChapterStore
+    (4 байта длины заголовка, JSON заголовок со смещениями, главы сжаты zlib по отдельности).
+
+    Глава отдается клиенту как есть, все числа little-endian, массивы выровнены
+    для Uint32Array/Uint16Array поверх того же ArrayBuffer:
+        magic       4 байта b"SPZ1"
+        words       uint32 - число слов
+        paragraphs  uint32 - число абзацев (блоков главы, в том числе без слов)
+        text_size   uint32 - длина текста в байтах
+        total_weight uint32 - сумма множителей пауз главы (без флага цифр), для оценки времени
+        paragraph_starts uint32[paragraphs] - номер первого слова абзаца
+        lengths     uint16[words] - длина слова в единицах UTF-16
+        orp         uint8[words] - индекс буквы ORP в слове
+        weights     uint8[words] - множитель паузы в десятых (0 - разметка, не показывать)
+                    и NUMBER_FLAG
+        text        UTF-8, слова через один пробел
+
+    Слова и абзацы - как в split_paragraphs, поэтому номера слов совпадают с позициями
+    PositionIndex, word_offset поиска и words оглавления.
+    """
+
+    VERSION = 2
+    HEADER_SIZE = struct.Struct(">I")
+    CHAPTER_HEADER = struct.Struct("<4sIIII")
+    MAGIC = b"SPZ1"
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self._build_lock = threading.Lock()
+
+    def _path(self, book_id: int, file_hash: str) -> Path:
+        return self.base_dir / f"{book_id}_{file_hash}.spritz"
+
+    @classmethod
+    def pack_chapter(cls, blocks: List[List]) -> bytes:
+        paragraph_starts: List[int] = []
+        words: List[str] = []
+        weights = bytearray()
+        for paragraph_words in split_paragraphs(blocks):
+            paragraph_starts.append(len(words))
+            last = len(paragraph_words) - 1
+            for i, word in enumerate(paragraph_words):
+                weights.append(pause_weight(word, i == last))
+            words.extend(paragraph_words)
+
+        text = " ".join(words).encode("utf-8")
+        total_weight = sum(weight & ~NUMBER_FLAG for weight in weights)
+        count = len(words)
+        return b"".join((
+            cls.CHAPTER_HEADER.pack(cls.MAGIC, count, len(paragraph_starts), len(text), total_weight),
+            struct.pack(f"<{len(paragraph_starts)}I", *paragraph_starts),
+            struct.pack(f"<{count}H", *(utf16_len(word) for word in words)),
+            bytes(orp_index(word) for word in words),
+            bytes(weights),
+            text,
+        ))
+
+    def save(self, book_id: int, file_hash: str, chapters: Iterable[Dict]) -> Dict:
+        """Упаковка глав и запись файла. Главы можно передавать генератором"""
+        toc = []
+        blobs = []
+        offset = 0
+        for chapter in chapters:
+            packed = self.pack_chapter(chapter["blocks"])
+            blob = zlib.compress(packed, 6)
+            toc.append({"offset": offset, "length": len(blob), "size": len(packed)})
+            blobs.append(blob)
+            offset += len(blob)
+
+        header = {
+            "version": self.VERSION,
+            "book_id": book_id,
+            "file_hash": file_hash,
+            "chapters": toc,
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        path = self._path(book_id, file_hash)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}_{threading.get_ident()}")
+        with open(tmp_path, "wb") as f:
+            f.write(self.HEADER_SIZE.pack(len(header_bytes)))
+            f.write(header_bytes)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+        return header
+
+    def _read_header(self, f) -> Dict:
+        (header_len,) = self.HEADER_SIZE.unpack(f.read(self.HEADER_SIZE.size))
+        return json.loads(f.read(header_len).decode("utf-8"))
+
+    def _is_current(self, path: Path) -> bool:
+        if not path.exists():
+            return False
+        with open(path, "rb") as f:
+            return self._read_header(f).get("version") == self.VERSION
+
+    def ensure(self, book_id: int, file_hash: str) -> Path:
+        """Путь к файлу, для книг, загруженных раньше, он строится из хранилища глав"""
+        path = self._path(book_id, file_hash)
+        if self._is_current(path):
+            return path
+
+        with self._build_lock:
+            if not self._is_current(path):
+                header = chapter_store.load_index(book_id, file_hash)
+                if header is None:
+                    raise FileNotFoundError(f"Chapters of book {book_id} are not stored")
+                chapters = (
+                    chapter
+                    for index in range(len(header["chapters"]))
+                    for chapter in chapter_store.read_chapters(book_id, file_hash, index, index + 1)
+                )
+                self.save(book_id, file_hash, chapters)
+        return path
+
+    def read_chapter(self, book_id: int, file_hash: str, index: int) -> Optional[bytes]:
+        """Упакованная глава; None - такой главы нет"""
+        path = self.ensure(book_id, file_hash)
+        with open(path, "rb") as f:
+            header = self._read_header(f)
+            data_start = f.tell()
+            if not 0 <= index < len(header["chapters"]):
+                return None
+            entry = header["chapters"][index]
+            f.seek(data_start + entry["offset"])
+            return zlib.decompress(f.read(entry["length"]))
+
+    def delete(self, book_id: int) -> None:
+        for path in self.base_dir.glob(f"{book_id}_*.spritz"):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Warning: Could not delete spritz store {path}: {e}")
+
+
+spritz_store = SpritzStore(Path(settings.spritz_dir))
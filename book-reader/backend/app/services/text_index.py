@@ -0,0 +1,183 @@
+"""
+Полнотекстовый индекс текста книги по абзацам
+"""
+import html
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.fulltext import FTS_TOKENIZER, match_phrase, normalize
+from app.services.chapter_blocks import iter_text_blocks
+from app.services.chapter_store import chapter_store
+
+
+class TextIndex:
+    """
+    Индекс абзацев книги: отдельная база SQLite с таблицей FTS5 на книгу,
+    рядом с хранилищем глав. Строится при загрузке книги из тех же глав,
+    что сохраняются в ChapterStore, для старых книг - при первом поиске.
+
+    Поиск читает с диска только страницы индекса и найденные абзацы,
+    поэтому не зависит от размера книги.
+
+    Абзацы - блоки главы с текстом, номер абзаца - номер блока (как id абзаца в читалке).
+    word_offset - номер первого слова абзаца от начала книги.
+    """
+
+    VERSION = 2
+    # Маркеры подсветки, которых нет в тексте: заменяются на <mark> после экранирования
+    MARK_OPEN = "\x02"
+    MARK_CLOSE = "\x03"
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self._build_lock = threading.Lock()
+
+    def _path(self, book_id: int, file_hash: str) -> Path:
+        return self.base_dir / f"{book_id}_{file_hash}.fts"
+
+    @staticmethod
+    def _paragraphs(chapters: Iterable[Dict]) -> Iterator[Tuple[int, int, int, str]]:
+        offset = 0
+        for chapter_index, chapter in enumerate(chapters):
+            for paragraph_index, text in iter_text_blocks(chapter["blocks"]):
+                yield chapter_index, paragraph_index, offset, text
+                offset += len(text.split())
+
+    def build(self, book_id: int, file_hash: str, chapters: Iterable[Dict]) -> None:
+        """Построение индекса. Главы можно передавать генератором"""
+        path = self._path(book_id, file_hash)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}_{threading.get_ident()}")
+        conn = sqlite3.connect(tmp_path)
+        try:
+            # Файл пишется один раз и переименовывается, журнал не нужен
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE paragraphs (id INTEGER PRIMARY KEY, chapter INTEGER, "
+                "paragraph INTEGER, word_offset INTEGER, text TEXT)"
+            )
+            conn.execute(
+                "CREATE VIRTUAL TABLE paragraphs_fts USING fts5(text, content='paragraphs', "
+                f"content_rowid='id', tokenize='{FTS_TOKENIZER}')"
+            )
+            conn.executemany(
+                "INSERT INTO paragraphs (chapter, paragraph, word_offset, text) VALUES (?, ?, ?, ?)",
+                self._paragraphs(chapters)
+            )
+            # В индекс идет нормализованный текст: замена ё не меняет позиции слов,
+            # поэтому snippet подсвечивает исходный текст правильно
+            conn.create_function("normalize", 1, normalize, deterministic=True)
+            conn.execute("INSERT INTO paragraphs_fts (rowid, text) SELECT id, normalize(text) FROM paragraphs")
+            conn.execute("INSERT INTO paragraphs_fts (paragraphs_fts) VALUES ('optimize')")
+            conn.execute(f"PRAGMA user_version={self.VERSION}")
+            conn.commit()
+        except Exception:
+            conn.close()
+            os.remove(tmp_path)
+            raise
+        conn.close()
+        os.replace(tmp_path, path)
+
+    def _is_current(self, path: Path) -> bool:
+        if not path.exists():
+            return False
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return conn.execute("PRAGMA user_version").fetchone()[0] == self.VERSION
+        finally:
+            conn.close()
+
+    def ensure(self, book_id: int, file_hash: str) -> Path:
+        """Путь к индексу, при необходимости строится из хранилища глав по одной главе"""
+        path = self._path(book_id, file_hash)
+        if self._is_current(path):
+            return path
+
+        with self._build_lock:
+            if not self._is_current(path):
+                header = chapter_store.load_index(book_id, file_hash)
+                if header is None:
+                    raise FileNotFoundError(f"Chapters of book {book_id} are not stored")
+                chapters = (
+                    chapter
+                    for index in range(len(header["chapters"]))
+                    for chapter in chapter_store.read_chapters(book_id, file_hash, index, index + 1)
+                )
+                self.build(book_id, file_hash, chapters)
+        return path
+
+    def search(self, book_id: int, file_hash: str, query: str, limit: int = 20, after_id: Optional[int] = None) -> List[Dict]:
+        """
+        Абзацы с фразой query (слова подряд, с учетом окончаний) в порядке текста.
+
+        Returns:
+            List[Dict]: id, chapter_index, paragraph_index, word_offset (слово, с которого начинается фраза)
+                и snippet - фрагмент абзаца, найденные слова в <mark>
+        """
+        match = match_phrase(query)
+        if match is None:
+            return []
+
+        path = self.ensure(book_id, file_hash)
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            # highlight отмечает в абзаце найденные фразы целиком, по первой отметке - номер слова
+            rows = conn.execute(
+                "SELECT p.id, p.chapter, p.paragraph, p.word_offset, "
+                "highlight(paragraphs_fts, 0, ?, ?), snippet(paragraphs_fts, 0, ?, ?, '…', ?) "
+                "FROM paragraphs_fts JOIN paragraphs p ON p.id = paragraphs_fts.rowid "
+                "WHERE paragraphs_fts MATCH ? AND paragraphs_fts.rowid > ? "
+                "ORDER BY paragraphs_fts.rowid LIMIT ?",
+                (
+                    self.MARK_OPEN, self.MARK_CLOSE,
+                    self.MARK_OPEN, self.MARK_CLOSE, settings.search_snippet_words,
+                    match, after_id or 0, limit,
+                )
+            ).fetchall()
+        finally:
+            conn.close()
+
+        return [
+            {
+                "id": row_id,
+                "chapter_index": chapter,
+                "paragraph_index": paragraph,
+                "word_offset": word_offset + self._hit_word(marked),
+                "snippet": self._highlight(snippet),
+            }
+            for row_id, chapter, paragraph, word_offset, marked, snippet in rows
+        ]
+
+    def _hit_word(self, marked: str) -> int:
+        """Номер слова абзаца (как в str.split()), на котором начинается первая отметка highlight"""
+        start = marked.find(self.MARK_OPEN)
+        if start < 0:
+            return 0
+        before = marked[:start]
+        index = len(before.split())
+        # Отметка внутри слова, например после кавычки: это слово и есть начало фразы
+        if before and not before[-1].isspace():
+            index -= 1
+        return index
+
+    def _highlight(self, snippet: str) -> str:
+        return (
+            html.escape(snippet, quote=False)
+            .replace(self.MARK_OPEN, "<mark>")
+            .replace(self.MARK_CLOSE, "</mark>")
+        )
+
+    def delete(self, book_id: int) -> None:
+        for path in self.base_dir.glob(f"{book_id}_*.fts"):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Warning: Could not delete text index {path}: {e}")
+
+
+text_index = TextIndex(Path(settings.search_index_dir))
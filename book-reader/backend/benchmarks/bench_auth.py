@@ -0,0 +1,64 @@
+"""
+Накладные расходы авторизации на один запрос: проверка initData без кеша и с кешем
+
+Запуск из папки backend:
+    python -m benchmarks.bench_auth
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import timeit
+from urllib.parse import urlencode
+
+from app.core import auth
+from app.core.config import settings
+from app.core.database import SessionLocal, init_db
+
+
+def make_init_data(telegram_id: int) -> str:
+    """initData, подписанная так же, как это делает Telegram"""
+    fields = {
+        "auth_date": str(int(time.time())),
+        "query_id": "AAHdF6IQAAAAAN0XohDhrOrc",
+        "user": json.dumps({"id": telegram_id, "first_name": "Bench", "username": "bench"}),
+    }
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", settings.tg_bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def main():
+    settings.skip_tg_validation = False
+    settings.tg_bot_token = settings.tg_bot_token or "123456:bench-token"
+    init_db()
+
+    header = f"Bearer {make_init_data(987654321)}"
+    number = 2000
+    loop = asyncio.new_event_loop()
+
+    def authenticate():
+        db = SessionLocal()
+        try:
+            user = loop.run_until_complete(auth.get_current_user(authorization=header, db=db))
+            return user.id
+        finally:
+            db.close()
+
+    def cold():
+        auth.auth_cache.clear()
+        authenticate()
+
+    for name, func in (("without cache", cold), ("with cache", authenticate)):
+        authenticate()
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        print(f"  {name:>14}: {seconds / number * 1e6:8.1f} us/request")
+
+    print(f"  cache: {auth.auth_cache.stats()}")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Разбор глав в блоки (FB2Parser.extract_blocks) против прежней склейки строк
+с маркерами подзаголовков, плюс размер глав в хранилище (JSON + zlib против текста + zlib)
+
+Запуск из папки backend:
+    python -m benchmarks.bench_chapter_blocks [путь к fb2 ...]
+
+Без аргументов берутся книги из data/books и синтетическая книга с глубокой вложенностью секций.
+"""
+import glob
+import json
+import os
+import sys
+import tempfile
+import timeit
+import zlib
+
+from lxml import etree
+
+from app.services.fb2_parser import FB2_NS, FB2Parser
+
+
+def extract_joined(parser: FB2Parser, section, skip_title=False, level=1) -> str:
+    """Прежний разбор: рекурсивный '\\n\\n'.join, подзаголовки - строки с маркером '#'"""
+    paragraphs = []
+    for elem in section:
+        if skip_title and elem.tag.endswith('title'):
+            continue
+        if elem.tag.endswith('p'):
+            text = ''.join(elem.itertext()).strip()
+            if text:
+                paragraphs.append(text)
+        elif elem.tag.endswith('section'):
+            title_elem = elem.find('fb:title', parser.ns)
+            if title_elem is not None:
+                parts = [''.join(p.itertext()).strip() for p in title_elem.findall('fb:p', parser.ns)]
+                parts = [part for part in parts if part]
+                if parts:
+                    paragraphs.append('#' * min(level + 2, 6) + ' ' + ' '.join(parts))
+            content = extract_joined(parser, elem, skip_title=True, level=level + 1)
+            if content:
+                paragraphs.append(content)
+    return '\n\n'.join(paragraphs)
+
+
+def extract_blocks(parser: FB2Parser, section) -> list:
+    blocks = []
+    parser.extract_blocks(section, blocks)
+    return blocks
+
+
+def nested_book(depth: int = 200, paragraphs: int = 20) -> str:
+    """Книга из одной главы с цепочкой вложенных секций"""
+    fd, path = tempfile.mkstemp(suffix=".fb2")
+    text = "Обычный текст абзаца без разметки, " * 6 + "одно слово <emphasis>с выделением</emphasis>."
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(f'<?xml version="1.0" encoding="utf-8"?><FictionBook xmlns="{FB2_NS}"><body><section>')
+        for level in range(depth):
+            f.write(f"<section><title><p>Часть {level}</p></title>")
+            f.write(f"<p>{text}</p>" * paragraphs)
+        f.write("</section>" * depth)
+        f.write("</section></body></FictionBook>")
+    return path
+
+
+def main():
+    synthetic = None if sys.argv[1:] else nested_book()
+    paths = sys.argv[1:] or sorted(glob.glob("data/books/*.fb2")) + [synthetic]
+    repeat = 5
+
+    for path in paths:
+        parser = FB2Parser(path)
+        root = etree.parse(path).getroot()
+        sections = root.find("fb:body", parser.ns).findall("fb:section", parser.ns)
+        print(f"{path}: {len(sections)} chapters")
+
+        for name, func in (
+            ("joined", lambda: [extract_joined(parser, s, skip_title=True) for s in sections]),
+            ("blocks", lambda: [extract_blocks(parser, s) for s in sections]),
+        ):
+            timings = timeit.repeat(func, number=1, repeat=repeat)
+            print(f"  {name:8} best {min(timings) * 1000:7.1f} ms   avg {sum(timings) / repeat * 1000:7.1f} ms")
+
+        joined = sum(len(zlib.compress(extract_joined(parser, s, skip_title=True).encode("utf-8"), 6)) for s in sections)
+        blocks = sum(
+            len(zlib.compress(json.dumps(extract_blocks(parser, s), ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6))
+            for s in sections
+        )
+        print(f"  stored: joined {joined} bytes, blocks {blocks} bytes")
+
+    if synthetic:
+        os.remove(synthetic)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Объем ответа с текстом книги и время его подготовки: сериализация
+стандартным json и orjson, сжатие gzip и brotli, запрос /content целиком
+
+Запуск из папки backend (база и хранилища создаются во временной папке):
+    python -m benchmarks.bench_compression [путь к fb2]
+"""
+import glob
+import os
+import sys
+import tempfile
+import time
+import timeit
+import zlib
+
+# Дочерние процессы парсинга импортируют этот модуль заново: папку берут из окружения
+BENCH_DIR = os.environ.setdefault("BENCH_DIR", tempfile.mkdtemp())
+os.environ["DATABASE_URL"] = f"sqlite:///{BENCH_DIR}/data/bench.db"
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.services.fb2_parser import FB2Parser  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def best(func, number: int = 5) -> float:
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def payload_stats(payload: dict) -> None:
+    print("serialization:")
+    encoded = jsonable_encoder(payload)
+    for name, response_class in (("json", JSONResponse), ("orjson", ORJSONResponse)):
+        seconds = best(lambda: response_class(encoded).body)
+        print(f"  {name:>8}: {seconds * 1000:7.1f} ms")
+    print(f"  jsonable_encoder (response_model): {best(lambda: jsonable_encoder(payload)) * 1000:7.1f} ms")
+
+    body = ORJSONResponse(encoded).body
+    print(f"compression of {len(body)} bytes:")
+    codecs = [(f"gzip {settings.compression_gzip_level}", lambda: zlib.compress(body, settings.compression_gzip_level))]
+    if brotli is not None:
+        codecs.append((f"br {settings.compression_brotli_quality}",
+                       lambda: brotli.compress(body, quality=settings.compression_brotli_quality)))
+    for name, compress in codecs:
+        size = len(compress())
+        print(f"  {name:>8}: {size:9d} bytes ({size / len(body):5.1%}), {best(compress) * 1000:7.1f} ms")
+
+
+def request_stats(sample: str) -> None:
+    from app.main import app
+
+    with TestClient(app) as client:
+        with open(sample, "rb") as f:
+            book_id = client.post("/api/books/", files={"file": ("sample.fb2", f)}).json()["book"]["id"]
+        encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+        for path in (f"/api/books/{book_id}/content", f"/api/books/{book_id}/chapters/5?window=1"):
+            print(f"GET {path}:")
+            for encoding in encodings:
+                headers = {"Accept-Encoding": encoding}
+                times = []
+                for _ in range(5):
+                    started = time.perf_counter()
+                    with client.stream("GET", path, headers=headers) as response:
+                        wire = sum(len(chunk) for chunk in response.iter_raw())
+                    times.append(time.perf_counter() - started)
+                print(f"  {encoding:>8}: {wire:9d} bytes on the wire, {min(times) * 1000:7.1f} ms")
+
+
+def main():
+    sample = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else sorted(glob.glob("data/books/*.fb2"))[0])
+    # Хранилища книг заданы относительными путями
+    os.chdir(BENCH_DIR)
+    os.makedirs("data", exist_ok=True)
+
+    chapters = FB2Parser(sample).parse_streaming()["chapters"]
+    payload = {
+        "chapters": [{"title": chapter["title"], "blocks": chapter["blocks"]} for chapter in chapters],
+        "current_chapter": 0,
+        "total_chapters": len(chapters),
+    }
+    print(f"{os.path.basename(sample)}: {len(chapters)} chapters")
+    payload_stats(payload)
+    request_stats(sample)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Пропускная способность API под конкурентной нагрузкой: синхронная сессия
+в пуле потоков (DB_ASYNC=false) против асинхронного драйвера (DB_ASYNC=true)
+
+Запуск из папки backend (база создается во временной папке):
+    python -m benchmarks.bench_db_async [одновременных клиентов] [запросов]
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+# Дочерние процессы получают папку базы через окружение
+DB_DIR = os.environ.setdefault("BENCH_DB_DIR", tempfile.mkdtemp())
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_DIR}/bench.db"
+
+import httpx  # noqa: E402
+
+from app.core import database  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.models import Book, User, UserBook  # noqa: E402
+
+BOOKS = 25
+
+
+def seed():
+    database.init_db()
+    db = database.SessionLocal()
+    user = User(telegram_id=settings.test_user_id, username=settings.test_username)
+    books = [Book(title=f"Книга {i}", author="Автор", file_path=f"{i}.fb2", total_pages=300) for i in range(BOOKS)]
+    db.add(user)
+    db.add_all(books)
+    db.commit()
+    db.add_all([UserBook(user_id=user.id, book_id=book.id, status="reading") for book in books])
+    db.commit()
+    db.close()
+
+
+async def load(clients: int, requests: int) -> dict:
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    counter = iter(range(requests))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for i in counter:
+                started = time.perf_counter()
+                if i % 10 == 0:
+                    response = await client.put(
+                        f"/api/user-books/{i % BOOKS + 1}/position",
+                        json={"current_position": i, "progress_percent": 1.0}
+                    )
+                elif i % 2:
+                    response = await client.get("/api/books/")
+                else:
+                    response = await client.get("/api/reading-sessions/stats")
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    await database.close_db()
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+def run_mode(clients: int, requests: int, results) -> None:
+    results.put(asyncio.run(load(clients, requests)))
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    seed()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{clients} клиентов, {requests} запросов (10% записей)")
+    for mode in ("false", "true"):
+        # Режим читается из окружения при импорте настроек в дочернем процессе
+        os.environ["DB_ASYNC"] = mode
+        results = context.Queue()
+        process = context.Process(target=run_mode, args=(clients, requests, results))
+        process.start()
+        result = results.get()
+        process.join()
+        print(f"  DB_ASYNC={mode:<5}: {result['rps']:7.0f} запр/с  "
+              f"p50 {result['p50']:6.1f} мс  p95 {result['p95']:6.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Конкурентный доступ к SQLite: одно общее соединение (StaticPool) против
+пула читающих соединений с одним пишущим
+
+Запуск из папки backend (база создается во временной папке):
+    python -m benchmarks.bench_db_concurrency [потоков] [секунд]
+
+Каждый режим запускается в отдельном процессе: общее соединение sqlite3
+при одновременном использовании из нескольких потоков может уронить интерпретатор.
+"""
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+# Дочерние процессы получают папку базы через окружение
+DB_DIR = os.environ.setdefault("BENCH_DB_DIR", tempfile.mkdtemp())
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_DIR}/bench.db"
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+from app.core import database  # noqa: E402
+from app.models import Book, User, UserBook  # noqa: E402
+from app.repositories.user_book_repository import UserBookRepository  # noqa: E402
+
+USERS = 20
+BOOKS_PER_USER = 25
+WRITE_RATIO = 0.1
+
+
+def seed():
+    database.init_db()
+    db = database.SessionLocal()
+    books = [Book(title=f"Книга {i}", author="Автор", file_path=f"{i}.fb2", total_pages=300) for i in range(BOOKS_PER_USER)]
+    db.add_all(books)
+    users = [User(telegram_id=1000 + i, username=f"user{i}") for i in range(USERS)]
+    db.add_all(users)
+    db.commit()
+    for user in users:
+        for book in books:
+            db.add(UserBook(user_id=user.id, book_id=book.id, status="reading"))
+    db.commit()
+    db.close()
+
+
+def legacy_sessionmaker():
+    engine = create_engine(
+        os.environ["DATABASE_URL"],
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def run(make_session, threads: int, seconds: float):
+    counters = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(seed_value):
+        rnd = random.Random(seed_value)
+        local = {"reads": 0, "writes": 0, "errors": 0}
+        while time.monotonic() < deadline:
+            db = make_session()
+            try:
+                repo = UserBookRepository(db)
+                user_id = rnd.randint(1, USERS)
+                user_books = repo.get_user_books(user_id)
+                if rnd.random() < WRITE_RATIO:
+                    user_book = rnd.choice(user_books)
+                    repo.update(user_book.id, {"current_position": rnd.randint(0, 100000)})
+                    local["writes"] += 1
+                else:
+                    local["reads"] += 1
+            except Exception:
+                db.rollback()
+                local["errors"] += 1
+            finally:
+                db.close()
+        with lock:
+            for key, value in local.items():
+                counters[key] += value
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return counters
+
+
+MODES = {
+    "StaticPool (одно соединение)": legacy_sessionmaker,
+    "читатели + один писатель": lambda: database.SessionLocal,
+}
+
+
+def run_mode(name: str, threads: int, seconds: float, results) -> None:
+    results.put(run(MODES[name](), threads, seconds))
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    seed()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{threads} потоков, {seconds:.0f} с, доля записей {WRITE_RATIO:.0%}")
+    for name in MODES:
+        results = context.Queue()
+        process = context.Process(target=run_mode, args=(name, threads, seconds, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"  {name:>30}: процесс упал (код {process.exitcode})")
+            continue
+
+        result = results.get()
+        total = result["reads"] + result["writes"]
+        print(f"  {name:>30}: {total / seconds:8.0f} оп/с  "
+              f"(чтений {result['reads']}, записей {result['writes']}, ошибок {result['errors']})")
+
+
+if __name__ == "__main__":
+    main()
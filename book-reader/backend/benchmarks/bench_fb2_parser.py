@@ -0,0 +1,70 @@
+"""
+Сравнение однопроходного FB2Parser.parse() с прежним многопроходным разбором
+
+Запуск из папки backend:
+    python -m benchmarks.bench_fb2_parser [путь к fb2 ...]
+"""
+import glob
+import sys
+import timeit
+
+from lxml import etree
+
+from app.services.fb2_parser import FB2Parser
+
+
+def parse_multi_pass(file_path: str) -> dict:
+    """
+    Прежний разбор: дерево целиком в памяти, отдельный проход
+    по нему для каждого поля (название, автор, обложка, главы, страницы)
+    """
+    parser = FB2Parser(file_path)
+    root = etree.parse(file_path).getroot()
+
+    def title_info():
+        return parser.read_title_info(root.find("fb:description/fb:title-info", parser.ns))
+
+    cover = None
+    cover_id = title_info()["cover_id"]
+    if cover_id:
+        binary = root.find(f'.//fb:binary[@id="{cover_id}"]', parser.ns)
+        if binary is not None:
+            cover = parser.decode_binary(binary)
+
+    chapters = []
+    body = root.find(".//fb:body", parser.ns)
+    if body is not None:
+        sections = body.findall("fb:section", parser.ns) or [body]
+        for i, section in enumerate(sections):
+            chapter = parser.build_chapter(section, i)
+            if chapter:
+                chapters.append(chapter)
+
+    words = len("".join(body.itertext()).split()) if body is not None else 0
+    return {
+        "title": title_info()["title"],
+        "author": title_info()["author"],
+        "annotation": title_info()["annotation"],
+        "cover": cover,
+        "chapters": chapters,
+        "total_pages": max(1, words // 250)
+    }
+
+
+def parse_single_pass(file_path: str) -> dict:
+    return FB2Parser(file_path).parse()
+
+
+def main():
+    paths = sys.argv[1:] or sorted(glob.glob("data/books/*.fb2"))
+    repeat = 10
+
+    for path in paths:
+        print(path)
+        for name, func in (("multi-pass", parse_multi_pass), ("single-pass", parse_single_pass)):
+            timings = timeit.repeat(lambda: func(path), number=1, repeat=repeat)
+            print(f"  {name:12} best {min(timings) * 1000:7.1f} ms   avg {sum(timings) / repeat * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Общие настройки тестов.
+
+Тесты запускаются из папки backend (python -m pytest). Каталоги данных
+и база переносятся во временную папку до импорта приложения:
+хранилища создают свои папки при импорте модулей.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+DATA_DIR = tempfile.mkdtemp(prefix="book-reader-tests-")
+
+for setting, folder in (
+    ("BOOKS_DIR", "books"),
+    ("CHAPTERS_DIR", "chapters"),
+    ("COVERS_DIR", "covers"),
+    ("IMAGES_DIR", "images"),
+    ("SEARCH_INDEX_DIR", "search"),
+    ("SPRITZ_DIR", "spritz"),
+    ("POSITIONS_DIR", "positions"),
+):
+    os.environ.setdefault(setting, os.path.join(DATA_DIR, folder))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(DATA_DIR, 'database.db')}")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
@@ -0,0 +1,205 @@
+"""
+Одна запись на книгу: миграция сводит существующие дубликаты,
+уникальные индексы не дают параллельным загрузкам создать новые.
+"""
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.core.database import Base, SessionLocal, init_db
+from app.core import migrations
+from app.core.migrations import run_migrations
+from app.main import app
+from app.models import Book, Bookmark, User, UserBook
+from app.services.book_ingest import BOOKS_DIR, content_path, parse_book_file, store_parsed_book
+from app.services.chapter_store import chapter_store
+
+
+def write_fb2(path, title: str) -> str:
+    path.write_text(
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0"><description><title-info>'
+        f"<author><first-name>Лев</first-name><last-name>Толстой</last-name></author><book-title>{title}</book-title>"
+        "</title-info></description><body><section><title><p>Глава</p></title>"
+        f"<p>Текст книги {title}.</p></section></body></FictionBook>",
+        encoding="utf-8",
+    )
+    return str(path)
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    """База версии 5: индексы по хешу и ID Флибусты еще не уникальные"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for name, column in (("ix_books_file_hash", "file_hash"), ("ix_books_flibusta_id", "flibusta_id")):
+            conn.execute(text(f"DROP INDEX {name}"))
+            conn.execute(text(f"CREATE INDEX {name} ON books ({column})"))
+        conn.execute(text("CREATE TABLE schema_version (version INTEGER NOT NULL)"))
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (5)"))
+    yield engine
+    engine.dispose()
+
+
+def test_migration_merges_duplicate_books(legacy_engine, tmp_path):
+    shared = tmp_path / "shared.fb2"
+    other = tmp_path / "other.fb2"
+    shared.write_bytes(b"<FictionBook/>")
+    other.write_bytes(b"<FictionBook/>")
+
+    with legacy_engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, telegram_id, library_version) VALUES (1, 1, 0), (2, 2, 0)"))
+        conn.execute(text(
+            "INSERT INTO books (id, title, author, file_path, file_hash, flibusta_id) VALUES "
+            "(1, 'Книга', 'Автор', :shared, 'h1', NULL), "
+            "(2, 'Книга', 'Автор', :shared, 'h1', NULL), "
+            "(3, 'Книга', 'Автор', :shared, 'h1', '42'), "
+            "(4, 'Книга', 'Автор', :other, 'h2', '42'), "
+            "(5, 'Другая', 'Автор', :other2, 'h3', NULL)"
+        ), {"shared": str(shared), "other": str(other), "other2": str(tmp_path / "missing.fb2")})
+        conn.execute(text(
+            "INSERT INTO user_books (id, user_id, book_id) VALUES (1, 1, 1), (2, 1, 2), (3, 2, 3), (4, 2, 4)"
+        ))
+        conn.execute(text("INSERT INTO bookmarks (user_book_id, user_id, position) VALUES (2, 1, 10), (4, 2, 20)"))
+        conn.execute(text("INSERT INTO reading_sessions (user_book_id, words_count) VALUES (2, 100), (3, 50)"))
+    chapter_store.save(2, "h1", [{"title": "Глава", "blocks": [["p", "Текст"]]}])
+
+    assert run_migrations(legacy_engine) >= 6
+
+    with legacy_engine.connect() as conn:
+        books = conn.execute(text("SELECT id, file_hash, flibusta_id FROM books ORDER BY id")).fetchall()
+        user_books = conn.execute(text("SELECT id, user_id, book_id FROM user_books ORDER BY id")).fetchall()
+        bookmarks = conn.execute(text("SELECT user_book_id, position FROM bookmarks ORDER BY position")).fetchall()
+        sessions = conn.execute(text("SELECT user_book_id, words_count FROM reading_sessions ORDER BY id")).fetchall()
+
+    assert [tuple(row) for row in books] == [(1, "h1", "42"), (5, "h3", None)]
+    # У каждого пользователя одна запись с оставшейся книгой, закладки и сессии перенесены на нее
+    assert [tuple(row) for row in user_books] == [(1, 1, 1), (3, 2, 1)]
+    assert [tuple(row) for row in bookmarks] == [(1, 10), (3, 20)]
+    assert [tuple(row) for row in sessions] == [(1, 100), (3, 50)]
+    # Файл удаленной книги больше не нужен, общий файл остался
+    assert shared.exists()
+    assert not other.exists()
+    assert chapter_store.load_index(2, "h1") is None
+
+    with legacy_engine.begin() as conn:
+        conn.execute(text("INSERT INTO books (title, author, file_path) VALUES ('А', 'Б', 'x'), ('В', 'Г', 'y')"))
+        with pytest.raises(IntegrityError):
+            conn.execute(text("INSERT INTO books (title, author, file_path, file_hash) VALUES ('Д', 'Е', 'z', 'h1')"))
+
+
+def test_failed_migration_keeps_files(legacy_engine, tmp_path, monkeypatch):
+    other = tmp_path / "other.fb2"
+    other.write_bytes(b"<FictionBook/>")
+    with legacy_engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO books (id, title, author, file_path, file_hash) VALUES "
+            "(1, 'Книга', 'Автор', 'shared.fb2', 'h1'), (2, 'Книга', 'Автор', :other, 'h1')"
+        ), {"other": str(other)})
+    chapter_store.save(2, "h1", [{"title": "Глава", "blocks": [["p", "Текст"]]}])
+
+    def broken_index(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(migrations, "_create_index", broken_index)
+    with pytest.raises(RuntimeError):
+        run_migrations(legacy_engine)
+
+    # Транзакция откатилась: вторая книга на месте, значит и ее файлы нужны
+    with legacy_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM books")).scalar() == 2
+    assert other.exists()
+    assert chapter_store.load_index(2, "h1") is not None
+
+
+def test_concurrent_store_returns_existing_book(tmp_path):
+    init_db()
+    upload = write_fb2(tmp_path / "upload.fb2", "Воскресение")
+    parsed_data = parse_book_file(upload)
+    file_hash = "a" * 64
+
+    db = SessionLocal()
+    try:
+        first_tmp = BOOKS_DIR / ".incoming_first.fb2"
+        second_tmp = BOOKS_DIR / ".incoming_second.fb2"
+        first_tmp.write_bytes(open(upload, "rb").read())
+        second_tmp.write_bytes(open(upload, "rb").read())
+
+        first = store_parsed_book(db, parsed_data, str(first_tmp), file_hash, "upload.fb2")
+        # Второй запрос проверил хеш раньше, чем первый создал запись
+        second = store_parsed_book(db, parsed_data, str(second_tmp), file_hash, "upload.fb2")
+
+        assert second.id == first.id
+        assert db.query(Book).filter(Book.file_hash == file_hash).count() == 1
+        assert content_path(file_hash).exists()
+        assert not second_tmp.exists()
+    finally:
+        db.close()
+
+
+def test_concurrent_flibusta_download_drops_losing_file(tmp_path):
+    init_db()
+    db = SessionLocal()
+    try:
+        first_data = parse_book_file(write_fb2(tmp_path / "first.fb2", "Детство"))
+        second_data = parse_book_file(write_fb2(tmp_path / "second.fb2", "Отрочество"))
+
+        first = store_parsed_book(db, first_data, str(tmp_path / "first.fb2"), "b" * 64, "7.fb2", "7")
+        # Под тем же ID Флибусты успел скачаться другой файл
+        second = store_parsed_book(db, second_data, str(tmp_path / "second.fb2"), "c" * 64, "7.fb2", "7")
+
+        assert second.id == first.id
+        assert db.query(Book).filter(Book.flibusta_id == "7").count() == 1
+        assert content_path("b" * 64).exists()
+        assert not content_path("c" * 64).exists()
+    finally:
+        db.close()
+
+
+def test_legacy_copy_is_merged_on_open(tmp_path):
+    """Две старые записи без хеша на копии одного файла: вторая при открытии сводится к первой"""
+    first_path = write_fb2(tmp_path / "first.fb2", "Хаджи-Мурат")
+    second_path = str(tmp_path / "second.fb2")
+    shutil.copy(first_path, second_path)
+
+    with TestClient(app) as client:
+        assert client.get("/api/books/media-token").status_code == 200
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.telegram_id == settings.test_user_id).one()
+            other = User(telegram_id=-1, username="other")
+            first = Book(title="Хаджи-Мурат", author="Лев Толстой", file_path=first_path, total_pages=1)
+            second = Book(title="Хаджи-Мурат", author="Лев Толстой", file_path=second_path, total_pages=1)
+            db.add_all([other, first, second])
+            db.commit()
+            kept = UserBook(user_id=user.id, book_id=first.id)
+            duplicate = UserBook(user_id=user.id, book_id=second.id)
+            moved = UserBook(user_id=other.id, book_id=second.id)
+            db.add_all([kept, duplicate, moved])
+            db.commit()
+            db.add(Bookmark(user_book_id=duplicate.id, user_id=user.id, position=5))
+            db.commit()
+        finally:
+            db.close()
+
+        assert client.get(f"/api/books/{first.id}/toc").status_code == 200
+        # Хеш второй книги уже занят первой: раньше здесь был постоянный 500
+        response = client.get(f"/api/books/{second.id}/toc")
+        assert response.status_code == 200
+        assert response.json()["book_id"] == first.id
+
+    db = SessionLocal()
+    try:
+        assert db.get(Book, second.id) is None
+        assert db.get(Book, first.id).file_hash is not None
+        user_books = db.query(UserBook.id, UserBook.book_id).filter(UserBook.id.in_([kept.id, duplicate.id, moved.id]))
+        assert sorted(tuple(row) for row in user_books) == [(kept.id, first.id), (moved.id, first.id)]
+        assert [bookmark.user_book_id for bookmark in db.query(Bookmark).filter(Bookmark.position == 5)] == [kept.id]
+    finally:
+        db.close()
+    assert not (tmp_path / "second.fb2").exists()
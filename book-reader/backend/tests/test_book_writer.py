@@ -0,0 +1,72 @@
+"""
+Прием книги потоком: распаковка gzip и ZIP до конца архива,
+обрезанный архив отклоняется.
+"""
+import gzip
+import hashlib
+import io
+import zipfile
+
+import pytest
+
+from app.services.book_ingest import BookFormatError, BookWriter
+
+
+# Хорошо сжимается: один кусок архива распаковывается во много кусков по CHUNK_SIZE
+BOOK = (
+    '<?xml version="1.0" encoding="utf-8"?><FictionBook><body><section>'
+    + "<p>Все счастливые семьи похожи друг на друга.</p>" * 100000
+    + "</section></body></FictionBook>"
+).encode("utf-8")
+
+
+def zip_book(data: bytes, name: str = "book.fb2") -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("readme.txt", "not a book")
+        archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def write(payload: bytes, chunk_size: int) -> BookWriter:
+    writer = BookWriter(max_size=len(BOOK) * 2)
+    for start in range(0, len(payload), chunk_size):
+        writer.write(payload[start:start + chunk_size])
+    return writer
+
+
+@pytest.mark.parametrize("pack", [gzip.compress, zip_book], ids=["gzip", "zip"])
+@pytest.mark.parametrize("chunk_size", [1024, 10 * 1024 * 1024], ids=["small-chunks", "one-chunk"])
+def test_archive_is_unpacked_completely(pack, chunk_size):
+    writer = write(pack(BOOK), chunk_size)
+    try:
+        assert writer.finish() == hashlib.sha256(BOOK).hexdigest()
+        assert writer.path.read_bytes() == BOOK
+    finally:
+        writer.discard()
+
+
+@pytest.mark.parametrize("pack", [gzip.compress, zip_book], ids=["gzip", "zip"])
+def test_truncated_archive_is_rejected(pack):
+    payload = pack(BOOK)
+    # ZIP обрезаем внутри данных FB2 записи, а не в центральном каталоге
+    cut = len(payload) // 2 if pack is gzip.compress else payload.index(b"book.fb2") + 200
+    writer = write(payload[:cut], 1024)
+    try:
+        with pytest.raises(BookFormatError, match="не полностью"):
+            writer.finish()
+    finally:
+        writer.discard()
+    assert not writer.path.exists()
+
+
+def test_zip_without_fb2_is_rejected():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("readme.txt", "not a book")
+    writer = write(buffer.getvalue(), 1024)
+    try:
+        with pytest.raises(BookFormatError, match="не найден"):
+            writer.finish()
+    finally:
+        writer.discard()
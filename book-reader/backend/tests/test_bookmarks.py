@@ -0,0 +1,65 @@
+"""
+Все закладки пользователя: владелец хранится в закладке,
+миграция заполняет его у существующих закладок.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base
+from app.core.migrations import run_migrations
+from app.repositories.bookmark_repository import BookmarkRepository
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    """База версии 6: у закладок еще нет user_id"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE bookmarks"))
+        conn.execute(text(
+            "CREATE TABLE bookmarks (id INTEGER PRIMARY KEY, "
+            "user_book_id INTEGER NOT NULL REFERENCES user_books(id) ON DELETE CASCADE, "
+            "position INTEGER NOT NULL, comment TEXT, created_at DATETIME)"
+        ))
+        conn.execute(text("CREATE TABLE schema_version (version INTEGER NOT NULL)"))
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (6)"))
+    yield engine
+    engine.dispose()
+
+
+def test_migration_backfills_bookmark_owner(legacy_engine):
+    start = datetime(2026, 1, 1)
+    with legacy_engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, telegram_id, library_version) VALUES (1, 1, 0), (2, 2, 0)"))
+        conn.execute(text(
+            "INSERT INTO books (id, title, author, file_path) VALUES (1, 'А', 'Б', 'a.fb2'), (2, 'В', 'Г', 'b.fb2')"
+        ))
+        conn.execute(text("INSERT INTO user_books (id, user_id, book_id) VALUES (1, 1, 1), (2, 1, 2), (3, 2, 1)"))
+        # Время - строкой с микросекундами, как его пишет SQLAlchemy: курсор сравнивает строки
+        for bookmark_id, user_book_id, minutes in ((1, 1, 0), (2, 2, 1), (3, 3, 2), (4, 1, 3)):
+            conn.execute(text(
+                "INSERT INTO bookmarks (id, user_book_id, position, created_at) VALUES (:id, :user_book_id, 0, :created_at)"
+            ), {"id": bookmark_id, "user_book_id": user_book_id, "created_at": str(start + timedelta(minutes=minutes, microseconds=1))})
+
+    assert run_migrations(legacy_engine) >= 7
+
+    with legacy_engine.connect() as conn:
+        owners = conn.execute(text("SELECT id, user_id FROM bookmarks ORDER BY id")).fetchall()
+    assert [tuple(row) for row in owners] == [(1, 1), (2, 1), (3, 2), (4, 1)]
+    indexes = {index["name"]: index["column_names"] for index in inspect(legacy_engine).get_indexes("bookmarks")}
+    assert indexes["ix_bookmarks_user_created"] == ["user_id", "created_at", "id"]
+
+    db = sessionmaker(bind=legacy_engine)()
+    try:
+        repo = BookmarkRepository(db)
+        first_page = repo.get_all_user_bookmarks(1, limit=2)
+        assert [bookmark.id for bookmark in first_page] == [4, 2]
+        last = first_page[-1]
+        assert [bookmark.id for bookmark in repo.get_all_user_bookmarks(1, after=(last.created_at, last.id))] == [1]
+        assert [bookmark.id for bookmark in repo.get_all_user_bookmarks(2)] == [3]
+    finally:
+        db.close()
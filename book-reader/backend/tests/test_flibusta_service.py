@@ -0,0 +1,165 @@
+"""
+Хеджирование запросов к зеркалам Флибусты на локальном HTTP сервере:
+одно зеркало зависает, второе отвечает 500, третье отдает поиск и файл книги.
+"""
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from app.core.config import settings
+from app.services.flibusta_service import FlibustaService, MirrorHealth
+
+
+SEARCH_HTML = """<html><head><meta charset="utf-8"></head><body><ul>
+<li>Лев Толстой — <a href="/b/101">Война и мир</a></li>
+<li>Лев Толстой — <a href="/b/102">Анна Каренина</a></li>
+</ul></body></html>""".encode("utf-8")
+EMPTY_HTML = b"<html><body><ul></ul></body></html>"
+
+# Больше куска скачивания, чтобы файл пришел в sink несколькими частями
+BOOK_FILE = bytes(range(256)) * 4096
+
+CLIENT_TIMEOUT = 0.5
+
+
+class Mirrors:
+    """Три зеркала на одном сервере: /hung, /broken и /good"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.requests = []
+        mirrors = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                mirror, _, path = url.path.lstrip("/").partition("/")
+                mirrors.requests.append(mirror)
+
+                if mirror == "hung":
+                    mirrors.release.wait(10)
+                    return
+                if mirror == "broken":
+                    self._reply(500, b"Internal Server Error", "text/plain")
+                elif path == "booksearch":
+                    query = parse_qs(url.query).get("ask", [""])[0]
+                    self._reply(200, SEARCH_HTML if query == "толстой" else EMPTY_HTML, "text/html; charset=utf-8")
+                elif path.startswith("b/"):
+                    self._reply(200, BOOK_FILE, "application/octet-stream")
+                else:
+                    self._reply(404, b"Not Found", "text/plain")
+
+            def _reply(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.hung, self.broken, self.good = f"{base}/hung", f"{base}/broken", f"{base}/good"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def mirrors():
+    mirrors = Mirrors()
+    yield mirrors
+    mirrors.stop()
+
+
+@pytest.fixture
+def service(mirrors, monkeypatch):
+    # Зависшее зеркало - основное из настроек, запросы к нему обрываются по таймауту клиента
+    monkeypatch.setattr(settings, "flibusta_url", mirrors.hung)
+    monkeypatch.setattr(settings, "flibusta_timeout", CLIENT_TIMEOUT)
+    monkeypatch.setattr(settings, "http_proxy_host", None)
+    service = FlibustaService(mirrors=[mirrors.hung, mirrors.broken, mirrors.good])
+    service.HEDGE_DELAY = 0.05
+    return service
+
+
+def run(service: FlibustaService, coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await service.close()
+    return asyncio.run(main())
+
+
+def test_search_hedges_to_good_mirror(service, mirrors):
+    started = time.monotonic()
+    books = run(service, service.search_books("Толстой"))
+    elapsed = time.monotonic() - started
+
+    assert [(book["id"], book["author"], book["title"]) for book in books] == [
+        ("101", "Лев Толстой", "Война и мир"),
+        ("102", "Лев Толстой", "Анна Каренина"),
+    ]
+    # Ответ хорошего зеркала не ждет таймаута зависшего
+    assert elapsed < CLIENT_TIMEOUT
+    assert mirrors.requests[0] == "hung"
+    assert service.health[mirrors.broken].failures == 1
+    assert service.health[mirrors.good].failures == 0
+    assert service.health[mirrors.good].latency is not None
+    assert service.search_cache.get(("толстой", 20)) == (books, True)
+
+
+def test_dead_mirrors_cool_down(service, mirrors):
+    # Пустая выдача не считается результатом: каждый поиск обходит все зеркала
+    async def search_nothing():
+        for attempt in range(MirrorHealth.FAILURES_BEFORE_DOWN):
+            assert await service.search_books(f"ничего {attempt}") == []
+
+    run(service, search_nothing())
+
+    for url in (mirrors.hung, mirrors.broken):
+        assert service.health[url].failures == MirrorHealth.FAILURES_BEFORE_DOWN
+        assert service.health[url].is_down
+    assert not service.health[mirrors.good].is_down
+    assert service._ranked_mirrors() == [mirrors.good]
+
+    # Пока идет пауза, недоступные зеркала не запрашиваются
+    mirrors.requests.clear()
+    books = run(service, service.search_books("толстой"))
+    assert len(books) == 2
+    assert mirrors.requests == ["good"]
+
+
+def test_download_streams_into_sink(service, mirrors):
+    chunks = []
+
+    async def sink(chunk: bytes) -> None:
+        chunks.append(chunk)
+
+    assert run(service, service.download_book("101", sink)) is True
+    assert b"".join(chunks) == BOOK_FILE
+    assert len(chunks) > 1
+    assert service.health[mirrors.good].failures == 0
+
+
+def test_download_fails_when_no_mirror_answers(service, mirrors, monkeypatch):
+    monkeypatch.setattr(service, "mirrors", [mirrors.hung, mirrors.broken])
+    chunks = []
+
+    async def sink(chunk: bytes) -> None:
+        chunks.append(chunk)
+
+    assert run(service, service.download_book("101", sink)) is False
+    assert chunks == []
@@ -0,0 +1,106 @@
+"""
+Обложки и иллюстрации по подписанным ссылкам: <img> не передает Authorization,
+поэтому книга должна быть в библиотеке владельца токена из ссылки.
+"""
+import base64
+import io
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.core.auth import issue_media_token
+from app.core.database import SessionLocal
+from app.main import app
+from app.repositories.user_repository import UserRepository
+
+
+def png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 60), (200, 30, 30)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+# Не картинка, хотя в FB2 объявлена как image/png
+SCRIPT = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(document.cookie)</script></svg>'
+
+
+def fb2_with_cover() -> bytes:
+    cover = base64.b64encode(png()).decode("ascii")
+    script = base64.b64encode(SCRIPT).decode("ascii")
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" xmlns:l="http://www.w3.org/1999/xlink">'
+        "<description><title-info><author><first-name>Иван</first-name><last-name>Бунин</last-name></author>"
+        '<book-title>Темные аллеи</book-title><coverpage><image l:href="#cover.png"/></coverpage>'
+        "</title-info></description><body><section><title><p>Глава</p></title>"
+        '<p>Текст с картинкой.</p><image l:href="#cover.png"/><image l:href="#evil.png"/></section></body>'
+        f'<binary id="cover.png" content-type="image/png">{cover}</binary>'
+        f'<binary id="evil.png" content-type="image/png">{script}</binary></FictionBook>'
+    ).encode("utf-8")
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def book_id(client):
+    response = client.post("/api/books/", files={"file": ("alleys.fb2", fb2_with_cover(), "application/octet-stream")})
+    assert response.status_code == 200
+    return response.json()["book"]["id"]
+
+
+@pytest.fixture(scope="module")
+def token(client):
+    response = client.get("/api/books/media-token")
+    assert response.status_code == 200
+    assert response.json()["expires"] > time.time()
+    return response.json()["token"]
+
+
+def stranger_token() -> str:
+    db = SessionLocal()
+    try:
+        user = UserRepository(db).create({"telegram_id": int(time.time() * 1000), "username": "stranger"})
+        return issue_media_token(user.id)["token"]
+    finally:
+        db.close()
+
+
+def test_cover_requires_signed_url(client, book_id, token):
+    response = client.get(f"/api/books/{book_id}/cover", params={"token": token, "size": "original"})
+    assert response.status_code == 200
+    assert response.content == png()
+    etag = response.headers["ETag"]
+
+    cached = client.get(
+        f"/api/books/{book_id}/cover", params={"token": token, "size": "original"}, headers={"If-None-Match": etag}
+    )
+    assert cached.status_code == 304
+
+    assert client.get(f"/api/books/{book_id}/cover").status_code == 422
+    forged = token[:-1] + ("1" if token.endswith("0") else "0")
+    assert client.get(f"/api/books/{book_id}/cover", params={"token": forged}).status_code == 403
+    # Книги нет в библиотеке владельца токена
+    assert client.get(f"/api/books/{book_id}/cover", params={"token": stranger_token()}).status_code == 404
+
+
+def test_image_type_is_checked_by_content(client, book_id, token):
+    response = client.get(f"/api/books/{book_id}/images/cover.png", params={"token": token})
+    assert response.status_code == 200
+    assert response.content == png()
+    assert response.headers["Content-Type"] == "image/png"
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+    assert response.headers["Content-Disposition"] == "inline"
+
+    # Объявленный тип не проверяется браузером: такие вложения не отдаются вовсе
+    assert client.get(f"/api/books/{book_id}/images/evil.png", params={"token": token}).status_code == 404
+
+
+def test_image_requires_signed_url(client, book_id, token):
+    assert client.get(f"/api/books/{book_id}/images/cover.png").status_code == 422
+    assert client.get(f"/api/books/{book_id}/images/cover.png", params={"token": stranger_token()}).status_code == 404
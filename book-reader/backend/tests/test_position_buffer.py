@@ -0,0 +1,63 @@
+"""
+Несохраненные позиции из буфера видны в ответах библиотеки и статистике
+без сброса буфера в БД, ETag библиотеки меняется вместе с ними.
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.position_buffer import position_buffer
+
+
+BOOK = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0"><description><title-info>'
+    "<author><first-name>Антон</first-name><last-name>Чехов</last-name></author><book-title>Степь</book-title>"
+    "</title-info></description><body>"
+    + "".join(f"<section><title><p>Глава {i}</p></title>" + "<p>Слово слово слово слово.</p>" * 200 + "</section>" for i in range(4))
+    + "</body></FictionBook>"
+).encode("utf-8")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    flushes = []
+    monkeypatch.setattr(position_buffer, "interval", 3600)
+    with TestClient(app) as client:
+        original = position_buffer.flush
+
+        async def counting_flush():
+            flushes.append(1)
+            return await original()
+
+        monkeypatch.setattr(position_buffer, "flush", counting_flush)
+        client.flushes = flushes
+        yield client
+
+
+def test_pending_position_is_served_without_flush(client):
+    user_book = client.post("/api/books/", files={"file": ("steppe.fb2", BOOK, "application/octet-stream")}).json()
+    # Первая позиция меняет статус на reading и записывается сразу
+    assert client.put(f"/api/user-books/{user_book['id']}/position", json={"chapter": 1}).status_code == 200
+    client.flushes.clear()
+    library = client.get("/api/books/")
+    stats = client.get("/api/users/me/stats").json()
+
+    response = client.put(f"/api/user-books/{user_book['id']}/position", json={"chapter": 2})
+    assert response.status_code == 200
+    assert position_buffer.get(user_book["id"])
+
+    # Старый ETag больше не подходит, в ответе позиция из буфера
+    changed = client.get("/api/books/", headers={"If-None-Match": library.headers["ETag"]})
+    assert changed.status_code == 200
+    served = next(item for item in changed.json() if item["id"] == user_book["id"])
+    assert served["progress_percent"] == pytest.approx(50.0)
+    assert client.get("/api/books/", headers={"If-None-Match": changed.headers["ETag"]}).status_code == 304
+
+    pending_stats = client.get("/api/users/me/stats").json()
+    assert pending_stats["total_pages"] > stats["total_pages"]
+    assert client.flushes == []
+
+    # После сброса статистика та же, что с поправкой из буфера
+    client.portal.call(position_buffer.close)
+    assert client.get("/api/users/me/stats").json() == pending_stats
@@ -0,0 +1,116 @@
+"""
+Планы горячих запросов: каждый запрос репозиториев должен идти по индексу,
+без полного просмотра таблиц и без сортировки во временном B-дереве.
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base
+from app.core.migrations import run_migrations
+from app.models import Book, Bookmark, ReadingSession, User, UserBook
+from app.repositories.book_repository import BookRepository
+from app.repositories.bookmark_repository import BookmarkRepository
+from app.repositories.reading_session_repository import ReadingSessionRepository
+from app.repositories.user_book_repository import UserBookRepository
+
+
+def hot_queries(db, user, book, user_book):
+    user_books = UserBookRepository(db)
+    books = BookRepository(db)
+    return {
+        "UserBookRepository.get_user_books": lambda: user_books.get_user_books(user.id),
+        "UserBookRepository.get_user_books(status)": lambda: user_books.get_user_books(user.id, "reading"),
+        "UserBookRepository.get_user_books(page)": lambda: user_books.get_user_books(
+            user.id, limit=51, after_id=user_book.id, columns=["status"], book_columns=["title"]
+        ),
+        "UserBookRepository.get_user_books(status, page)": lambda: user_books.get_user_books(
+            user.id, "reading", limit=51, after_id=user_book.id
+        ),
+        "UserBookRepository.get_by_user_and_book": lambda: user_books.get_by_user_and_book(user.id, book.id),
+        "UserBookRepository.count_by_book": lambda: user_books.count_by_book(book.id),
+        "BookmarkRepository.get_by_user_book": lambda: BookmarkRepository(db).get_by_user_book(user_book.id),
+        "BookmarkRepository.get_by_user_book(page)": lambda: BookmarkRepository(db).get_by_user_book(
+            user_book.id, limit=51, after=(10, 1)
+        ),
+        "BookmarkRepository.get_all_user_bookmarks(page)": lambda: BookmarkRepository(db).get_all_user_bookmarks(
+            user.id, limit=51, after=(datetime.utcnow(), 1)
+        ),
+        "ReadingSessionRepository.get_by_user_book": lambda: ReadingSessionRepository(db).get_by_user_book(user_book.id),
+        "ReadingSessionRepository.get_average_speed": lambda: ReadingSessionRepository(db).get_average_speed(user.id),
+        "BookRepository.get_by_hash": lambda: books.get_by_hash("abc"),
+        "BookRepository.get_by_flibusta_id": lambda: books.get_by_flibusta_id("1"),
+        "BookRepository.count_by_file_path": lambda: books.count_by_file_path("a.fb2"),
+    }
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    """Временная база SQLite, созданная по моделям, как при первом запуске"""
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine, fresh=True)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def queries(engine):
+    db = sessionmaker(bind=engine, expire_on_commit=False)()
+    user = User(telegram_id=1, username="explain")
+    book = Book(title="Книга", author="Автор", file_path="a.fb2", file_hash="abc", flibusta_id="1", total_pages=10)
+    db.add_all([user, book])
+    db.commit()
+    user_book = UserBook(user_id=user.id, book_id=book.id, status="reading")
+    db.add(user_book)
+    db.commit()
+    db.add_all([
+        Bookmark(user_book_id=user_book.id, user_id=user.id, position=10),
+        ReadingSession(user_book_id=user_book.id, words_count=100, speed_wpm=300, duration_seconds=20),
+    ])
+    db.commit()
+    yield db, hot_queries(db, user, book, user_book)
+    db.close()
+
+
+def capture(engine, query):
+    """SQL и параметры всех запросов, выполненных функцией"""
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        query()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return statements
+
+
+def problems(plan):
+    issues = []
+    for row in plan:
+        detail = row[-1]
+        # SCAN по индексу допустим (например, покрывающий индекс для COUNT), полный просмотр таблицы - нет
+        if detail.startswith("SCAN") and "INDEX" not in detail:
+            issues.append(detail)
+        if "TEMP B-TREE" in detail:
+            issues.append(detail)
+    return issues
+
+
+@pytest.mark.parametrize("name", list(hot_queries(None, User(id=1), Book(id=1), UserBook(id=1))))
+def test_hot_query_uses_index(engine, queries, name):
+    db, hot = queries
+    db.expunge_all()
+    statements = capture(engine, hot[name])
+    assert statements
+
+    for statement, parameters in statements:
+        with engine.connect() as conn:
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        issues = problems(plan)
+        assert not issues, "\n".join([statement] + [row[-1] for row in plan])
@@ -0,0 +1,51 @@
+"""
+Поиск по тексту книги: номер слова, с которого начинается найденная фраза.
+"""
+import pytest
+
+from app.services.text_index import TextIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    text_index = TextIndex(tmp_path)
+    text_index.build(1, "hash", [
+        {"title": "Первая", "blocks": [["h1", "Пролог"], ["p", "Одна две три"]]},
+        {"title": "Вторая", "blocks": [
+            ["empty", ""],
+            ["p", "Война началась внезапно, а потом была война и мир наступил"],
+            ["p", "Потом «Войну и мир» перечитывали все"],
+        ]},
+    ])
+    return text_index
+
+
+def test_word_offset_points_to_phrase_start(index):
+    hits = index.search(1, "hash", "война и мир")
+
+    assert [(hit["chapter_index"], hit["paragraph_index"]) for hit in hits] == [(1, 1), (1, 2)]
+    # Пролог (1 слово) и первый абзац (3 слова) идут раньше: смещение абзацев 4 и 14
+    assert hits[0]["word_offset"] == 4 + 6
+    # Фраза начинается внутри слова «Войну: это второе слово абзаца
+    assert hits[1]["word_offset"] == 14 + 1
+    assert hits[0]["snippet"].startswith("Война началась внезапно, а потом была <mark>война и мир</mark>")
+
+
+def test_single_word_offset(index):
+    hits = index.search(1, "hash", "наступил")
+    assert [hit["word_offset"] for hit in hits] == [4 + 9]
+
+
+def test_short_words_match_exactly(tmp_path):
+    text_index = TextIndex(tmp_path)
+    text_index.build(2, "hash", [{"title": "Глава", "blocks": [
+        ["p", "Лес изобиловал дичью"],
+        ["p", "Пришли из леса"],
+        ["p", "Лес и поле"],
+    ]}])
+
+    # Префикс "и*" находил бы и "изобиловал", и "из"
+    assert [hit["paragraph_index"] for hit in text_index.search(2, "hash", "и")] == [2]
+    assert [hit["paragraph_index"] for hit in text_index.search(2, "hash", "лес и")] == [2]
+    # Длинные слова по-прежнему ищутся по основе
+    assert [hit["paragraph_index"] for hit in text_index.search(2, "hash", "лесами")] == [0, 1, 2]
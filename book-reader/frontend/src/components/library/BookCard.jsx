@@ -1,6 +1,7 @@
 import React from 'react';
 import { BookOpen } from 'lucide-react';
 import { useNavigate } from 'react-router-dom';
+import { getBooksService } from '../../services/books';
 
 const BookCard = ({ userBook, theme }) => {
   const navigate = useNavigate();
@@ -30,9 +31,19 @@ const BookCard = ({ userBook, theme }) => {
           display: 'flex',
           alignItems: 'center',
           justifyContent: 'center',
+          overflow: 'hidden',
         }}
       >
-        <BookOpen size={32} color="rgba(0,0,0,0.3)" />
+        {book.cover_path ? (
+          <img
+            src={getBooksService.getCoverUrl(book.id)}
+            alt={book.title}
+            loading="lazy"
+            style={{ width: '100%', height: '100%', objectFit: 'cover' }}
+          />
+        ) : (
+          <BookOpen size={32} color="rgba(0,0,0,0.3)" />
+        )}
       </div>
       <h3
         style={{
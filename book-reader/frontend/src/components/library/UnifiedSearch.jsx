@@ -31,16 +31,13 @@ const UnifiedSearch = ({ theme, onBookAdded, darkMode }) => {
 
     setError('');
 
-    // Поиск в библиотеке
+    // Поиск в библиотеке: полнотекстовый на сервере, результаты по релевантности
     setLoadingLibrary(true);
     try {
-      const response = await api.get('/api/books');
-      const filtered = response.data.filter(
-        (userBook) =>
-          userBook.book.title.toLowerCase().includes(searchQuery.toLowerCase()) ||
-          userBook.book.author.toLowerCase().includes(searchQuery.toLowerCase())
-      );
-      setLibraryResults(filtered);
+      const response = await api.get('/api/books/search', {
+        params: { q: searchQuery, limit: 20 }
+      });
+      setLibraryResults(response.data);
     } catch (err) {
       console.error('Library search error:', err);
     } finally {
@@ -2,10 +2,14 @@ import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
 import { ArrowLeft, Heart, ChevronLeft, ChevronRight, Sun, Moon, Zap, List, Hash } from 'lucide-react';
 import { getTheme } from '../../utils/theme';
+import { escapeHtml, renderBlocks } from '../../utils/blocks';
 import { getBooksService } from '../../services/books';
 import api from '../../services/api';
 import SpritzReader from '../spritz/SpritzReader';
 
+// Сколько соседних глав с каждой стороны приходит в одном запросе /chapters (максимум сервера - 5)
+const CHAPTER_WINDOW = 5;
+
 const Reader = ({ darkMode, setDarkMode }) => {
   const theme = getTheme(darkMode);
   const navigate = useNavigate();
@@ -25,101 +29,108 @@ const Reader = ({ darkMode, setDarkMode }) => {
   // Spritz states
   const [spritzMode, setSpritzMode] = useState(false);
   const [spritzSelectMode, setSpritzSelectMode] = useState(false);
-  const [rawChapters, setRawChapters] = useState([]);
+  const [rawChapters, setRawChapters] = useState([]); // Оглавление: index, title, words
+  const [chaptersLoaded, setChaptersLoaded] = useState(false); // Загружены все главы, а не только окно у позиции
   const [currentChapterIndex, setCurrentChapterIndex] = useState(0);
   const [showSpritzEndModal, setShowSpritzEndModal] = useState(false);
   const [spritzInitialIndex, setSpritzInitialIndex] = useState(0);
+  // Слова текущей главы для Spritz: { chapter, stream }, приходят с сервера уже разобранными
+  const [spritz, setSpritz] = useState(null);
   
   // Navigation modals
   const [showPageModal, setShowPageModal] = useState(false);
   const [showTocModal, setShowTocModal] = useState(false);
   const [pageInputValue, setPageInputValue] = useState('');
+  // HTML открытого примечания
+  const [noteHtml, setNoteHtml] = useState(null);
   
   const contentRef = useRef(null);
   const currentAnchorRef = useRef(null);
   const lastSpritzIndexRef = useRef(0);
+  const spritzCacheRef = useRef({});
+  const notesRef = useRef(null);
 
-  // Загрузка книги и всего контента
+  // Загрузка книги: оглавление, затем главы окнами через /chapters.
+  // Первым приходит окно вокруг сохраненной позиции, остальные главы - следом
   useEffect(() => {
+    let cancelled = false;
+
+    const chapterHtml = (ch, idx) => {
+        const chapterId = `chapter-${idx}`;
+        // Блоки главы с ID абзацев для отслеживания позиции; пока глава не загружена - только заголовок
+        const paragraphs = ch.blocks ? renderBlocks(ch.blocks, {
+            idPrefix: chapterId,
+            imageUrl: (imageId) => getBooksService.getImageUrl(bookId, imageId)
+        }) : '';
+
+        // break-before: column гарантирует начало с новой колонки (страницы)
+        // Добавляем ID и класс к заголовку для отслеживания
+        return `
+          <div id="${chapterId}" class="chapter" style="break-before: column; margin-bottom: 20vh;">
+             <h3 id="${chapterId}-title" class="reader-header" style="font-size: 1.4em; font-weight: bold; margin-bottom: 1em; margin-top: 1em; color: inherit; text-align: center; break-after: avoid;">${escapeHtml(ch.title)}</h3>
+             ${paragraphs}
+          </div>
+        `;
+    };
+
+    const loadWindow = async (chapters, index) => {
+        const data = await getBooksService.getChapters(bookId, index, CHAPTER_WINDOW);
+        data.chapters.forEach((ch) => { chapters[ch.index] = ch; });
+    };
+
     const loadData = async () => {
       try {
         setLoading(true);
-        const [bookData, contentData] = await Promise.all([
+        setChaptersLoaded(false);
+        const [bookData, toc] = await Promise.all([
           getBooksService.getById(bookId),
-          getBooksService.getContent(bookId)
+          getBooksService.getToc(bookId)
         ]);
-        
+        if (cancelled) return;
+
         setBook(bookData);
-        
-        if (contentData?.chapters) {
-           setRawChapters(contentData.chapters);
-           let fullText = '';
-           const info = [];
-           contentData.chapters.forEach((ch, idx) => {
-               const chapterId = `chapter-${idx}`;
-               info.push({ id: chapterId, title: ch.title, index: idx });
-
-               // Параграфы с ID для отслеживания позиции
-               const paragraphs = ch.content
-                   .split('\n\n')
-                   .filter(p => p.trim())
-                   .map((p, pIdx) => {
-                       const trimmed = p.trim();
-                       
-                       // Проверяем, является ли параграф подзаголовком (поддержка разных уровней)
-                       const headerMatch = trimmed.match(/^(#{3,6})\s+(.+)$/);
-                       if (headerMatch) {
-                           const level = headerMatch[1].length; // 3, 4, 5 или 6
-                           const subtitle = headerMatch[2];
-                           
-                           // Символы и стили в зависимости от уровня вложенности
-                           const styles = {
-                               3: { symbol: '§', fontSize: '1em', marginTop: '1.5em', indent: '0em' },
-                               4: { symbol: '◆', fontSize: '1em', marginTop: '1.2em', indent: '1em' },
-                               5: { symbol: '●', fontSize: '0.95em', marginTop: '1em', indent: '2em' },
-                               6: { symbol: '◦', fontSize: '0.95em', marginTop: '0.8em', indent: '3em' }
-                           };
-                           
-                           const style = styles[level] || styles[3];
-                           
-                           return `
-                               <p id="${chapterId}-p-${pIdx}" class="reader-subheader" style="
-                                   margin: ${style.marginTop} 0 0.6em 0; 
-                                   padding-left: ${style.indent};
-                                   text-align: left;
-                                   font-size: ${style.fontSize}; 
-                                   font-weight: 600; 
-                                   opacity: 0.5;
-                                   text-indent: 0;
-                                   break-after: avoid;
-                               "><span style="font-family: monospace; font-weight: 700;">${style.symbol}</span> ${subtitle}</p>
-                           `;
-                       }
-                       
-                       return `<p id="${chapterId}-p-${pIdx}" class="reader-paragraph" style="margin-bottom: 0.8em; text-align: justify; text-indent: 1.5em;">${trimmed}</p>`;
-                   })
-                   .join('');
-
-               // break-before: column гарантирует начало с новой колонки (страницы)
-               // Добавляем ID и класс к заголовку для отслеживания
-               fullText += `
-                 <div id="${chapterId}" class="chapter" style="break-before: column; margin-bottom: 20vh;">
-                    <h3 id="${chapterId}-title" class="reader-header" style="font-size: 1.4em; font-weight: bold; margin-bottom: 1em; margin-top: 1em; color: inherit; text-align: center; break-after: avoid;">${ch.title}</h3>
-                    ${paragraphs}
-                 </div>
-               `;
-           });
-           setFullContent(fullText);
-           setChaptersInfo(info);
+        setRawChapters(toc.chapters);
+        setChaptersInfo(toc.chapters.map((ch) => ({ id: `chapter-${ch.index}`, title: ch.title, index: ch.index })));
+        if (!toc.chapters.length) return;
+
+        let startChapter = 0;
+        if (bookData.current_position > 0) {
+            try {
+                const resolved = await getBooksService.resolvePosition(bookId, { position: bookData.current_position });
+                startChapter = Math.min(resolved.chapter, toc.chapters.length - 1);
+            } catch (error) {
+                console.error('Error resolving position:', error);
+            }
         }
 
+        const chapters = toc.chapters.map((ch) => ({ title: ch.title }));
+        const render = () => setFullContent(chapters.map(chapterHtml).join(''));
+
+        await loadWindow(chapters, startChapter);
+        if (cancelled) return;
+        render();
+        setLoading(false);
+
+        // Остальные главы: центры окон так, чтобы окна не перекрывались
+        const pending = [];
+        for (let idx = 0; idx < chapters.length; idx++) {
+            if (!chapters[idx].blocks) {
+                pending.push(loadWindow(chapters, Math.min(idx + CHAPTER_WINDOW, chapters.length - 1)));
+                idx += 2 * CHAPTER_WINDOW;
+            }
+        }
+        await Promise.all(pending);
+        if (cancelled) return;
+        render();
+        setChaptersLoaded(true);
       } catch (error) {
         console.error('Error loading:', error);
       } finally {
-        setLoading(false);
+        if (!cancelled) setLoading(false);
       }
     };
     loadData();
+    return () => { cancelled = true; };
   }, [bookId]);
 
   // Расчет страниц и восстановление позиции
@@ -133,6 +144,24 @@ const Reader = ({ darkMode, setDarkMode }) => {
     };
   }, [fullContent, fontSize]);
 
+  // Иллюстрации меняют высоту колонок после загрузки: пересчитываем страницы.
+  // Событие load не всплывает, поэтому слушаем на фазе перехвата
+  useEffect(() => {
+      const content = contentRef.current;
+      if (!content) return;
+      let timer = null;
+      const handleImageLoad = (e) => {
+          if (e.target.tagName !== 'IMG') return;
+          clearTimeout(timer);
+          timer = setTimeout(calculatePages, 150);
+      };
+      content.addEventListener('load', handleImageLoad, true);
+      return () => {
+          clearTimeout(timer);
+          content.removeEventListener('load', handleImageLoad, true);
+      };
+  }, [fullContent]);
+
   // Обновляем "якорь" (видимый элемент) при смене страницы
   useEffect(() => {
       // Ждем окончания анимации перехода (300мс) + небольшой буфер
@@ -147,11 +176,31 @@ const Reader = ({ darkMode, setDarkMode }) => {
 
   // Восстановление позиции при первой загрузке
   useEffect(() => {
-      if (book && totalPages > 1 && currentPage === 0 && book.progress_percent > 0) {
+      if (!(book && totalPages > 1 && currentPage === 0 && book.progress_percent > 0)) return;
+      
+      // Доля страниц имеет смысл только когда загружены все главы
+      const restoreByProgress = () => {
+          if (!chaptersLoaded) return;
           const page = Math.floor((book.progress_percent / 100) * totalPages);
           setCurrentPage(Math.min(page, totalPages - 1));
-      }
-  }, [book, totalPages]);
+      };
+      
+      // Позиция - номер слова, сервер переводит его в главу и абзац.
+      // В старых записях там номер страницы: прогресс для нее с сохраненным не совпадет.
+      getBooksService.resolvePosition(bookId, { position: book.current_position })
+          .then((resolved) => {
+              const paragraphId = `chapter-${resolved.chapter}-p-${resolved.paragraph}`;
+              const el = document.getElementById(paragraphId);
+              if (el && Math.abs(resolved.progress_percent - book.progress_percent) < 0.01) {
+                  // Якорь держит страницу, когда догружаются главы перед позицией
+                  currentAnchorRef.current = paragraphId;
+                  setCurrentPage(Math.min(Math.floor(el.offsetLeft / window.innerWidth), totalPages - 1));
+              } else {
+                  restoreByProgress();
+              }
+          })
+          .catch(restoreByProgress);
+  }, [book, totalPages, chaptersLoaded]);
 
   const updateAnchor = () => {
       // Ищем элемент в центре экрана
@@ -222,82 +271,100 @@ const Reader = ({ darkMode, setDarkMode }) => {
       setCurrentChapterIndex(foundIndex);
   };
   
+  const loadSpritz = (chapterIdx) => {
+      const cache = spritzCacheRef.current;
+      if (!cache[chapterIdx]) {
+          cache[chapterIdx] = getBooksService.getSpritz(bookId, chapterIdx).catch((error) => {
+              delete cache[chapterIdx];
+              throw error;
+          });
+      }
+      return cache[chapterIdx];
+  };
+
+  // Поток слов загружается при входе в Spritz и при переходе к следующей главе
+  useEffect(() => {
+      if (!spritzMode) return;
+      let cancelled = false;
+      loadSpritz(currentChapterIndex)
+          .then((stream) => {
+              if (!cancelled) setSpritz({ chapter: currentChapterIndex, stream });
+          })
+          .catch((error) => console.error('Error loading spritz stream:', error));
+      return () => { cancelled = true; };
+  }, [spritzMode, currentChapterIndex, bookId]);
+
+  // Переход на страницу с абзацем, в котором находится слово главы.
+  // Начала абзацев приходят с сервера в той же нумерации, что id абзацев на странице.
+  const showSpritzWord = (wordIndex) => {
+      const chapterInfo = chaptersInfo.find(c => c.index === currentChapterIndex);
+      if (!chapterInfo || !spritz || spritz.chapter !== currentChapterIndex || wordIndex <= 0) return;
+      
+      const paragraphId = `${chapterInfo.id}-p-${spritz.stream.paragraphOf(wordIndex)}`;
+      const el = document.getElementById(paragraphId);
+      
+      if (el) {
+          const newPage = Math.floor(el.offsetLeft / window.innerWidth);
+          changePage(newPage);
+      }
+  };
+
   const handleSpritzClose = (lastIndex, totalWords) => {
       // Сохраняем текущую позицию для возможного возврата
       lastSpritzIndexRef.current = lastIndex;
       setSpritzMode(false);
-      
-      const currentChapter = rawChapters[currentChapterIndex];
-      const chapterInfo = chaptersInfo.find(c => c.index === currentChapterIndex);
-      
-      if (currentChapter && chapterInfo && lastIndex > 0) {
-          // Split into paragraphs exactly as we did for rendering
-          const paragraphs = currentChapter.content.split('\n\n').filter(p => p.trim());
-          
-          let wordCount = 0;
-          let targetParagraphIndex = paragraphs.length > 0 ? paragraphs.length - 1 : 0;
-          
-          for (let i = 0; i < paragraphs.length; i++) {
-              // Same split logic as SpritzReader
-              const pWords = paragraphs[i].split(/\s+/).filter(w => w.length > 0).length;
-              if (wordCount + pWords > lastIndex) {
-                  targetParagraphIndex = i;
-                  break;
-              }
-              wordCount += pWords;
-          }
-          
-          // Find the element
-          const paragraphId = `${chapterInfo.id}-p-${targetParagraphIndex}`;
-          const el = document.getElementById(paragraphId);
-          
-          if (el) {
-              const newPage = Math.floor(el.offsetLeft / window.innerWidth);
-              changePage(newPage);
-          }
-      }
+      showSpritzWord(lastIndex);
   };
 
   const handleExitFromEndModal = () => {
       // Используем сохраненную позицию для возврата
-      const currentChapter = rawChapters[currentChapterIndex];
-      const chapterInfo = chaptersInfo.find(c => c.index === currentChapterIndex);
-      
       setShowSpritzEndModal(false);
       setSpritzMode(false);
-      
-      if (currentChapter && chapterInfo && lastSpritzIndexRef.current > 0) {
-          const paragraphs = currentChapter.content.split('\n\n').filter(p => p.trim());
-          
-          let wordCount = 0;
-          let targetParagraphIndex = paragraphs.length > 0 ? paragraphs.length - 1 : 0;
-          
-          for (let i = 0; i < paragraphs.length; i++) {
-              const pWords = paragraphs[i].split(/\s+/).filter(w => w.length > 0).length;
-              if (wordCount + pWords > lastSpritzIndexRef.current) {
-                  targetParagraphIndex = i;
-                  break;
-              }
-              wordCount += pWords;
+      showSpritzWord(lastSpritzIndexRef.current);
+  };
+
+  // Примечания загружаются один раз при первом открытии
+  const openNote = async (noteId) => {
+      try {
+          if (!notesRef.current) {
+              notesRef.current = getBooksService.getNotes(bookId).catch((error) => {
+                  notesRef.current = null;
+                  throw error;
+              });
           }
-          
-          // Find the element
-          const paragraphId = `${chapterInfo.id}-p-${targetParagraphIndex}`;
-          const el = document.getElementById(paragraphId);
-          
-          if (el) {
-              const newPage = Math.floor(el.offsetLeft / window.innerWidth);
-              changePage(newPage);
+          const notes = await notesRef.current;
+          if (notes[noteId]) {
+              setNoteHtml(renderBlocks(notes[noteId]));
           }
+      } catch (error) {
+          console.error('Error loading notes:', error);
+      }
+  };
+
+  const handleContentClick = (e) => {
+      const link = e.target.closest('a.reader-note');
+      if (link) {
+          e.stopPropagation();
+          openNote(link.dataset.note);
       }
   };
 
+  // Зоны листания лежат поверх текста: ссылку на примечание под ними ищем по координатам
+  const noteAtPoint = (e) => {
+      const link = document.elementsFromPoint(e.clientX, e.clientY)
+          .find(el => el.matches && el.matches('a.reader-note'));
+      if (!link) return false;
+      e.stopPropagation();
+      openNote(link.dataset.note);
+      return true;
+  };
+
   const enterSpritzSelectMode = () => {
       setSpritzSelectMode(true);
       setShowControls(false);
   };
 
-  const handleParagraphClick = (e) => {
+  const handleParagraphClick = async (e) => {
       if (!spritzSelectMode) return;
       
       // Находим кликнутый параграф
@@ -317,18 +384,15 @@ const Reader = ({ darkMode, setDarkMode }) => {
       
       let startIndex = 0;
       
-      // Если кликнули на заголовок
-      if (target.id.includes('-title')) {
-          startIndex = 0;
-      } 
-      // Если кликнули на параграф
-      else if (target.id.includes('-p-')) {
+      // Если кликнули на параграф - начинаем с его первого слова
+      if (target.id.includes('-p-')) {
           const pIdx = parseInt(idParts[3], 10);
-          const paragraphs = currentChapter.content.split('\n\n').filter(p => p.trim());
-          
-          for (let i = 0; i < pIdx && i < paragraphs.length; i++) {
-              const pWords = paragraphs[i].split(/\s+/).filter(w => w.length > 0).length;
-              startIndex += pWords;
+          try {
+              const stream = await loadSpritz(chapterIdx);
+              startIndex = stream.paragraphStarts[pIdx] ?? 0;
+          } catch (error) {
+              console.error('Error loading spritz stream:', error);
+              return;
           }
       }
       
@@ -381,10 +445,8 @@ const Reader = ({ darkMode, setDarkMode }) => {
 
   const handleSpritzComplete = () => {
     // Сохраняем последнюю позицию (конец главы)
-    const currentChapter = rawChapters[currentChapterIndex];
-    if (currentChapter) {
-      const words = currentChapter.content.split(/\s+/).filter(w => w.length > 0);
-      lastSpritzIndexRef.current = words.length - 1;
+    if (spritz && spritz.chapter === currentChapterIndex) {
+      lastSpritzIndexRef.current = spritz.stream.count - 1;
     }
     setShowSpritzEndModal(true);
   };
@@ -393,6 +455,7 @@ const Reader = ({ darkMode, setDarkMode }) => {
     const nextIndex = currentChapterIndex + 1;
     if (nextIndex < rawChapters.length) {
         setCurrentChapterIndex(nextIndex);
+        setSpritzInitialIndex(0);
         setShowSpritzEndModal(false);
         
         // Sync reader position to the new chapter
@@ -411,14 +474,39 @@ const Reader = ({ darkMode, setDarkMode }) => {
     }
   };
 
+  // Первый абзац, начинающийся на странице, из id вида chapter-3-p-12
+  const paragraphOnPage = (page) => {
+      if (!contentRef.current) return null;
+      const paragraphs = contentRef.current.querySelectorAll('p[id*="-p-"]');
+      const pageStart = page * window.innerWidth;
+      
+      // Абзацы идут по колонкам слева направо: двоичный поиск по offsetLeft
+      let lo = 0;
+      let hi = paragraphs.length;
+      while (lo < hi) {
+          const mid = (lo + hi) >> 1;
+          if (paragraphs[mid].offsetLeft < pageStart) lo = mid + 1;
+          else hi = mid;
+      }
+      // Страница целиком внутри длинного абзаца - берем абзац, начавшийся раньше
+      const startsOnPage = lo < paragraphs.length && paragraphs[lo].offsetLeft < pageStart + window.innerWidth;
+      const el = paragraphs[startsOnPage ? lo : lo - 1];
+      if (!el) return null;
+      
+      const idParts = el.id.split('-');
+      return { chapter: parseInt(idParts[1], 10), paragraph: parseInt(idParts[3], 10) };
+  };
+
   const updatePosition = async (page) => {
       if (!book) return;
-      const progress = (page / totalPages) * 100;
+      // Прогресс считает сервер по числу слов; последняя страница - конец книги
+      // Пока догружаются главы, последняя страница - еще не конец книги
+      const position = chaptersLoaded && totalPages > 1 && page >= totalPages - 1
+          ? { chapter: chaptersInfo.length }
+          : paragraphOnPage(page);
+      if (!position) return;
       try {
-          await api.put(`/api/user-books/${book.id}/position`, {
-              current_position: page,
-              progress_percent: progress
-          });
+          await api.put(`/api/user-books/${book.id}/position`, position);
       } catch (err) { console.error(err); }
   };
 
@@ -552,7 +640,7 @@ const Reader = ({ darkMode, setDarkMode }) => {
       }}>
           <div 
              ref={contentRef}
-             onClick={spritzSelectMode ? handleParagraphClick : undefined}
+             onClick={spritzSelectMode ? handleParagraphClick : handleContentClick}
              style={{
                  height: '100%',
                  width: '100%',
@@ -585,6 +673,7 @@ const Reader = ({ darkMode, setDarkMode }) => {
             left: 0, width: '30%', zIndex: 10 
           }} 
           onClick={(e) => { 
+            if (noteAtPoint(e)) return;
             // Проверяем, не выделяется ли сейчас текст
             const selection = window.getSelection();
             if (!selection || selection.toString().trim().length === 0) {
@@ -600,6 +689,7 @@ const Reader = ({ darkMode, setDarkMode }) => {
             right: 0, width: '30%', zIndex: 10 
           }} 
           onClick={(e) => { 
+            if (noteAtPoint(e)) return;
             // Проверяем, не выделяется ли сейчас текст
             const selection = window.getSelection();
             if (!selection || selection.toString().trim().length === 0) {
@@ -658,9 +748,9 @@ const Reader = ({ darkMode, setDarkMode }) => {
       </div>
 
       {/* Spritz Reader Overlay */}
-      {spritzMode && rawChapters.length > 0 && (
+      {spritzMode && spritz && spritz.chapter === currentChapterIndex && (
           <SpritzReader
-              content={rawChapters[currentChapterIndex]?.content || ''}
+              stream={spritz.stream}
               title={rawChapters[currentChapterIndex]?.title || ''}
               darkMode={darkMode}
               onComplete={handleSpritzComplete}
@@ -701,6 +791,29 @@ const Reader = ({ darkMode, setDarkMode }) => {
           </div>
       )}
 
+      {/* Note Modal */}
+      {noteHtml && (
+          <div 
+              style={{
+                  position: 'fixed', top: 0, left: 0, right: 0, bottom: 0,
+                  background: 'rgba(0,0,0,0.8)', zIndex: 200,
+                  display: 'flex', alignItems: 'center', justifyContent: 'center',
+                  padding: '20px'
+              }}
+              onClick={() => setNoteHtml(null)}
+          >
+              <div 
+                  style={{
+                      background: theme.surface1, padding: '20px 24px', borderRadius: '12px',
+                      maxWidth: '480px', width: '100%', maxHeight: '60vh', overflowY: 'auto',
+                      color: theme.textPrimary, fontSize: `${Math.round(fontSize * 0.9)}px`, lineHeight: '1.5'
+                  }}
+                  onClick={e => e.stopPropagation()}
+                  dangerouslySetInnerHTML={{ __html: noteHtml }}
+              />
+          </div>
+      )}
+
       {/* Go To Page Modal */}
       {showPageModal && (
           <div 
@@ -1,8 +1,10 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { Play, Pause, X } from 'lucide-react';
 import { getTheme } from '../../utils/theme';
+import { WEIGHT_MASK, NUMBER_FLAG } from '../../services/spritz';
 
-const SpritzReader = ({ content, title, darkMode, onComplete, onClose, initialIndex = 0 }) => {
+// stream - слова главы от сервера (services/spritz.js): ORP и паузы уже посчитаны
+const SpritzReader = ({ stream, title, darkMode, onComplete, onClose, initialIndex = 0 }) => {
   const theme = getTheme(darkMode);
   const [isPlaying, setIsPlaying] = useState(false);
   const [currentIndex, setCurrentIndex] = useState(initialIndex);
@@ -11,21 +13,26 @@ const SpritzReader = ({ content, title, darkMode, onComplete, onClose, initialIn
   const [pauseOnPunctuation, setPauseOnPunctuation] = useState(true);
   const [pauseOnNumbers, setPauseOnNumbers] = useState(true);
   const [timeSpent, setTimeSpent] = useState(0);
-  const [words, setWords] = useState([]);
   const intervalRef = useRef(null);
+  const wordCount = stream ? stream.count : 0;
+
+  // Слова с нулевым весом - разметка (маркеры подзаголовков), их пропускаем
+  const nextVisible = (index) => {
+    let i = index;
+    while (i < wordCount - 1 && stream.weights[i] === 0) i++;
+    return i;
+  };
 
   useEffect(() => {
-    if (content) {
-      const wordArray = content.split(/\s+/).filter(w => w.length > 0);
-      setWords(wordArray);
-      setCurrentIndex(initialIndex);
+    if (stream) {
+      setCurrentIndex(nextVisible(Math.min(initialIndex, Math.max(0, wordCount - 1))));
       setIsPlaying(false);
       setTimeSpent(0);
     }
-  }, [content]);
+  }, [stream]);
 
   const handleClose = () => {
-      onClose(currentIndex, words.length);
+      onClose(currentIndex, wordCount);
   };
 
   useEffect(() => {
@@ -46,33 +53,27 @@ const SpritzReader = ({ content, title, darkMode, onComplete, onClose, initialIn
 
   useEffect(() => {
     let timeoutId;
-    if (isPlaying && words.length > 0) {
-      const currentWord = words[currentIndex];
+    if (isPlaying && wordCount > 0) {
+      // Множитель паузы посчитан на сервере: конец предложения, запятая, конец абзаца
+      const weight = stream.weights[currentIndex];
       let delay = 60000 / wpm;
 
-      // Calculate delay multiplier based on word content
-      if (currentWord) {
-        if (pauseOnPunctuation) {
-          if (/[.!?]+("|»)?$/.test(currentWord)) {
-            delay *= 2.5; // End of sentence
-          } else if (/[,:;]+("|»)?$/.test(currentWord)) {
-            delay *= 1.5; // Clause break
-          }
-        }
-        
-        if (pauseOnNumbers && /\d/.test(currentWord)) {
-          delay = Math.max(delay, (60000 / wpm) * 2); // Numbers
-        }
+      if (pauseOnPunctuation) {
+        delay *= (weight & WEIGHT_MASK) / 10;
+      }
+
+      if (pauseOnNumbers && (weight & NUMBER_FLAG)) {
+        delay = Math.max(delay, (60000 / wpm) * 2); // Numbers
       }
 
       timeoutId = setTimeout(() => {
         setCurrentIndex(prev => {
-          if (prev >= words.length - 1) {
+          if (prev >= wordCount - 1) {
             setIsPlaying(false);
             if (onComplete) onComplete();
             return prev;
           }
-          return prev + 1;
+          return nextVisible(prev + 1);
         });
       }, delay);
     }
@@ -82,11 +83,10 @@ const SpritzReader = ({ content, title, darkMode, onComplete, onClose, initialIn
         clearTimeout(timeoutId);
       }
     };
-  }, [isPlaying, wpm, words, currentIndex, pauseOnPunctuation, pauseOnNumbers]);
+  }, [isPlaying, wpm, stream, currentIndex, pauseOnPunctuation, pauseOnNumbers]);
 
-  const currentWord = words[currentIndex] || '';
-  // Используем формулу из примера: round((length + 1) * 0.4) - 1
-  const orp = Math.max(0, Math.round((currentWord.length + 1) * 0.4) - 1);
+  const currentWord = wordCount > 0 ? stream.word(currentIndex) : '';
+  const orp = wordCount > 0 ? stream.orp[currentIndex] : 0;
 
   return (
     <div
@@ -254,7 +254,7 @@ const SpritzReader = ({ content, title, darkMode, onComplete, onClose, initialIn
           zIndex: 110
       }}>
         <div style={{ marginBottom: '20px', color: theme.textSecondary, fontSize: '14px' }}>
-          {currentIndex + 1} / {words.length} слов
+          {currentIndex + 1} / {wordCount} слов
         </div>
 
         <div style={{ display: 'flex', gap: '12px', marginBottom: '30px' }}>
@@ -419,7 +419,7 @@ const SpritzReader = ({ content, title, darkMode, onComplete, onClose, initialIn
         >
           <div
             style={{
-              width: `${((currentIndex + 1) / words.length) * 100}%`,
+              width: `${wordCount ? ((currentIndex + 1) / wordCount) * 100 : 0}%`,
               height: '100%',
               background: theme.accent,
               borderRadius: '2px',
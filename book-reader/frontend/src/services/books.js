@@ -1,29 +1,92 @@
 import api from './api';
+import { decodeSpritz } from './spritz';
+
+// Токен для ссылок на обложки и иллюстрации: <img> не передает заголовок Authorization
+let mediaToken = null;
+let mediaTokenRequest = null;
 
 export const getBooksService = {
+  // Обновляет токен заранее, за минуту до истечения срока
+  async loadMediaToken() {
+    if (mediaToken && mediaToken.expires * 1000 - Date.now() > 60000) return mediaToken.token;
+    if (!mediaTokenRequest) {
+      mediaTokenRequest = api.get('/api/books/media-token')
+        .then((response) => { mediaToken = response.data; return mediaToken.token; })
+        .finally(() => { mediaTokenRequest = null; });
+    }
+    return mediaTokenRequest;
+  },
+
   async getAll(status = null) {
     const params = status ? { status } : {};
-    const response = await api.get('/api/books/', { params });
+    const [response] = await Promise.all([api.get('/api/books/', { params }), this.loadMediaToken()]);
     return response.data;
   },
 
+  // Страница библиотеки: { items, nextCursor }, nextCursor = null на последней странице
+  async getPage({ status = null, limit = 50, cursor = null, fields = null } = {}) {
+    const params = { limit };
+    if (status) params.status = status;
+    if (cursor) params.cursor = cursor;
+    if (fields) params.fields = fields;
+    const [response] = await Promise.all([api.get('/api/books/', { params }), this.loadMediaToken()]);
+    return {
+      items: response.data,
+      nextCursor: response.headers['x-next-cursor'] || null,
+    };
+  },
+
   async getReading() {
-    const response = await api.get('/api/books/reading');
+    const [response] = await Promise.all([api.get('/api/books/reading'), this.loadMediaToken()]);
     return response.data;
   },
 
   async getById(bookId) {
-    const response = await api.get(`/api/books/${bookId}`);
+    const [response] = await Promise.all([api.get(`/api/books/${bookId}`), this.loadMediaToken()]);
     return response.data;
   },
 
-  async getContent(bookId, chapter = 0) {
-    const response = await api.get(`/api/books/${bookId}/content`, {
-      params: { chapter }
+  async getToc(bookId) {
+    const response = await api.get(`/api/books/${bookId}/toc`);
+    return response.data;
+  },
+
+  async getChapters(bookId, chapter, window = 0) {
+    const response = await api.get(`/api/books/${bookId}/chapters/${chapter}`, {
+      params: { window }
     });
     return response.data;
   },
 
+  // Примечания книги: { id: блоки }, ссылки на них в тексте - разметка "a" с href "#id"
+  async getNotes(bookId) {
+    const response = await api.get(`/api/books/${bookId}/notes`);
+    return response.data;
+  },
+
+  // Позиция в книге: { position } или { chapter, paragraph, word } -> оба представления и прогресс
+  async resolvePosition(bookId, params) {
+    const response = await api.get(`/api/books/${bookId}/position`, { params });
+    return response.data;
+  },
+
+  // Слова главы для Spritz с ORP и паузами, посчитанными на сервере
+  async getSpritz(bookId, chapter) {
+    const response = await api.get(`/api/books/${bookId}/spritz/${chapter}`, {
+      responseType: 'arraybuffer'
+    });
+    return decodeSpritz(response.data);
+  },
+
+  // Ссылки на обложки и иллюстрации действительны после загрузки токена (getAll, getPage, getReading, getById)
+  getCoverUrl(bookId, size = 'medium') {
+    return `${api.defaults.baseURL}/api/books/${bookId}/cover?size=${size}&token=${mediaToken?.token ?? ''}`;
+  },
+
+  getImageUrl(bookId, imageId) {
+    return `${api.defaults.baseURL}/api/books/${bookId}/images/${encodeURIComponent(imageId)}?token=${mediaToken?.token ?? ''}`;
+  },
+
   async addBook(file) {
     const formData = new FormData();
     formData.append('file', file);
@@ -0,0 +1,61 @@
+// Разбор упакованного потока слов главы (формат описан в backend/app/services/spritz_store.py).
+// Массивы - представления над тем же ArrayBuffer, без копирования и без split текста.
+
+const HEADER_SIZE = 20;
+const MAGIC = 'SPZ1';
+
+// Младшие 7 бит веса - множитель паузы в десятых, старший бит - в слове есть цифры
+export const WEIGHT_MASK = 0x7f;
+export const NUMBER_FLAG = 0x80;
+
+export const decodeSpritz = (buffer) => {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(
+    view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3)
+  );
+  if (magic !== MAGIC) {
+    throw new Error('Unsupported spritz stream');
+  }
+
+  const count = view.getUint32(4, true);
+  const paragraphs = view.getUint32(8, true);
+  const textSize = view.getUint32(12, true);
+  const totalWeight = view.getUint32(16, true);
+
+  let offset = HEADER_SIZE;
+  const paragraphStarts = new Uint32Array(buffer, offset, paragraphs);
+  offset += paragraphs * 4;
+  const lengths = new Uint16Array(buffer, offset, count);
+  offset += count * 2;
+  const orp = new Uint8Array(buffer, offset, count);
+  offset += count;
+  const weights = new Uint8Array(buffer, offset, count);
+  offset += count;
+  const text = new TextDecoder().decode(new Uint8Array(buffer, offset, textSize));
+
+  // Начала слов в строке: слова разделены одним пробелом
+  const starts = new Uint32Array(count);
+  for (let i = 1; i < count; i++) {
+    starts[i] = starts[i - 1] + lengths[i - 1] + 1;
+  }
+
+  return {
+    count,
+    paragraphStarts,
+    orp,
+    weights,
+    totalWeight,
+    word: (i) => text.substr(starts[i], lengths[i]),
+    // Номер абзаца, в котором находится слово
+    paragraphOf: (wordIndex) => {
+      let lo = 0;
+      let hi = paragraphStarts.length - 1;
+      while (lo < hi) {
+        const mid = (lo + hi + 1) >> 1;
+        if (paragraphStarts[mid] <= wordIndex) lo = mid;
+        else hi = mid - 1;
+      }
+      return Math.max(0, lo);
+    },
+  };
+};
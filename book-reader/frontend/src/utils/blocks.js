@@ -0,0 +1,105 @@
+// HTML главы из блоков (формат описан в backend/app/services/chapter_blocks.py).
+// Блок - [тип, текст] или [тип, текст, разметка], номер блока - номер абзаца в id.
+
+const ESCAPES = { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' };
+
+export const escapeHtml = (text) => text.replace(/[&<>"']/g, (c) => ESCAPES[c]);
+
+const MARK_TAGS = { strong: 'strong', em: 'em', s: 's', sub: 'sub', sup: 'sup', code: 'code' };
+
+const openTag = ([, , mark, href]) => {
+  if (mark === 'a') {
+    // Ссылка на примечание - #id из /notes, внешние ссылки открываются в новой вкладке
+    if (href.startsWith('#')) {
+      return `<a class="reader-note" data-note="${escapeHtml(href.slice(1))}" style="color: inherit; opacity: 0.7; cursor: pointer;">`;
+    }
+    if (/^https?:\/\//i.test(href)) {
+      return `<a href="${escapeHtml(href)}" target="_blank" rel="noopener noreferrer" style="color: inherit;">`;
+    }
+    return '<span>';
+  }
+  return `<${MARK_TAGS[mark] || 'span'}>`;
+};
+
+const closeTag = ([, , mark, href]) => {
+  if (mark === 'a') {
+    return href.startsWith('#') || /^https?:\/\//i.test(href) ? '</a>' : '</span>';
+  }
+  return `</${MARK_TAGS[mark] || 'span'}>`;
+};
+
+// Отрезки разметки могут вкладываться и пересекаться: текст режется по их границам,
+// каждый кусок оборачивается в отрезки, которые его покрывают
+export const renderInline = (text, spans) => {
+  if (!spans) return escapeHtml(text);
+
+  const points = new Set([0, text.length]);
+  spans.forEach(([start, end]) => { points.add(start); points.add(end); });
+  const bounds = [...points].sort((a, b) => a - b);
+
+  let html = '';
+  for (let i = 0; i < bounds.length - 1; i++) {
+    const from = bounds[i];
+    const to = bounds[i + 1];
+    const active = spans.filter(([start, end]) => start <= from && end >= to);
+    html += active.map(openTag).join('')
+      + escapeHtml(text.slice(from, to))
+      + active.map(closeTag).reverse().join('');
+  }
+  return html;
+};
+
+// Подзаголовки вложенных секций: символ и отступ по глубине
+const HEADING_STYLES = {
+  h1: { symbol: '§', fontSize: '1em', marginTop: '1.5em', indent: '0em' },
+  h2: { symbol: '◆', fontSize: '1em', marginTop: '1.2em', indent: '1em' },
+  h3: { symbol: '●', fontSize: '0.95em', marginTop: '1em', indent: '2em' },
+  h4: { symbol: '◦', fontSize: '0.95em', marginTop: '0.8em', indent: '3em' },
+};
+
+// Класс reader-paragraph - блоки со словами, их можно выбрать для Spritz
+const BLOCK_STYLES = {
+  p: ['reader-paragraph', 'margin-bottom: 0.8em; text-align: justify; text-indent: 1.5em;'],
+  subtitle: ['reader-paragraph', 'margin: 1em 0 0.6em; text-align: center; text-indent: 0; font-weight: 600; break-after: avoid;'],
+  epigraph: ['reader-paragraph', 'margin: 0 0 0.4em 30%; text-align: left; text-indent: 0; font-size: 0.9em; font-style: italic;'],
+  cite: ['reader-paragraph', 'margin: 0 1.5em 0.8em; text-align: justify; text-indent: 0; font-size: 0.95em;'],
+  verse: ['reader-paragraph', 'margin: 0 0 0 2em; text-align: left; text-indent: 0;'],
+  author: ['reader-paragraph', 'margin-bottom: 0.8em; text-align: right; text-indent: 0; font-size: 0.9em; font-style: italic;'],
+};
+
+const renderBlock = (block, id, imageUrl) => {
+  const [kind, text, spans] = block;
+  const idAttr = id ? ` id="${id}"` : '';
+
+  if (kind === 'empty') {
+    return `<p${idAttr} class="reader-empty" style="margin: 0; height: 0.8em;"></p>`;
+  }
+  if (kind === 'image') {
+    if (!imageUrl) return `<p${idAttr} class="reader-empty" style="margin: 0;"></p>`;
+    return `<p${idAttr} class="reader-image" style="margin: 0.8em 0; text-align: center; text-indent: 0; break-inside: avoid;">`
+      + `<img src="${escapeHtml(imageUrl(text))}" alt="" style="max-width: 100%; max-height: 70vh;"></p>`;
+  }
+
+  const heading = HEADING_STYLES[kind];
+  if (heading) {
+    return `<p${idAttr} class="reader-subheader" style="
+        margin: ${heading.marginTop} 0 0.6em 0;
+        padding-left: ${heading.indent};
+        text-align: left;
+        font-size: ${heading.fontSize};
+        font-weight: 600;
+        opacity: 0.5;
+        text-indent: 0;
+        break-after: avoid;
+    "><span style="font-family: monospace; font-weight: 700;">${heading.symbol}</span> ${renderInline(text, spans)}</p>`;
+  }
+
+  const [className, style] = BLOCK_STYLES[kind] || BLOCK_STYLES.p;
+  return `<p${idAttr} class="${className}" style="${style}">${renderInline(text, spans)}</p>`;
+};
+
+// idPrefix - id главы (абзацы получают id вида chapter-3-p-12), без него id не ставятся
+export const renderBlocks = (blocks, { idPrefix = null, imageUrl = null } = {}) =>
+  blocks
+    .map((block, index) => renderBlock(block, idPrefix ? `${idPrefix}-p-${index}` : null, imageUrl))
+    .join('');